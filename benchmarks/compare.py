@@ -0,0 +1,45 @@
+"""Compare two JSON reports from benchmarks.suite.
+
+    $ python -m benchmarks.compare before.json after.json
+
+Prints the change in ns/op and allocated bytes/op for every benchmark that
+appears in both reports. Negative changes are improvements.
+"""
+import argparse
+import json
+
+
+def _load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return {r['name']: r for r in report['results']}
+
+
+def _change(before, after):
+    if not before:
+        return '      n/a'
+    return '{:>+8.1f}%'.format((after - before) * 100 / before)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    before = _load(args.before)
+    after = _load(args.after)
+    print('{:<30} {:>12} {:>12} {:>9} {:>9}'.format(
+        'benchmark', 'ns/op', 'ns/op', 'time', 'alloc'))
+    for name in before:
+        if name not in after:
+            continue
+        old, new = before[name], after[name]
+        print('{:<30} {:>12,.0f} {:>12,.0f} {} {}'.format(
+            name, old['ns_per_op'], new['ns_per_op'],
+            _change(old['ns_per_op'], new['ns_per_op']),
+            _change(old['alloc_bytes_per_op'], new['alloc_bytes_per_op'])))
+
+
+if __name__ == '__main__':
+    main()
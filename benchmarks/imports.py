@@ -0,0 +1,68 @@
+"""Time importing statsd and the default clients, in a fresh interpreter.
+
+Run from the repository root with::
+
+    $ python -m benchmarks.imports
+    $ python -m benchmarks.imports --repeat 50
+
+Every import is timed in a new ``python -X importtime`` process, so nothing
+is cached in ``sys.modules``, and the median of all runs is reported.
+``statsd.defaults.django`` is only timed if Django is installed.
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+
+
+MODULES = ['statsd', 'statsd.client', 'statsd.defaults.env']
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def _setup(module):
+    if module == 'statsd.defaults.django':
+        return ('import django; from django.conf import settings; '
+                'settings.configure(); ')
+    return ''
+
+
+def time_import(module, env):
+    """Return the microseconds spent importing `module` and its imports."""
+    code = _setup(module) + 'import ' + module
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          env=env, stderr=subprocess.PIPE, check=True,
+                          universal_newlines=True)
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise ValueError('no import time for {}'.format(module))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='processes per module (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    modules = list(MODULES)
+    if importlib.util.find_spec('django') is not None:
+        modules.append('statsd.defaults.django')
+    env = _env()
+    for module in modules:
+        times = [time_import(module, env) for _ in range(args.repeat)]
+        print('{:<25} {:>8,.1f} ms (median) {:>8,.1f} ms (min)'.format(
+            module, statistics.median(times) / 1000, min(times) / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Time Pipeline.send() for pipelines of various sizes.
+
+Run from the repository root with::
+
+    $ python -m benchmarks.pipeline
+"""
+import timeit
+
+from statsd import StatsClient
+
+
+class NullSocket:
+    def sendto(self, data, addr):
+        pass
+
+    def close(self):
+        pass
+
+
+def bench(size, number):
+    """Return the seconds spent per pipeline, in total and in send()."""
+    client = StatsClient()
+    client._sock = NullSocket()
+    names = ['pipeline.bench.%d' % (i % 100) for i in range(size)]
+    pipes = []
+
+    def _fill():
+        pipe = client.pipeline()
+        for name in names:
+            pipe.incr(name)
+        pipes.append(pipe)
+
+    def _send():
+        pipes.pop().send()
+
+    fill = min(timeit.repeat(_fill, number=number, repeat=5))
+    pipes.clear()
+    for _ in range(number):
+        _fill()
+    send = timeit.timeit(_send, number=number)
+    return (fill + send) / number, send / number
+
+
+def main():
+    for size, number in ((10, 10000), (1000, 100), (100000, 1)):
+        total, send = bench(size, number)
+        print('{:>7} stats: {:>8.1f} ns/stat total {:>8.1f} ns/stat in '
+              'send()'.format(size, total * 1e9 / size, send * 1e9 / size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""Measure the per-call cost of every client, stat type and transport.
+
+Everything runs locally: each client sends to a statsd.server.StatsServer
+in this process. Run from the repository root with::
+
+    $ python -m benchmarks.suite
+    $ python -m benchmarks.suite --json results.json
+    $ python -m benchmarks.suite --quick -k udp.incr -k tcp.
+
+For every benchmark this reports calls per second, nanoseconds per call, the
+peak memory allocated during one call (as traced by tracemalloc), and the
+packets, bytes and lines the server received. The JSON output can be compared
+across releases with ``python -m benchmarks.compare``.
+
+Requires Python 3.9 or later.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import statsd
+from statsd import (
+    AsyncStatsClient,
+    AsyncTCPStatsClient,
+    BufferedStatsClient,
+    StatsClient,
+    TCPStatsClient,
+    ThreadedStatsClient,
+    UnixDatagramStatsClient,
+    UnixSocketStatsClient,
+)
+from statsd.server import StatsServer
+
+
+def _udp(server):
+    return StatsClient(*server.udp_address)
+
+
+def _tcp(server):
+    return TCPStatsClient(*server.tcp_address)
+
+
+def _unix(server):
+    return UnixSocketStatsClient(server.unix_path)
+
+
+def _unix_dgram(server):
+    return UnixDatagramStatsClient(server.unix_dgram_path)
+
+
+def _buffered(server):
+    return BufferedStatsClient(_udp(server))
+
+
+def _threaded(server):
+    return ThreadedStatsClient(_udp(server))
+
+
+async def _async_udp(server):
+    client = AsyncStatsClient(*server.udp_address)
+    await client.connect()
+    return client
+
+
+async def _async_tcp(server):
+    client = AsyncTCPStatsClient(*server.tcp_address)
+    await client.connect()
+    return client
+
+
+# name: (server transport, client factory)
+CLIENTS = {
+    'udp': ('udp', _udp),
+    'tcp': ('tcp', _tcp),
+    'unix': ('unix', _unix),
+    'unix_dgram': ('unix_dgram', _unix_dgram),
+    'buffered': ('udp', _buffered),
+    'threaded': ('udp', _threaded),
+    'async_udp': ('udp', _async_udp),
+    'async_tcp': ('tcp', _async_tcp),
+}
+
+
+def _pipeline(size):
+    names = ['bench.pipeline.%d' % i for i in range(size)]
+
+    def _op(client):
+        def _send():
+            with client.pipeline() as pipe:
+                for name in names:
+                    pipe.incr(name)
+        return _send
+    return _op
+
+
+def _timing_loop(size):
+    values = [i * 0.25 for i in range(size)]
+
+    def _op(client):
+        def _send():
+            with client.pipeline() as pipe:
+                for value in values:
+                    pipe.timing('bench.timing', value)
+        return _send
+    return _op
+
+
+def _timing_many(size):
+    values = [i * 0.25 for i in range(size)]
+
+    def _op(client):
+        return lambda: client.timing_many('bench.timing', values)
+    return _op
+
+
+def _timer_decorator(client):
+    @client.timer('bench.timer')
+    def _timed():
+        pass
+    return _timed
+
+
+def _timer_context(client):
+    def _timed():
+        with client.timer('bench.timer'):
+            pass
+    return _timed
+
+
+def _timer_reused(client):
+    timer = client.timer('bench.timer')
+
+    def _timed():
+        with timer:
+            pass
+    return _timed
+
+
+# name: (function returning a callable for a client, stats per call)
+OPERATIONS = {
+    'incr': (lambda c: lambda: c.incr('bench.incr'), 1),
+    'timing': (lambda c: lambda: c.timing('bench.timing', 12.5), 1),
+    'gauge': (lambda c: lambda: c.gauge('bench.gauge', 42), 1),
+    'set': (lambda c: lambda: c.set('bench.set', 'member'), 1),
+    'pipeline_10': (_pipeline(10), 10),
+    'pipeline_100': (_pipeline(100), 100),
+    'pipeline_1000': (_pipeline(1000), 1000),
+    'timing_loop_1000': (_timing_loop(1000), 1000),
+    'timing_many_1000': (_timing_many(1000), 1000),
+    'timer_decorator': (_timer_decorator, 1),
+    'timer_context': (_timer_context, 1),
+    'timer_reused': (_timer_reused, 1),
+}
+
+
+def _time(func, min_time, repeat):
+    """Return the best time for one call of `func`, in seconds."""
+    number = 1
+    while timeit.timeit(func, number=number) < min_time:
+        number *= 2
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def _peak_alloc(func, samples=20):
+    """Return the median peak memory allocated by one call of `func`."""
+    tracemalloc.start()
+    try:
+        func()
+        peaks = []
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def _flush(client):
+    """Flush clients that buffer stats."""
+    flush = getattr(client, 'flush', None)
+    if flush is not None:
+        flush()
+
+
+def _server(transport, tmpdir):
+    if transport in ('unix', 'unix_dgram'):
+        return StatsServer(**{transport: os.path.join(tmpdir, 'statsd.sock')})
+    return StatsServer(**{transport: ('127.0.0.1', 0)})
+
+
+def _wait_idle(server, quiet=0.05, timeout=5):
+    """Wait until the server hasn't received anything for `quiet` seconds."""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        current = server.snapshot()['bytes']
+        if current == last:
+            return
+        last = current
+        time.sleep(quiet)
+
+
+def run_one(client_name, op_name, min_time=0.02, repeat=5):
+    transport, factory = CLIENTS[client_name]
+    make_op, stats_per_call = OPERATIONS[op_name]
+    tmpdir = tempfile.mkdtemp()
+    server = _server(transport, tmpdir).start()
+    loop = None
+    try:
+        client = factory(server)
+        if asyncio.iscoroutine(client):
+            loop = asyncio.new_event_loop()
+            client = loop.run_until_complete(client)
+        op = make_op(client)
+        seconds = _time(op, min_time, repeat)
+        alloc = _peak_alloc(op)
+
+        # Measure what actually goes over the wire separately, with a known
+        # number of calls.
+        _flush(client)
+        _wait_idle(server)
+        server.flush()
+        calls = 1000
+        for _ in range(calls):
+            op()
+        _flush(client)
+        if loop is not None:
+            loop.run_until_complete(asyncio.sleep(0.01))
+        _wait_idle(server)
+        received = server.snapshot()
+        client.close()
+    finally:
+        if loop is not None:
+            loop.close()
+        server.stop()
+        os.rmdir(tmpdir)
+
+    packets = received['packets']
+    return {
+        'name': '{}.{}'.format(client_name, op_name),
+        'client': client_name,
+        'operation': op_name,
+        'stats_per_call': stats_per_call,
+        'ops_per_sec': 1 / seconds,
+        'ns_per_op': seconds * 1e9,
+        'ns_per_stat': seconds * 1e9 / stats_per_call,
+        'alloc_bytes_per_op': alloc,
+        'calls': calls,
+        'packets': packets,
+        'bytes_per_packet': received['bytes'] / packets if packets else 0,
+        'lines_received': received['lines'],
+        'lines_per_packet': received['lines'] / packets if packets else 0,
+        'lines_dropped': received['dropped'],
+    }
+
+
+def run(patterns=(), min_time=0.02, repeat=5):
+    results = []
+    for client_name in CLIENTS:
+        for op_name in OPERATIONS:
+            name = '{}.{}'.format(client_name, op_name)
+            if patterns and not any(p in name for p in patterns):
+                continue
+            result = run_one(client_name, op_name, min_time, repeat)
+            print('{name:<30} {ops_per_sec:>12,.0f} ops/s '
+                  '{ns_per_op:>12,.0f} ns/op {alloc_bytes_per_op:>8,.0f} B/op '
+                  '{bytes_per_packet:>8,.0f} B/packet'.format(**result),
+                  file=sys.stderr)
+            results.append(result)
+    return {
+        'meta': {
+            'statsd': statsd.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--json', metavar='FILE',
+                        help='write results to FILE as JSON')
+    parser.add_argument('-k', dest='patterns', action='append', default=[],
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true',
+                        help='shorter, noisier runs')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        report = run(args.patterns, min_time=0.005, repeat=3)
+    else:
+        report = run(args.patterns)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measure what timing a block of code costs, without any I/O.
+
+Run from the repository root with::
+
+    $ python -m benchmarks.timer
+
+Stats go to a client that throws them away, so only the time and memory
+spent by the Timer and by formatting the stat are measured. Each way of
+timing is measured at the default precision and with ``precision=0``, next
+to a plain timing() call.
+"""
+import argparse
+
+from statsd.client.base import StatsClientBase
+
+from .suite import _peak_alloc, _time
+
+
+class NullClient(StatsClientBase):
+    """A client that formats stats and throws them away."""
+
+    def __init__(self, prefix=None):
+        self._prefix = prefix
+
+    def _after(self, data):
+        pass
+
+
+def _decorator(client, precision):
+    @client.timer('bench.timer', precision=precision)
+    def _timed():
+        pass
+    return _timed
+
+
+def _context(client, precision):
+    def _timed():
+        with client.timer('bench.timer', precision=precision):
+            pass
+    return _timed
+
+
+def _reused(client, precision):
+    timer = client.timer('bench.timer', precision=precision)
+
+    def _timed():
+        with timer:
+            pass
+    return _timed
+
+
+TIMERS = {
+    'decorator': _decorator,
+    'context': _context,
+    'reused': _reused,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='shorter, noisier runs')
+    args = parser.parse_args(argv)
+    min_time, repeat = (0.05, 3) if args.quick else (0.2, 7)
+
+    client = NullClient(prefix='bench')
+    # For comparison: timing() with a value that's already known.
+    funcs = [('timing', lambda: client.timing('bench.timer', 12.5))]
+    for name, make in TIMERS.items():
+        for precision in (6, 0):
+            funcs.append(('{}[{}]'.format(name, precision),
+                          make(client, precision)))
+    for name, func in funcs:
+        print('{:<20} {:>10,.0f} ns/op {:>8,.0f} B/op'.format(
+            name, _time(func, min_time, repeat) * 1e9, _peak_alloc(func)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,30 @@
+from .client import LazyClient
 from .client import StatsClient
 from .client import TCPStatsClient
+from .client import UnixDatagramStatsClient
 from .client import UnixSocketStatsClient
 
 
 VERSION = (4, 0, 1)
 __version__ = '.'.join(map(str, VERSION))
-__all__ = ['StatsClient', 'TCPStatsClient', 'UnixSocketStatsClient']
+__all__ = [
+    'AsyncStatsClient',
+    'AsyncTCPStatsClient',
+    'BufferedStatsClient',
+    'LazyClient',
+    'SharedStatsClient',
+    'StatsClient',
+    'TCPStatsClient',
+    'ThreadedStatsClient',
+    'UnixDatagramStatsClient',
+    'UnixSocketStatsClient',
+]
+
+
+def __getattr__(name):
+    # See statsd.client.__getattr__.
+    from . import client
+    if name in client._LAZY:
+        return getattr(client, name)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
@@ -1,2 +1,25 @@
+import importlib
+
+from .lazy import LazyClient  # noqa
 from .stream import TCPStatsClient, UnixSocketStatsClient  # noqa
-from .udp import StatsClient  # noqa
+from .udp import StatsClient, UnixDatagramStatsClient  # noqa
+
+
+# Clients that need more than the others are only imported for applications
+# that use them: asyncio takes longer to import than everything else, shared
+# needs mmap and fcntl, threaded a queue.
+_LAZY = {
+    'AsyncStatsClient': 'aio',
+    'AsyncTCPStatsClient': 'aio',
+    'BufferedStatsClient': 'buffered',
+    'SharedStatsClient': 'shared',
+    'ThreadedStatsClient': 'threaded',
+}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+    return getattr(importlib.import_module('.' + module, __name__), name)
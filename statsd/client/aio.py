@@ -0,0 +1,194 @@
+import asyncio
+import socket
+
+from . import fork
+from .base import StatsClientBase
+from .stream import StreamPipeline
+from .udp import Pipeline
+
+
+class _ClientProtocol(asyncio.Protocol, asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self._client = client
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        if self._client._transport is self._transport:
+            self._client._transport = None
+
+    def error_received(self, exc):
+        # Datagrams that can't be delivered are dropped, just like the
+        # synchronous StatsClient does.
+        pass
+
+
+class AsyncClientBase(StatsClientBase):
+    """A base class for clients that send stats on an asyncio event loop.
+
+    Sending never blocks or awaits. If the client isn't connected yet, a
+    connection is started in the background and the stat is dropped. If the
+    transport's write buffer has grown past `max_write_buffer` bytes because
+    the server can't keep up, stats are dropped until it drains. Dropped
+    stats are counted in `dropped`.
+    """
+
+    _closed = False
+
+    def close(self):
+        # A connect that's still under way must not leave a transport open
+        # once we're closed.
+        self._closed = True
+        if self._connecting is not None:
+            self._connecting.cancel()
+            self._connecting = None
+        if self._transport is not None:
+            self._transport.close()
+        self._transport = None
+
+    def _after_fork(self):
+        # The transport belongs to the parent's event loop, so leave it
+        # alone and connect again on this process's loop.
+        self._transport = None
+        self._connecting = None
+        self.dropped = 0
+
+    async def connect(self):
+        """Connect, or wait for the connection already being made."""
+        transport = self._transport
+        if transport is not None and not transport.is_closing():
+            return
+        if self._connecting is None:
+            self._start_connect(asyncio.get_running_loop())
+        # Shielded, so cancelling one caller doesn't cancel the connect for
+        # everyone else.
+        await asyncio.shield(self._connecting)
+
+    async def _open(self):
+        """Open and return a new transport."""
+        raise NotImplementedError()
+
+    async def _connect(self):
+        transport = await self._open()
+        if self._closed:
+            transport.close()
+            return
+        if self._transport is not None:
+            # Never leave a transport open behind us.
+            self._transport.close()
+        self._transport = transport
+
+    def _connect_soon(self):
+        if self._connecting is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._start_connect(loop)
+
+    def _start_connect(self, loop):
+        t = self._telemetry
+        if t is not None:
+            t.connects += 1
+        self._closed = False
+        self._connecting = loop.create_task(self._connect())
+        self._connecting.add_done_callback(self._connected)
+
+    def _connected(self, task):
+        if self._connecting is task:
+            self._connecting = None
+        if not task.cancelled():
+            # Retrieve the exception so it isn't logged as unhandled. The
+            # next stat will try again.
+            task.exception()
+
+    def _send(self, data):
+        """Send data to statsd."""
+        transport = self._transport
+        if transport is None:
+            self._connect_soon()
+            self.dropped += 1
+        elif transport.get_write_buffer_size() > self._max_write_buffer:
+            self.dropped += 1
+        else:
+            self._write(transport, data)
+            t = self._telemetry
+            if t is not None:
+                t.packets += 1
+                t.bytes += len(data)
+
+    def _write(self, transport, data):
+        raise NotImplementedError()
+
+
+class AsyncStatsClient(AsyncClientBase):
+    """An asyncio version of StatsClient."""
+
+    def __init__(self, host='localhost', port=8125, prefix=None,
+                 maxudpsize=512, ipv6=False, max_write_buffer=65536):
+        """Create a new client."""
+        self._host = host
+        self._port = port
+        self._ipv6 = ipv6
+        self._prefix = prefix
+        self._maxudpsize = maxudpsize
+        self._max_write_buffer = max_write_buffer
+        self._transport = None
+        self._connecting = None
+        self.dropped = 0
+        fork.register(self)
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        fam = socket.AF_INET6 if self._ipv6 else socket.AF_INET
+        family, _, _, _, addr = (await loop.getaddrinfo(
+            self._host, self._port, family=fam, type=socket.SOCK_DGRAM))[0]
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ClientProtocol(self), remote_addr=addr, family=family)
+        return transport
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def _write(self, transport, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        transport.sendto(data)
+
+
+class AsyncTCPStatsClient(AsyncClientBase):
+    """An asyncio version of TCPStatsClient."""
+
+    def __init__(self, host='localhost', port=8125, prefix=None,
+                 timeout=None, ipv6=False, max_write_buffer=65536):
+        """Create a new client."""
+        self._host = host
+        self._port = port
+        self._ipv6 = ipv6
+        self._timeout = timeout
+        self._prefix = prefix
+        self._max_write_buffer = max_write_buffer
+        self._transport = None
+        self._connecting = None
+        self.dropped = 0
+        fork.register(self)
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        fam = socket.AF_INET6 if self._ipv6 else socket.AF_INET
+        connect = loop.create_connection(
+            lambda: _ClientProtocol(self), self._host, self._port,
+            family=fam)
+        transport, _ = await asyncio.wait_for(connect, self._timeout)
+        return transport
+
+    def pipeline(self):
+        return StreamPipeline(self)
+
+    def _write(self, transport, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        transport.write(b'%s\n' % data)
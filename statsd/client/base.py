@@ -1,13 +1,35 @@
-import random
 from collections import deque
 from datetime import timedelta
 
-from .timer import Timer
+from . import profiling, sampling, telemetry
+from .handles import CounterHandle, GaugeHandle, TimerHandle
+from .timer import Timer, _timing_format
+
+
+def _values(values):
+    # NumPy arrays (and anything else with a dtype) convert themselves to a
+    # list of Python numbers much faster than iterating over them.
+    if hasattr(values, 'dtype') and hasattr(values, 'tolist'):
+        return values.ravel().tolist()
+    return list(values)
+
+
+def _pairs(pairs):
+    if hasattr(pairs, 'items'):
+        return pairs.items()
+    return pairs
 
 
 class StatsClientBase:
     """A Base class for various statsd clients."""
 
+    _telemetry = None
+    _profiler = None
+    # Clients that aggregate stats themselves set this to a method taking
+    # (kind, stat, value, rate, delta), so handles send through it instead
+    # of writing pre-formatted lines.
+    _handle_send = None
+
     def close(self):
         """Used to close and clean up any underlying resources."""
         raise NotImplementedError()
@@ -18,22 +40,96 @@ class StatsClientBase:
     def pipeline(self):
         raise NotImplementedError()
 
-    def timer(self, stat, rate=1):
-        return Timer(self, stat, rate)
+    def timer(self, stat, rate=1, precision=6):
+        return Timer(self, stat, rate, precision)
+
+    def enable_telemetry(self, interval=None, prefix='statsd.client'):
+        """Count what this client does, for stats().
+
+        With an `interval`, the counts are also sent through this client
+        every `interval` seconds, as counters under `prefix`. Clients that
+        wrap another client enable it on that client, too.
+        """
+        if self._telemetry is None:
+            self._telemetry = telemetry.Telemetry()
+        inner = getattr(self, '_client', None)
+        if isinstance(inner, StatsClientBase):
+            inner.enable_telemetry()
+        if interval:
+            telemetry.start(self, interval, prefix)
+
+    def stats(self):
+        """Return a snapshot of this client's counters, as a dict.
+
+        `dropped` and `errors` (by errno) are always included, where the
+        client keeps them. The rest are only counted once
+        enable_telemetry() has been called.
+        """
+        stats = {'dropped': getattr(self, 'dropped', 0)}
+        errors = getattr(self, 'errors', None)
+        if errors is not None:
+            stats['errors'] = dict(errors)
+        if self._telemetry is not None:
+            stats.update(self._telemetry.snapshot())
+        inner = getattr(self, '_client', None)
+        if isinstance(inner, StatsClientBase):
+            stats['client'] = inner.stats()
+        return stats
+
+    def set_profiler(self, profiler):
+        """Time 1 in `profiler.every` stats sent with `profiler`.
+
+        See :mod:`statsd.client.profiling`. Pipelines created afterwards
+        are profiled too, and clients that wrap another client profile that
+        client as well. ``set_profiler(None)`` stops profiling.
+        """
+        if profiler is None:
+            profiling.disable(self)
+        else:
+            profiling.enable(self, profiler)
+        inner = getattr(self, '_client', None)
+        if isinstance(inner, StatsClientBase):
+            inner.set_profiler(profiler)
+
+    def _sampled_out(self, count=1):
+        t = self._telemetry
+        if t is not None:
+            t.sampled += count
+
+    def counter(self, stat, rate=1):
+        """Return a CounterHandle for sending to `stat` repeatedly."""
+        return CounterHandle(self, stat, rate)
+
+    def timer_handle(self, stat, rate=1):
+        """Return a TimerHandle for sending to `stat` repeatedly."""
+        return TimerHandle(self, stat, rate)
+
+    def gauge_handle(self, stat, rate=1):
+        """Return a GaugeHandle for sending to `stat` repeatedly."""
+        return GaugeHandle(self, stat, rate)
 
-    def timing(self, stat, delta, rate=1):
+    def timing(self, stat, delta, rate=1, precision=6):
         """
         Send new timing information.
 
-        `delta` can be either a number of milliseconds or a timedelta.
+        `delta` can be either a number of milliseconds or a timedelta. It is
+        sent with `precision` decimal places.
         """
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
         if isinstance(delta, timedelta):
             # Convert timedelta to number of milliseconds.
             delta = delta.total_seconds() * 1000.
-        self._send_stat(stat, '%0.6f|ms' % delta, rate)
+        if precision == 6:
+            value = '%0.6f|ms' % delta
+        else:
+            value = _timing_format(precision) % delta
+        self._send_stat(stat, value, rate)
 
     def incr(self, stat, count=1, rate=1):
         """Increment a stat by `count`."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
         self._send_stat(stat, '%s|c' % count, rate)
 
     def decr(self, stat, count=1, rate=1):
@@ -42,10 +138,9 @@ class StatsClientBase:
 
     def gauge(self, stat, value, rate=1, delta=False):
         """Set a gauge value."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
         if value < 0 and not delta:
-            if rate < 1:
-                if random.random() > rate:
-                    return
             with self.pipeline() as pipe:
                 pipe._send_stat(stat, '0|g', 1)
                 pipe._send_stat(stat, '%s|g' % value, 1)
@@ -55,15 +150,86 @@ class StatsClientBase:
 
     def set(self, stat, value, rate=1):
         """Set a set value."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
         self._send_stat(stat, '%s|s' % value, rate)
 
+    def timing_many(self, stat, values, rate=1):
+        """Send many timings for `stat` at once.
+
+        `values` is any iterable of numbers of milliseconds, including a
+        NumPy array. They are formatted in one go and sent in a pipeline.
+        """
+        values = self._sample(_values(values), rate)
+        if values:
+            line = self._line_format(stat, '%0.6f|ms', rate) + '\n'
+            self._send_lines((line * len(values))[:-1] % tuple(values))
+
+    def incr_many(self, pairs, rate=1):
+        """Increment many counters at once.
+
+        `pairs` is a mapping or an iterable of (stat, count) pairs.
+        """
+        pairs = self._sample(_pairs(pairs), rate)
+        line = self._line_format(None, '%s|c', rate)
+        self._send_lines('\n'.join([line % (stat, count)
+                                    for stat, count in pairs]))
+
+    def gauge_many(self, pairs, rate=1, delta=False):
+        """Set many gauges at once.
+
+        `pairs` is a mapping or an iterable of (stat, value) pairs.
+        """
+        pairs = self._sample(_pairs(pairs), rate)
+        line = self._line_format(None, '%s|g', rate)
+        lines = []
+        for stat, value in pairs:
+            if delta:
+                if value >= 0:
+                    value = '+%s' % value
+            elif value < 0:
+                # As in gauge(), but the reset goes in the same pipeline.
+                lines.append(line % (stat, 0))
+            lines.append(line % (stat, value))
+        self._send_lines('\n'.join(lines))
+
+    def _sample(self, items, rate):
+        if rate < 1:
+            items = list(items)
+            random = sampling.random
+            kept = [item for item in items if random() <= rate]
+            self._sampled_out(len(items) - len(kept))
+            return kept
+        return items
+
+    def _line_format(self, stat, value, rate):
+        # A %-format for whole lines, with `value` (and `stat`, if it's None)
+        # left to fill in.
+        template = self._format('\0' if stat is None else stat, '\1', rate)
+        return template.replace('%', '%%').replace(
+            '\0', '%s').replace('\1', value)
+
+    def _send_lines(self, text):
+        # Newline-separated lines, packed into as few packets as possible.
+        if text:
+            with self.pipeline() as pipe:
+                pipe._send_lines(text)
+
     def _send_stat(self, stat, value, rate):
-        self._after(self._prepare(stat, value, rate))
+        # Public methods have already made the sampling decision, before
+        # formatting anything.
+        t = self._telemetry
+        if t is not None:
+            t.formatted += 1
+        self._after(self._format(stat, value, rate))
 
     def _prepare(self, stat, value, rate):
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        return self._format(stat, value, rate)
+
+    def _format(self, stat, value, rate):
         if rate < 1:
-            if random.random() > rate:
-                return
             value = '{}|@{}'.format(value, rate)
 
         if self._prefix:
@@ -75,21 +241,39 @@ class StatsClientBase:
         if data:
             self._send(data)
 
+    def _after_many(self, datagrams):
+        """Handle several packed datagrams, returning how many were sent."""
+        for data in datagrams:
+            self._after(data)
+        return len(datagrams)
+
 
 class PipelineBase(StatsClientBase):
 
     def __init__(self, client):
         self._client = client
         self._prefix = client._prefix
+        self._telemetry = client._telemetry
         self._stats = deque()
+        if client._profiler is not None:
+            profiling.enable_pipeline(self, client._profiler)
 
     def _send(self):
         raise NotImplementedError()
 
     def _after(self, data):
         if data is not None:
+            if isinstance(data, str):
+                data = data.encode('ascii')
             self._stats.append(data)
 
+    def _send_lines(self, text):
+        if text:
+            t = self._telemetry
+            if t is not None:
+                t.formatted += text.count('\n') + 1
+            self._stats.extend(text.encode('ascii').split(b'\n'))
+
     def __enter__(self):
         return self
 
@@ -99,7 +283,7 @@ class PipelineBase(StatsClientBase):
     def send(self):
         if not self._stats:
             return
-        self._send()
+        return self._send()
 
     def pipeline(self):
         return self.__class__(self)
@@ -0,0 +1,278 @@
+import atexit
+import threading
+import weakref
+from datetime import timedelta
+from time import monotonic as time_now
+
+from . import fork, sampling
+from .base import StatsClientBase, PipelineBase, _pairs, _values
+from .sketch import QuantileSketch
+
+
+# Weak, so clients that aren't used any more can still be collected.
+_clients = weakref.WeakSet()
+_registered = False
+
+
+def _flush_all():
+    for client in list(_clients):
+        try:
+            client.flush()
+        except Exception:
+            # The wrapped client may be closed already. Flush the rest.
+            pass
+
+
+def _flush_at_exit(client):
+    global _registered
+    _clients.add(client)
+    if not _registered:
+        # Registered with the first client rather than on import, so it
+        # runs before the exit handlers of the modules imported after this
+        # one, like threaded's, which may close the client this one wraps.
+        atexit.register(_flush_all)
+        _registered = True
+
+
+def _run(ref, stop, interval):
+    # The client is only held while flushing, so one that isn't used any
+    # more can still be collected, and its thread ends.
+    while not stop.wait(interval):
+        client = ref()
+        if client is None:
+            return
+        try:
+            if client._size:
+                client.flush()
+        except Exception:
+            # There's no one to raise to from here. Try again next time.
+            pass
+        del client
+
+
+class BufferedPipeline(PipelineBase):
+    def _send(self):
+        while self._stats:
+            self._client._after(self._stats.popleft())
+
+
+class BufferedStatsClient(StatsClientBase):
+    """Aggregate stats in memory and flush them to another client.
+
+    Counters are summed, gauges keep the last value written and set
+    members are deduplicated. Everything else (timers, pipelines) is
+    buffered as-is. Buffered stats are flushed through a pipeline of the
+    wrapped client every `flush_interval` seconds, from a daemon thread, or
+    once `max_buffer` distinct stats are waiting, whichever comes first.
+    Anything still buffered when the interpreter exits is flushed then.
+
+    With `summarize_timers`, timers are summarized in a QuantileSketch
+    instead and sent as gauges: `count`, `min`, `max`, `mean` and one per
+    quantile in `quantiles`, e.g. `p99`.
+    """
+
+    def __init__(self, client, flush_interval=1.0, max_buffer=1000,
+                 summarize_timers=False, quantiles=(0.5, 0.9, 0.99)):
+        """Create a new buffered client wrapping `client`."""
+        self._client = client
+        self._prefix = client._prefix
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._summarize_timers = summarize_timers
+        self._quantiles = [
+            ('p' + ('%g' % (q * 100)).replace('.', '_'), q)
+            for q in quantiles
+        ]
+        self._lock = threading.Lock()
+        self._reset()
+        self._start()
+        _flush_at_exit(self)
+        fork.register(self)
+
+    def _start(self):
+        self._stop = threading.Event()
+        self._thread = None
+        if self._flush_interval > 0:
+            self._thread = threading.Thread(
+                target=_run, daemon=True, name='statsd-buffered',
+                args=(weakref.ref(self), self._stop, self._flush_interval))
+            self._thread.start()
+
+    def _after_fork(self):
+        # Whatever is buffered is the parent's to send. The thread wasn't
+        # copied into this process.
+        self._lock = threading.Lock()
+        self._reset()
+        self._start()
+
+    def _reset(self):
+        self._counters = {}
+        self._gauges = {}
+        self._sets = {}
+        self._timers = {}
+        self._lines = []
+        self._size = 0
+        self._next_flush = time_now() + self._flush_interval
+
+    def close(self):
+        """Flush any buffered stats and close the wrapped client."""
+        _clients.discard(self)
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self._client.close()
+
+    def pipeline(self):
+        return BufferedPipeline(self)
+
+    def incr(self, stat, count=1, rate=1):
+        """Increment a stat by `count`."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        key = (stat, rate)
+        with self._lock:
+            if key in self._counters:
+                self._counters[key] += count
+            else:
+                self._counters[key] = count
+                self._size += 1
+        self._maybe_flush()
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """Set a gauge value."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        with self._lock:
+            current = self._gauges.get(stat)
+            if current is None:
+                self._size += 1
+            elif delta:
+                # Fold deltas into whatever is already buffered. An absolute
+                # gauge stays absolute.
+                value = current[0] + value
+                delta = current[1]
+            self._gauges[stat] = (value, delta)
+        self._maybe_flush()
+
+    def set(self, stat, value, rate=1):
+        """Set a set value."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        with self._lock:
+            members = self._sets.get(stat)
+            if members is None:
+                members = self._sets[stat] = set()
+            value = '%s' % value
+            if value not in members:
+                members.add(value)
+                self._size += 1
+        self._maybe_flush()
+
+    def timing(self, stat, delta, rate=1, precision=6):
+        """
+        Send new timing information.
+
+        `delta` can be either a number of milliseconds or a timedelta.
+        Summarized timers ignore `precision`.
+        """
+        if not self._summarize_timers:
+            return super().timing(stat, delta, rate, precision)
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        if isinstance(delta, timedelta):
+            # Convert timedelta to number of milliseconds.
+            delta = delta.total_seconds() * 1000.
+        with self._lock:
+            sketch = self._timers.get(stat)
+            if sketch is None:
+                sketch = self._timers[stat] = QuantileSketch()
+                self._size += 1
+            # Weight sampled values so the count reflects every call.
+            sketch.add(delta, 1 / rate)
+        self._maybe_flush()
+
+    def _handle_send(self, kind, stat, value, rate, delta=False):
+        if kind == 'c':
+            self.incr(stat, value, rate)
+        elif kind == 'g':
+            self.gauge(stat, value, rate, delta)
+        else:
+            self.timing(stat, value, rate)
+
+    # Bulk stats are aggregated like any others.
+    def timing_many(self, stat, values, rate=1):
+        if not self._summarize_timers:
+            return super().timing_many(stat, values, rate)
+        for value in _values(values):
+            self.timing(stat, value, rate)
+
+    def incr_many(self, pairs, rate=1):
+        for stat, count in _pairs(pairs):
+            self.incr(stat, count, rate)
+
+    def gauge_many(self, pairs, rate=1, delta=False):
+        for stat, value in _pairs(pairs):
+            self.gauge(stat, value, rate, delta)
+
+    def _after(self, data):
+        if data:
+            with self._lock:
+                self._lines.append(data)
+                self._size += 1
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self._size >= self._max_buffer or time_now() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """Send all buffered stats to the wrapped client."""
+        started = time_now()
+        with self._lock:
+            counters = self._counters
+            gauges = self._gauges
+            sets = self._sets
+            timers = self._timers
+            lines = self._lines
+            self._reset()
+
+        pipe = self._client.pipeline()
+        for (stat, rate), count in counters.items():
+            pipe._after(self._format(stat, '%s|c' % count, rate))
+        for stat, (value, delta) in gauges.items():
+            if delta:
+                prefix = '+' if value >= 0 else ''
+                pipe._after(
+                    self._format(stat, '{}{}|g'.format(prefix, value), 1))
+            else:
+                self._flush_gauge(pipe, stat, value)
+        for stat, members in sets.items():
+            for member in members:
+                pipe._after(self._format(stat, '%s|s' % member, 1))
+        for stat, sketch in timers.items():
+            summary = [
+                ('count', round(sketch.count)),
+                ('min', sketch.min),
+                ('max', sketch.max),
+                ('mean', sketch.mean),
+            ]
+            summary.extend((name, sketch.quantile(q))
+                           for name, q in self._quantiles)
+            for name, value in summary:
+                self._flush_gauge(pipe, '{}.{}'.format(stat, name), value)
+        t = self._telemetry
+        if t is not None:
+            # The aggregated lines were formatted just now.
+            t.formatted += len(pipe._stats)
+        for line in lines:
+            pipe._after(line)
+        pipe.send()
+        if t is not None:
+            t.flushed(started)
+
+    def _flush_gauge(self, pipe, stat, value):
+        if value < 0:
+            pipe._after(self._format(stat, '0|g', 1))
+        pipe._after(self._format(stat, '%s|g' % value, 1))
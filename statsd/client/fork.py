@@ -0,0 +1,28 @@
+"""Reset clients in child processes.
+
+A process that forks after creating a client, like the master of a pre-fork
+server, leaves every child with a copy of the client's sockets and buffers.
+Anything the child wrote to the copies would be interleaved with the
+parent's writes, or sent twice. Clients that hold such state register
+themselves here, and their ``_after_fork()`` method is called in the child
+right after every fork.
+"""
+import os
+import weakref
+
+
+_clients = weakref.WeakSet()
+
+
+def register(client):
+    """Call `client._after_fork()` in the child after every fork."""
+    _clients.add(client)
+
+
+def _after_fork():
+    for client in list(_clients):
+        client._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,117 @@
+import copy
+from datetime import timedelta
+
+from . import sampling
+
+
+class Handle:
+    """A stat bound to a client, with its name prepared ahead of time.
+
+    The prefixed name and the type and rate suffix are formatted and
+    encoded once, so sending only has to format the value.
+    """
+
+    suffix = None
+
+    def __init__(self, client, stat, rate=1):
+        self._client = client
+        self.stat = stat
+        self.rate = rate
+        if client._prefix:
+            stat = '{}.{}'.format(client._prefix, stat)
+        self._name = '{}:'.format(stat).encode('ascii')
+        suffix = self.suffix
+        if rate < 1:
+            suffix = '{}|@{}'.format(suffix, rate)
+        self._suffix = suffix.encode('ascii')
+
+    def bind(self, client):
+        """Return a copy of this handle that sends through `client`.
+
+        Useful for sending through a pipeline. `client` should have the same
+        prefix as the original client.
+        """
+        handle = copy.copy(self)
+        handle._client = client
+        return handle
+
+    def _send_value(self, value):
+        if self.rate < 1 and sampling.random() > self.rate:
+            return self._client._sampled_out()
+        t = self._client._telemetry
+        if t is not None:
+            t.formatted += 1
+        self._client._after(
+            self._name + ('%s' % value).encode('ascii') + self._suffix)
+
+
+class CounterHandle(Handle):
+    """A pre-bound counter. See StatsClientBase.counter()."""
+
+    suffix = '|c'
+
+    def incr(self, count=1):
+        """Increment the counter by `count`."""
+        send = self._client._handle_send
+        if send is not None:
+            return send('c', self.stat, count, self.rate)
+        self._send_value(count)
+
+    def decr(self, count=1):
+        """Decrement the counter by `count`."""
+        send = self._client._handle_send
+        if send is not None:
+            return send('c', self.stat, -count, self.rate)
+        self._send_value(-count)
+
+
+class TimerHandle(Handle):
+    """A pre-bound timer. See StatsClientBase.timer_handle()."""
+
+    suffix = '|ms'
+
+    def __init__(self, client, stat, rate=1):
+        super().__init__(client, stat, rate)
+        self._format = (self._name.replace(b'%', b'%%') + b'%0.6f' +
+                        self._suffix.replace(b'%', b'%%'))
+
+    def timing(self, delta):
+        """Send new timing information.
+
+        `delta` can be either a number of milliseconds or a timedelta.
+        """
+        send = self._client._handle_send
+        if send is not None:
+            return send('ms', self.stat, delta, self.rate)
+        if self.rate < 1 and sampling.random() > self.rate:
+            return self._client._sampled_out()
+        if isinstance(delta, timedelta):
+            # Convert timedelta to number of milliseconds.
+            delta = delta.total_seconds() * 1000.
+        t = self._client._telemetry
+        if t is not None:
+            t.formatted += 1
+        self._client._after(self._format % delta)
+
+
+class GaugeHandle(Handle):
+    """A pre-bound gauge. See StatsClientBase.gauge_handle()."""
+
+    suffix = '|g'
+
+    def gauge(self, value, delta=False):
+        """Set the gauge value."""
+        send = self._client._handle_send
+        if send is not None:
+            return send('g', self.stat, value, self.rate, delta)
+        if value < 0 and not delta:
+            if self.rate < 1 and sampling.random() > self.rate:
+                return self._client._sampled_out()
+            with self._client.pipeline() as pipe:
+                pipe._after(self._name + b'0|g')
+                pipe._after(
+                    self._name + ('%s|g' % value).encode('ascii'))
+        elif delta and value >= 0:
+            self._send_value('+%s' % value)
+        else:
+            self._send_value(value)
@@ -0,0 +1,100 @@
+import threading
+
+from .base import StatsClientBase
+
+
+_OWN = ('_cls', '_args', '_kwargs', '_client', '_lock')
+
+# Methods that go straight to the client once it exists.
+_DIRECT = ('incr', 'decr', 'gauge', 'set', 'timing', 'timing_many',
+           'incr_many', 'gauge_many', 'pipeline', '_after', '_after_many')
+
+
+class LazyClient(StatsClientBase):
+    """Create a client the first time it's used.
+
+    `cls` is called with `args` and `kwargs` to create the client as soon as
+    a stat is sent or anything else is done with it, so nothing is looked up
+    or opened until then. timer(), counter() and the other handles can be
+    created without creating the client.
+
+    Once the client exists, the stat methods are looked up on it directly,
+    so sending through a LazyClient costs the same as through the client.
+    """
+
+    def __init__(self, cls, *args, **kwargs):
+        self._cls = cls
+        self._args = args
+        self._kwargs = kwargs
+        self._prefix = kwargs.get('prefix')
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._cls(*self._args, **self._kwargs)
+                    self._prefix = client._prefix
+                    for name in _DIRECT:
+                        setattr(self, name, getattr(client, name))
+                    self._client = client
+        return self._client
+
+    def __getattr__(self, name):
+        # Anything else the client has, like flush() or connect().
+        if name.startswith('__') or name in _OWN:
+            raise AttributeError(name)
+        return getattr(self._get_client(), name)
+
+    def enable_telemetry(self, interval=None, prefix='statsd.client'):
+        # Stats go straight to the client, so it has to do the counting.
+        self._get_client().enable_telemetry(interval, prefix)
+
+    def stats(self):
+        return self._get_client().stats()
+
+    def set_profiler(self, profiler):
+        self._get_client().set_profiler(profiler)
+
+    def close(self):
+        """Close the client, if it was ever created."""
+        if self._client is not None:
+            self._client.close()
+
+    def pipeline(self):
+        return self._get_client().pipeline()
+
+    def timing(self, stat, delta, rate=1, precision=6):
+        self._get_client().timing(stat, delta, rate, precision)
+
+    def incr(self, stat, count=1, rate=1):
+        self._get_client().incr(stat, count, rate)
+
+    def decr(self, stat, count=1, rate=1):
+        self._get_client().decr(stat, count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        self._get_client().gauge(stat, value, rate, delta)
+
+    def set(self, stat, value, rate=1):
+        self._get_client().set(stat, value, rate)
+
+    def timing_many(self, stat, values, rate=1):
+        self._get_client().timing_many(stat, values, rate)
+
+    def incr_many(self, pairs, rate=1):
+        self._get_client().incr_many(pairs, rate)
+
+    def gauge_many(self, pairs, rate=1, delta=False):
+        self._get_client().gauge_many(pairs, rate, delta)
+
+    @property
+    def _handle_send(self):
+        return self._get_client()._handle_send
+
+    def _after(self, data):
+        self._get_client()._after(data)
+
+    def _after_many(self, datagrams):
+        return self._get_client()._after_many(datagrams)
@@ -0,0 +1,153 @@
+"""Find out which stats cost the most to send.
+
+A client's set_profiler() replaces its `_send_stat()`, and the `_send()` of
+its pipelines, with versions that time 1 in every `profiler.every` calls and
+pass the times to the profiler, and sends stats from handles through the
+stat methods so they're timed too. Until then, and after
+``set_profiler(None)``, nothing on the hot path changes.
+
+Any object with the two methods of :class:`Profiler` below can be used::
+
+    sampled()                          # True to time this call
+    record(stat, format_ns, send_ns)   # the times of one sampled call
+
+`send_ns` is the time spent handing the formatted stat to the client; for
+most clients that's the syscall, but pipelines and buffered clients only
+store it, and their sends are recorded under ``PIPELINE``.
+"""
+from time import perf_counter_ns as time_now
+
+
+# The name pipeline sends are recorded under. Packing the stats counts as
+# formatting.
+PIPELINE = '(pipeline)'
+
+
+class Profiler:
+    """Count and time every `every`-th stat, by name.
+
+    Like telemetry, the counts are updated without a lock and may miss the
+    odd call under contention. Counts and times are estimates: the sampled
+    values multiplied by `every`.
+    """
+
+    def __init__(self, every=100):
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        self.every = every
+        self._calls = 0
+        # stat: [sampled calls, format ns, send ns]
+        self._stats = {}
+
+    def sampled(self):
+        self._calls += 1
+        if self._calls >= self.every:
+            self._calls = 0
+            return True
+        return False
+
+    def record(self, stat, format_ns, send_ns):
+        entry = self._stats.get(stat)
+        if entry is None:
+            entry = self._stats.setdefault(stat, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += format_ns
+        entry[2] += send_ns
+
+    def clear(self):
+        self._stats.clear()
+
+    def results(self, top=None):
+        """Return (stat, calls, format ns, send ns) tuples, costliest first.
+
+        `calls` and the times are estimated for every call, sampled or not.
+        """
+        every = self.every
+        results = sorted(
+            ((stat, calls * every, fmt * every, send * every)
+             for stat, (calls, fmt, send) in list(self._stats.items())),
+            key=lambda r: r[2] + r[3], reverse=True)
+        return results[:top] if top else results
+
+    def report(self, top=10):
+        """Return a table of the `top` costliest stats, as a string."""
+        lines = ['{:<40} {:>10} {:>12} {:>8} {:>8}'.format(
+            'stat', 'calls', 'total ms', 'format', 'send')]
+        for stat, calls, fmt, send in self.results(top):
+            total = fmt + send
+            lines.append('{:<40} {:>10,} {:>12,.3f} {:>7.0%} {:>7.0%}'.format(
+                stat, calls, total / 1e6,
+                fmt / total if total else 0, send / total if total else 0))
+        return '\n'.join(lines)
+
+
+def _send_stat(client, profiler):
+    unprofiled = type(client)._send_stat.__get__(client)
+
+    def send_stat(stat, value, rate):
+        if not profiler.sampled():
+            return unprofiled(stat, value, rate)
+        t = client._telemetry
+        if t is not None:
+            t.formatted += 1
+        start = time_now()
+        data = client._format(stat, value, rate)
+        formatted = time_now()
+        client._after(data)
+        profiler.record(stat, formatted - start, time_now() - formatted)
+
+    return send_stat
+
+
+def _handle_send(client):
+    # Handles send formatted lines straight to _after(). While profiling,
+    # they go through the stat methods instead, so they're timed by name.
+    def handle_send(kind, stat, value, rate, delta=False):
+        if kind == 'c':
+            client.incr(stat, value, rate)
+        elif kind == 'g':
+            client.gauge(stat, value, rate, delta)
+        else:
+            client.timing(stat, value, rate)
+
+    return handle_send
+
+
+def _pipeline_send(pipe, profiler):
+    unprofiled = type(pipe)._send.__get__(pipe)
+    pack = getattr(pipe, '_pack', None)
+
+    def send():
+        if not profiler.sampled():
+            return unprofiled()
+        start = time_now()
+        if pack is None:
+            # Packing and sending can't be told apart.
+            sent = unprofiled()
+            profiler.record(PIPELINE, 0, time_now() - start)
+            return sent
+        datagrams = pack()
+        packed = time_now()
+        sent = pipe._client._after_many(datagrams)
+        profiler.record(PIPELINE, packed - start, time_now() - packed)
+        return sent
+
+    return send
+
+
+def enable(client, profiler):
+    client._profiler = profiler
+    client._send_stat = _send_stat(client, profiler)
+    if type(client)._handle_send is None:
+        client._handle_send = _handle_send(client)
+
+
+def disable(client):
+    client.__dict__.pop('_profiler', None)
+    client.__dict__.pop('_send_stat', None)
+    client.__dict__.pop('_handle_send', None)
+
+
+def enable_pipeline(pipe, profiler):
+    enable(pipe, profiler)
+    pipe._send = _pipeline_send(pipe, profiler)
@@ -0,0 +1,153 @@
+"""Resolve statsd hosts, and keep resolving them.
+
+A :class:`Resolver` looks up every address for a host once, when it's
+created, and then again every `ttl` seconds from a single background thread,
+so clients never wait for DNS while sending. Clients asking for the same
+host, port and socket type share one resolver.
+"""
+import socket
+import threading
+import weakref
+from time import monotonic as time_now
+
+from . import fork
+
+
+class Resolver:
+    """The addresses of a host, refreshed every `ttl` seconds.
+
+    `addresses` is a list of (family, sockaddr) tuples, in the order
+    getaddrinfo() returned them. When a refresh finds different addresses,
+    every client passed to watch() is told through its `_resolved()` method,
+    from the background thread. If a refresh fails, the last known addresses
+    are kept.
+    """
+
+    def __init__(self, host, port, family, type, ttl):
+        self.host = host
+        self.port = port
+        self.family = family
+        self.type = type
+        self.ttl = ttl
+        self.addresses = lookup(host, port, family, type)
+        self._clients = weakref.WeakSet()
+        self.next_refresh = time_now() + ttl
+
+    def watch(self, client):
+        """Call `client._resolved(addresses)` when the addresses change."""
+        self._clients.add(client)
+
+    def refresh(self):
+        self.next_refresh = time_now() + self.ttl
+        try:
+            addresses = lookup(self.host, self.port, self.family, self.type)
+        except OSError:
+            return
+        if addresses and addresses != self.addresses:
+            self.addresses = addresses
+            for client in list(self._clients):
+                client._resolved(addresses)
+
+
+class _Refresher:
+    """Refresh every resolver when it's due, from one daemon thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resolvers = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        fork.register(self)
+
+    def get(self, host, port, family, type, ttl, client=None):
+        key = (host, port, family, type, ttl)
+        with self._lock:
+            resolver = self._resolvers.get(key)
+            # Watched with the lock held, so it can't be dropped before the
+            # client is one of its clients.
+            if resolver is not None and client is not None:
+                resolver.watch(client)
+        if resolver is None:
+            resolver = Resolver(host, port, family, type, ttl)
+            with self._lock:
+                resolver = self._resolvers.setdefault(key, resolver)
+                if client is not None:
+                    resolver.watch(client)
+                if self._thread is None:
+                    self._start()
+            # It may be due sooner than anything the thread is waiting for.
+            self._wakeup.set()
+        return resolver
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='statsd-resolver')
+        self._thread.start()
+
+    def _after_fork(self):
+        # The thread wasn't copied into this process.
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        if self._resolvers:
+            self._start()
+
+    def _drop(self, resolver):
+        key = (resolver.host, resolver.port, resolver.family, resolver.type,
+               resolver.ttl)
+        with self._lock:
+            if not resolver._clients and self._resolvers.get(key) is resolver:
+                del self._resolvers[key]
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                resolvers = list(self._resolvers.values())
+            now = time_now()
+            # With nothing to refresh, wait until a resolver is added.
+            next_refresh = now + 60
+            for resolver in resolvers:
+                if resolver.next_refresh <= now:
+                    if not resolver._clients:
+                        # Every client that used it is gone.
+                        self._drop(resolver)
+                        continue
+                    try:
+                        resolver.refresh()
+                    except Exception:
+                        # There's no one to raise to from here, and the
+                        # other resolvers still need refreshing. This one
+                        # is tried again after its ttl.
+                        pass
+                next_refresh = min(next_refresh, resolver.next_refresh)
+            self._wakeup.wait(max(next_refresh - time_now(), 0.01))
+
+
+_refresher = _Refresher()
+
+
+def lookup(host, port, family, type):
+    """Return every (family, sockaddr) for `host` and `port`, right now."""
+    return [
+        (family, addr)
+        for family, _, _, _, addr in socket.getaddrinfo(
+            host, port, family, type)
+    ]
+
+
+def resolve(host, port, family, type, ttl, client=None):
+    """Return a shared Resolver for `host` and `port`, watched by `client`.
+
+    A resolver is dropped once every client watching it is gone.
+    """
+    return _refresher.get(host, port, family, type, ttl, client)
+
+
+def ordered(addresses, preferred):
+    """Return `addresses`, starting with `preferred` if it's one of them."""
+    if preferred in addresses:
+        addresses = list(addresses)
+        addresses.remove(preferred)
+        addresses.insert(0, preferred)
+    return addresses
@@ -0,0 +1,41 @@
+"""The source of random numbers for sample rates.
+
+Clients call ``sampling.random()`` once per sampled stat, before doing any
+other work.
+"""
+import os
+import random as _random
+import sys
+import threading
+
+
+class _ThreadRandom(threading.local):
+    def __init__(self):
+        self.random = _random.Random().random
+
+
+def _gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+
+if _gil_enabled():
+    # The GIL already serializes access to the shared generator, and nothing
+    # is cheaper than calling it directly.
+    random = _random.random
+else:
+    # Without a GIL, threads would contend for the shared generator's lock.
+    # Give each thread its own generator instead.
+    _local = _ThreadRandom()
+
+    def random():
+        return _local.random()
+
+    def _reseed():
+        # The shared generator is reseeded in child processes, so do the
+        # same here, or every child would sample the same stats.
+        global _local
+        _local = _ThreadRandom()
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_reseed)
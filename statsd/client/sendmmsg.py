@@ -0,0 +1,157 @@
+"""Send several datagrams with a single system call where possible.
+
+On Linux, :func:`send_many` hands a whole batch of datagrams to the kernel
+with ``sendmmsg(2)``. Everywhere else, or if ``sendmmsg`` or ctypes isn't
+available, it falls back to calling ``sendto`` once per datagram. ctypes is
+only imported when the first batch is sent.
+"""
+import socket
+import struct
+import sys
+
+
+# Loaded with the first batch of two or more datagrams, since importing
+# ctypes and looking up libc take longer than importing everything else.
+_NOT_LOADED = object()
+_sendmmsg = _NOT_LOADED
+# (ctypes, _iovec, _mmsghdr), once _sendmmsg is loaded.
+_types = None
+
+
+def _load_sendmmsg():
+    global _types
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.sendmmsg
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    class _iovec(ctypes.Structure):
+        _fields_ = [
+            ('iov_base', ctypes.c_void_p),
+            ('iov_len', ctypes.c_size_t),
+        ]
+
+    class _msghdr(ctypes.Structure):
+        _fields_ = [
+            ('msg_name', ctypes.c_void_p),
+            ('msg_namelen', ctypes.c_uint32),
+            ('msg_iov', ctypes.POINTER(_iovec)),
+            ('msg_iovlen', ctypes.c_size_t),
+            ('msg_control', ctypes.c_void_p),
+            ('msg_controllen', ctypes.c_size_t),
+            ('msg_flags', ctypes.c_int),
+        ]
+
+    class _mmsghdr(ctypes.Structure):
+        _fields_ = [
+            ('msg_hdr', _msghdr),
+            ('msg_len', ctypes.c_uint),
+        ]
+
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint,
+                     ctypes.c_int]
+    func.restype = ctypes.c_int
+    _types = (ctypes, _iovec, _mmsghdr)
+    return func
+
+
+def _available():
+    """Load sendmmsg if it hasn't been yet, and return True if it works."""
+    global _sendmmsg
+    if _sendmmsg is _NOT_LOADED:
+        _sendmmsg = _load_sendmmsg()
+    return _sendmmsg is not None
+
+
+def _sockaddr(family, addr):
+    """Build the C sockaddr struct for a Python socket address."""
+    if family == socket.AF_INET:
+        host, port = addr[:2]
+        return (struct.pack('=H', family) + struct.pack('!H', port) +
+                socket.inet_pton(family, host) + b'\0' * 8)
+    if family == socket.AF_INET6:
+        host, port, flowinfo, scope_id = (tuple(addr) + (0, 0))[:4]
+        return (struct.pack('=H', family) +
+                struct.pack('!HI', port, flowinfo) +
+                socket.inet_pton(family, host) +
+                struct.pack('=I', scope_id))
+    raise ValueError('Unsupported address family: %r' % family)
+
+
+def _buffer(ctypes, data):
+    size = len(data)
+    try:
+        return (ctypes.c_char * size).from_buffer(data)
+    except TypeError:
+        # Read-only data (bytes) has to be copied.
+        return (ctypes.c_char * size).from_buffer_copy(data)
+
+
+def _send_loop(sock, datagrams, addr, on_error):
+    sent = 0
+    for data in datagrams:
+        try:
+            if addr is None:
+                sock.send(data)
+            else:
+                sock.sendto(data, addr)
+        except (OSError, RuntimeError) as exc:
+            if on_error is not None:
+                on_error(getattr(exc, 'errno', None))
+            continue
+        sent += 1
+    return sent
+
+
+def send_many(sock, datagrams, addr=None, on_error=None):
+    """Send each datagram in `datagrams` on `sock`.
+
+    If `addr` is None the socket must be connected. Errors are swallowed,
+    just like a single send on a StatsClient, but `on_error` is called with
+    the errno of each failed datagram if it's given. Returns the number of
+    datagrams the kernel accepted.
+    """
+    if (len(datagrams) < 2 or not isinstance(sock, socket.socket) or
+            not _available()):
+        return _send_loop(sock, datagrams, addr, on_error)
+
+    ctypes, _iovec, _mmsghdr = _types
+    count = len(datagrams)
+    buffers = [_buffer(ctypes, data) for data in datagrams]
+    iovecs = (_iovec * count)()
+    msgs = (_mmsghdr * count)()
+    name = None
+    if addr is not None:
+        sockaddr = _sockaddr(sock.family, addr)
+        name = ctypes.create_string_buffer(sockaddr, len(sockaddr))
+    for i, buf in enumerate(buffers):
+        iovecs[i].iov_base = ctypes.addressof(buf)
+        iovecs[i].iov_len = len(buf)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdr.msg_iovlen = 1
+        if name is not None:
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = len(name)
+
+    fd = sock.fileno()
+    base = ctypes.addressof(msgs)
+    size = ctypes.sizeof(_mmsghdr)
+    sent = 0
+    pos = 0
+    while pos < count:
+        result = _sendmmsg(fd, base + pos * size, count - pos, 0)
+        if result < 0:
+            # The datagram at `pos` failed; skip it and carry on with the
+            # rest, the way a loop of sendto calls would.
+            if on_error is not None:
+                on_error(ctypes.get_errno())
+            pos += 1
+        else:
+            sent += result
+            pos += result
+    return sent
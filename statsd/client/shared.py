@@ -0,0 +1,444 @@
+"""Aggregate counters and gauges across processes in shared memory.
+
+The shared file is laid out in fixed-size slots::
+
+    header | lane 0: header, slot, slot, ... | lane 1: ... | ...
+
+Every process claims a lane of its own and is the only one to write to it,
+so processes never contend with each other. Each slot holds one stat: its
+name and type, the running total (or last value, for gauges) written by the
+lane's process, and the total already sent, written by whichever process is
+the sender. Keeping what was sent in the file means another process can take
+over as the sender at any time without sending anything twice.
+
+Writers update a slot's value under a sequence number (a seqlock), which the
+sender checks to make sure it never reads a half-written value.
+"""
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from . import fork, sampling
+from .base import StatsClientBase, _pairs
+
+
+_MAGIC = b'PYSTATSD'
+_VERSION = 1
+SLOT_SIZE = 128
+
+# magic, version, lanes, slots per lane, slot size
+_HEADER = struct.Struct('<8sIIII')
+# pid, slots used
+_LANE = struct.Struct('<qI')
+# seq, kind, name length
+_SLOT = struct.Struct('<IBxH')
+_SEQ = struct.Struct('<I')
+_VALUE = struct.Struct('<dd')
+_SENT = struct.Struct('<d')
+_VALUE_OFFSET = 8
+_SENT_OFFSET = 24
+_NAME_OFFSET = 32
+MAX_NAME = SLOT_SIZE - _NAME_OFFSET
+
+_COUNTER = 1
+_GAUGE = 2
+_GAUGE_DELTA = 3
+
+# Byte ranges locked with lockf(), which are held per process and never
+# inherited by children.
+_SENDER_LOCK = 0
+_SETUP_LOCK = 1
+
+
+_clients = set()
+
+
+@atexit.register
+def _close_all():
+    for client in list(_clients):
+        client.close()
+
+
+def _number(value):
+    if value == int(value):
+        return b'%d' % value
+    return b'%r' % value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedStatsClient(StatsClientBase):
+    """Aggregate counters and gauges from many processes on one host.
+
+    Every process using the same `path` adds its counters and gauges to a
+    memory-mapped file instead of sending them. One of them, the sender,
+    sends the totals through `client` every `flush_interval` seconds, so the
+    statsd server gets one packet's worth of counters per interval no matter
+    how many processes there are.
+
+    Every client created with `sender=True` competes to be the sender, and
+    exactly one of them is at any time. Timers, sets, pipelines and stats
+    whose names are longer than `MAX_NAME` bytes, or that don't fit in the
+    `max_stats` slots of a process, are sent through `client` directly.
+
+    Up to `max_processes` processes can use the file at once; any more send
+    their stats through `client` directly. The file's layout is fixed when
+    it is created, so every process must use the same `max_processes` and
+    `max_stats`.
+    """
+
+    def __init__(self, client, path, flush_interval=1.0, max_processes=64,
+                 max_stats=1024, sender=True):
+        """Create a new shared client wrapping `client`."""
+        if fcntl is None:
+            raise RuntimeError('SharedStatsClient requires fcntl.')
+        self._client = client
+        self._prefix = client._prefix
+        self._path = path
+        self._flush_interval = flush_interval
+        self._lanes = max_processes
+        self._slots = max_stats
+        self._lane_size = (max_stats + 1) * SLOT_SIZE
+        size = SLOT_SIZE + max_processes * self._lane_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._setup(size)
+            self._mmap = mmap.mmap(self._fd, size)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._reset()
+        self._is_sender = False
+        self._stop = threading.Event()
+        self._thread = None
+        if sender:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='statsd-shared')
+            self._thread.start()
+        _clients.add(self)
+        fork.register(self)
+
+    def _setup(self, size):
+        self._lock_file(_SETUP_LOCK)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                header = _HEADER.pack(_MAGIC, _VERSION, self._lanes,
+                                      self._slots, SLOT_SIZE)
+                os.pwrite(self._fd, header, 0)
+                return
+            header = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+            expected = (_MAGIC, _VERSION, self._lanes, self._slots,
+                        SLOT_SIZE)
+            if header != expected:
+                raise ValueError(
+                    '{} has a different layout: {!r}, expected {!r}'.format(
+                        self._path, header, expected))
+        finally:
+            self._unlock_file(_SETUP_LOCK)
+
+    def _lock_file(self, offset, blocking=True):
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.lockf(self._fd, flags, 1, offset, os.SEEK_SET)
+
+    def _unlock_file(self, offset):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset, os.SEEK_SET)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._lane = None
+        self._no_lane = False
+        # (stat, kind): [slot offset, current value]
+        self._cache = {}
+        # The same, by prefixed and encoded name, for slots this process
+        # hasn't used yet.
+        self._names = {}
+
+    def _after_fork(self):
+        # The child needs a lane of its own. The parent stays the sender, if
+        # it is one: lockf() locks aren't inherited.
+        self._reset()
+        self._is_sender = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def close(self):
+        """Stop sending, send any totals if this is the sender, and close."""
+        if self._mmap is None:
+            return
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._is_sender:
+            self.flush()
+        with self._lock:
+            if self._lane is not None:
+                # The totals stay in the lane, for the sender to send.
+                _LANE.pack_into(self._mmap, self._lane, 0,
+                                self._lane_used())
+            self._mmap.close()
+            self._mmap = None
+        os.close(self._fd)
+        _clients.discard(self)
+        self._client.close()
+
+    def pipeline(self):
+        # Pipelined stats are sent as they are, in one go.
+        return self._client.pipeline()
+
+    def incr(self, stat, count=1, rate=1):
+        """Increment a stat by `count`."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        if not self._add(stat, _COUNTER, count / rate if rate < 1 else count):
+            self._send_stat(stat, '%s|c' % count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """Set a gauge value."""
+        if rate < 1 and sampling.random() > rate:
+            return self._sampled_out()
+        if delta:
+            stored = self._shift(stat, value)
+        else:
+            stored = self._set(stat, _GAUGE, value)
+        if not stored:
+            super().gauge(stat, value, 1, delta)
+
+    def incr_many(self, pairs, rate=1):
+        for stat, count in _pairs(pairs):
+            self.incr(stat, count, rate)
+
+    def gauge_many(self, pairs, rate=1, delta=False):
+        for stat, value in _pairs(pairs):
+            self.gauge(stat, value, rate, delta)
+
+    def _handle_send(self, kind, stat, value, rate, delta=False):
+        if kind == 'c':
+            self.incr(stat, value, rate)
+        elif kind == 'g':
+            self.gauge(stat, value, rate, delta)
+        else:
+            self.timing(stat, value, rate)
+
+    def _after(self, data):
+        if data:
+            self._client._after(data)
+
+    def _slot(self, stat, kind, create=True):
+        # Called with the lock held. Returns None if the stat has no slot
+        # and can't have one.
+        key = (stat, kind)
+        entry = self._cache.get(key)
+        if entry is not None:
+            return entry
+        if self._lane is None:
+            if self._no_lane or not self._claim_lane():
+                return None
+        name = stat
+        if self._prefix:
+            name = '{}.{}'.format(self._prefix, stat)
+        name = name.encode('ascii')
+        entry = self._names.get((name, kind))
+        if entry is not None:
+            self._cache[key] = entry
+            return entry
+        if not create:
+            return None
+        used = self._lane_used()
+        if len(name) > MAX_NAME or used >= self._slots:
+            return None
+        offset = self._lane + (used + 1) * SLOT_SIZE
+        mm = self._mmap
+        mm[offset + _NAME_OFFSET:offset + _NAME_OFFSET + len(name)] = name
+        _SLOT.pack_into(mm, offset, 0, kind, len(name))
+        # Only count the slot once it is complete, for the sender.
+        _LANE.pack_into(mm, self._lane, os.getpid(), used + 1)
+        entry = self._cache[key] = [offset, 0.0]
+        return entry
+
+    def _lane_used(self):
+        return _LANE.unpack_from(self._mmap, self._lane)[1]
+
+    def _claim_lane(self):
+        mm = self._mmap
+        pid = os.getpid()
+        self._lock_file(_SETUP_LOCK)
+        try:
+            for lane in range(self._lanes):
+                offset = SLOT_SIZE + lane * self._lane_size
+                owner, used = _LANE.unpack_from(mm, offset)
+                if owner and _alive(owner):
+                    continue
+                # A lane left by a process that's gone keeps its totals, so
+                # keep adding to them.
+                _LANE.pack_into(mm, offset, pid, used)
+                self._lane = offset
+                break
+            else:
+                # Every stat is sent through the wrapped client instead.
+                # Don't look again on every call.
+                self._no_lane = True
+                return False
+        finally:
+            self._unlock_file(_SETUP_LOCK)
+        for i in range(used):
+            slot = offset + (i + 1) * SLOT_SIZE
+            _, kind, length = _SLOT.unpack_from(mm, slot)
+            start = slot + _NAME_OFFSET
+            name = bytes(mm[start:start + length])
+            value = _VALUE.unpack_from(mm, slot + _VALUE_OFFSET)[0]
+            self._names[(name, kind)] = [slot, value]
+        return True
+
+    def _write(self, entry, value, stamp=0.0):
+        # Called with the lock held.
+        offset = entry[0]
+        mm = self._mmap
+        seq = _SEQ.unpack_from(mm, offset)[0]
+        _SEQ.pack_into(mm, offset, (seq + 1) & 0xffffffff)
+        _VALUE.pack_into(mm, offset + _VALUE_OFFSET, value, stamp)
+        _SEQ.pack_into(mm, offset, (seq + 2) & 0xffffffff)
+        entry[1] = value
+
+    def _add(self, stat, kind, count):
+        with self._lock:
+            if self._mmap is None:
+                return False
+            entry = self._slot(stat, kind)
+            if entry is None:
+                return False
+            self._write(entry, entry[1] + count)
+        return True
+
+    def _shift(self, stat, value):
+        with self._lock:
+            if self._mmap is None:
+                return False
+            entry = self._slot(stat, _GAUGE, create=False)
+            if entry is not None:
+                # Once this process has set the gauge, deltas change the
+                # value it set, so they can't be sent before it.
+                self._write(entry, entry[1] + value, time.time())
+                return True
+            entry = self._slot(stat, _GAUGE_DELTA)
+            if entry is None:
+                return False
+            self._write(entry, entry[1] + value)
+        return True
+
+    def _set(self, stat, kind, value):
+        with self._lock:
+            if self._mmap is None:
+                return False
+            entry = self._slot(stat, kind)
+            if entry is None:
+                return False
+            # The most recently set value wins, across all processes.
+            self._write(entry, value, time.time())
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self._flush_interval):
+            if not self._is_sender:
+                try:
+                    self._lock_file(_SENDER_LOCK, blocking=False)
+                except OSError:
+                    continue
+                self._is_sender = True
+            try:
+                self.flush()
+            except Exception:
+                # There's no one to raise to from here. Try again next time.
+                pass
+
+    def _read(self, offset, tries=1000):
+        mm = self._mmap
+        for _ in range(tries):
+            seq = _SEQ.unpack_from(mm, offset)[0]
+            value, stamp = _VALUE.unpack_from(mm, offset + _VALUE_OFFSET)
+            if not seq & 1 and _SEQ.unpack_from(mm, offset)[0] == seq:
+                break
+        # If the writer died halfway through, what's there is the best guess.
+        return value, stamp
+
+    def flush(self):
+        """Send the totals of every process.
+
+        Only the sender should call this: if several processes flush, each
+        change is sent by whichever gets to it first.
+        """
+        started = time.monotonic()
+        mm = self._mmap
+        counters = {}
+        deltas = {}
+        gauges = {}
+        with self._lock:
+            for lane in range(self._lanes):
+                lane = SLOT_SIZE + lane * self._lane_size
+                used = _LANE.unpack_from(mm, lane)[1]
+                slots = []
+                # Gauges this lane's process set since the last flush.
+                gauges_set = set()
+                for i in range(used):
+                    offset = lane + (i + 1) * SLOT_SIZE
+                    _, kind, length = _SLOT.unpack_from(mm, offset)
+                    start = offset + _NAME_OFFSET
+                    name = bytes(mm[start:start + length])
+                    value, stamp = self._read(offset)
+                    sent = _SENT.unpack_from(mm, offset + _SENT_OFFSET)[0]
+                    if kind == _GAUGE:
+                        if stamp > sent:
+                            _SENT.pack_into(mm, offset + _SENT_OFFSET, stamp)
+                            gauges_set.add(name)
+                            if stamp > gauges.get(name, (0.0, 0))[0]:
+                                gauges[name] = (stamp, value)
+                        continue
+                    slots.append((offset, kind, name, value, sent))
+                for offset, kind, name, value, sent in slots:
+                    if value == sent:
+                        continue
+                    _SENT.pack_into(mm, offset + _SENT_OFFSET, value)
+                    if kind == _GAUGE_DELTA and name in gauges_set:
+                        # Deltas only go in this slot until the process
+                        # first sets the gauge, so these came before the
+                        # value it set, which replaces them.
+                        continue
+                    totals = counters if kind == _COUNTER else deltas
+                    totals[name] = totals.get(name, 0) + value - sent
+
+        pipe = self._client.pipeline()
+        for name, count in counters.items():
+            if count:
+                pipe._after(b'%s:%s|c' % (name, _number(count)))
+        for name, (_, value) in gauges.items():
+            if value < 0:
+                pipe._after(b'%s:0|g' % name)
+            pipe._after(b'%s:%s|g' % (name, _number(value)))
+        for name, value in deltas.items():
+            if value:
+                sign = b'+' if value > 0 else b''
+                pipe._after(b'%s:%s%s|g' % (name, sign, _number(value)))
+        t = self._telemetry
+        if t is not None:
+            t.formatted += len(pipe._stats)
+        pipe.send()
+        if t is not None:
+            t.flushed(started)
@@ -0,0 +1,76 @@
+import math
+
+
+class QuantileSketch:
+    """A streaming quantile sketch with bounded memory.
+
+    Values are counted in logarithmically sized buckets (as in DDSketch), so
+    any quantile is accurate to within `relative_accuracy` of the true value,
+    using at most `max_buckets` buckets no matter how many values are added.
+    If there are more distinct buckets than that, the lowest ones are merged,
+    which only affects the accuracy of the lowest quantiles.
+
+    Values less than or equal to zero are counted together as zero.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._gamma = gamma
+        self._log_gamma = math.log(gamma)
+        self._max_buckets = max_buckets
+        self._buckets = {}
+        self._zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        """Add `value` to the sketch, counted `weight` times."""
+        self.count += weight
+        self.sum += value * weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value <= 0:
+            self._zero += weight
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        buckets = self._buckets
+        if index in buckets:
+            buckets[index] += weight
+        else:
+            buckets[index] = weight
+            if len(buckets) > self._max_buckets:
+                self._collapse()
+
+    def _collapse(self):
+        lowest, second = sorted(self._buckets)[:2]
+        self._buckets[second] += self._buckets.pop(lowest)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.sum / self.count
+
+    def quantile(self, q):
+        """Return an estimate of the `q` quantile, between 0 and 1."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = self._zero
+        if seen >= rank and seen:
+            value = 0
+        else:
+            value = self.max
+            for index in sorted(self._buckets):
+                seen += self._buckets[index]
+                if seen >= rank:
+                    value = 2 * self._gamma ** index / (self._gamma + 1)
+                    break
+        # The exact extremes are known, so never return anything outside
+        # them.
+        return min(max(value, self.min), self.max)
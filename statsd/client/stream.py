@@ -1,25 +1,194 @@
 import socket
+import threading
+from collections import Counter, deque
+from time import monotonic as time_now
 
+from . import fork, resolver
 from .base import StatsClientBase, PipelineBase
 
 
+def _count_lines(data):
+    if isinstance(data, str):
+        return data.count('\n') + 1
+    return data.count(b'\n') + 1
+
+
 class StreamPipeline(PipelineBase):
     def _send(self):
-        self._client._after('\n'.join(self._stats))
+        self._client._after(b'\n'.join(self._stats))
         self._stats.clear()
 
 
+class _ThreadBuffer:
+    """Lines coalesced by one thread.
+
+    Only the owning thread adds lines, so its lock is only ever contended
+    while another thread flushes.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.size = 0
+        self.lock = threading.Lock()
+        self.thread = threading.current_thread()
+
+    def take(self):
+        """Return the buffered lines as one chunk. Call with the lock held."""
+        data = b'\n'.join(self.lines)
+        self.lines = []
+        self.size = 0
+        return data
+
+
 class StreamClientBase(StatsClientBase):
+    """Base class for clients that send to a stream socket.
+
+    Stream clients are thread-safe. Every write to the socket, and every
+    connect, happens with a lock held, so lines from different threads are
+    never interleaved.
+
+    With a `buffer_size`, each thread coalesces lines in a buffer of its own,
+    without taking the lock, and writes them with a single `sendall` once
+    `buffer_size` bytes are waiting. Once `flush_interval` seconds have
+    passed since the last flush, the buffers of every thread are written.
+    Both are only checked when a stat is sent, so call flush() or close() to
+    send anything still waiting.
+
+    With `blocking=False`, the socket is non-blocking once connected. Writes
+    send whatever the kernel accepts and keep the rest in a backlog of up to
+    `max_backlog` bytes, which is sent ahead of anything new. Stats that
+    don't fit in the backlog are dropped and counted in `dropped`.
+
+    With `reconnect=True`, socket errors aren't raised. A connection that
+    breaks while sending is replaced straight away and the write is retried
+    once. If that or connecting fails, stats are dropped (and counted in
+    `dropped`) without trying to connect again for `min_backoff` seconds,
+    doubling up to `max_backoff` seconds after each failed attempt. The
+    errors are counted by errno in `errors`.
+    """
+
+    _buffer_size = 0
+    _blocking = True
+    _reconnect = False
+    dropped = 0
+
+    def _init_buffer(self, buffer_size, flush_interval):
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+        self._next_flush = time_now() + flush_interval
+
+    def _init_backlog(self, blocking, max_backlog):
+        self._blocking = blocking
+        self._max_backlog = max_backlog
+        self._backlog = deque()
+        self._backlog_size = 0
+        self.dropped = 0
+
+    def _init_reconnect(self, reconnect, min_backoff, max_backoff):
+        self._reconnect = reconnect
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._backoff = min_backoff
+        self._retry_at = 0
+        self.errors = Counter()
+
+    def _after_fork(self):
+        # The parent still owns the connection and everything buffered so
+        # far. Close this process's copy of the socket and start afresh.
+        if self._sock and hasattr(self._sock, 'close'):
+            self._sock.close()
+        self._sock = None
+        self._init_buffer(self._buffer_size, self._flush_interval)
+        self._init_backlog(self._blocking, self._max_backlog)
+        self._init_reconnect(self._reconnect, self._min_backoff,
+                             self._max_backoff)
+
     def connect(self):
         raise NotImplementedError()
 
     def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._disconnect()
+
+    def _disconnect(self):
+        if not self._blocking:
+            # Whatever is left can't be sent on a new connection, which
+            # might start in the middle of a line.
+            for data in self._backlog:
+                self.dropped += bytes(data).count(b'\n')
+            self._backlog.clear()
+            self._backlog_size = 0
         if self._sock and hasattr(self._sock, 'close'):
             self._sock.close()
         self._sock = None
 
+    def flush(self):
+        """Send any coalesced lines now, from every thread.
+
+        In non-blocking mode, also send as much of the backlog as the kernel
+        will accept, without waiting for the rest.
+        """
+        if self._blocking and not self._buffer_size:
+            return
+        started = time_now()
+        with self._lock:
+            # Take the buffers with the lock held, so no thread can write
+            # lines newer than these before they're written.
+            data = self._take_all() if self._buffer_size else None
+            if data:
+                self._write(data)
+            if not self._blocking and self._sock:
+                try:
+                    self._drain()
+                except OSError as exc:
+                    if not self._reconnect:
+                        raise
+                    self.errors[exc.errno] += 1
+                    self._disconnect()
+                    self._backoff_failed()
+        t = self._telemetry
+        if t is not None:
+            t.flushed(started)
+
+    def _take_all(self):
+        # Called with the lock held.
+        self._next_flush = time_now() + self._flush_interval
+        buffers = self._buffers
+        # Forget the buffers of threads that are gone, once they've been
+        # emptied one last time.
+        self._buffers = [buf for buf in buffers if buf.thread.is_alive()]
+        chunks = []
+        for buf in buffers:
+            with buf.lock:
+                if buf.lines:
+                    chunks.append(buf.take())
+        return b'\n'.join(chunks)
+
+    def _thread_buffer(self):
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buf = self._local.buffer = _ThreadBuffer()
+            with self._lock:
+                self._buffers.append(buf)
+            return buf
+
     def reconnect(self):
         self.close()
+        with self._lock:
+            if not self._sock:
+                self._connect()
+
+    def _connect(self):
+        t = self._telemetry
+        if t is not None:
+            t.connects += 1
         self.connect()
 
     def pipeline(self):
@@ -27,47 +196,198 @@ class StreamClientBase(StatsClientBase):
 
     def _send(self, data):
         """Send data to statsd."""
-        if not self._sock:
-            self.connect()
-        self._do_send(data)
+        if not self._buffer_size:
+            with self._lock:
+                self._write(data)
+            return
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        buf = self._thread_buffer()
+        with buf.lock:
+            buf.lines.append(data)
+            buf.size += len(data) + 1
+            full = buf.size >= self._buffer_size
+        if full:
+            # Take the lines and write them under one lock, like flush(),
+            # so chunks are written in the order they were taken.
+            with self._lock:
+                with buf.lock:
+                    data = buf.take() if buf.lines else None
+                if data:
+                    self._write(data)
+        if time_now() >= self._next_flush:
+            self.flush()
+
+    def _write(self, data):
+        if not self._reconnect:
+            if not self._sock:
+                self._connect()
+            self._do_send(data)
+            return
+
+        connected = self._sock is not None
+        if not connected and time_now() < self._retry_at:
+            # Still backing off: don't wait for another connect to fail.
+            self.dropped += _count_lines(data)
+            return
+        for attempt in (1, 2):
+            try:
+                if not self._sock:
+                    self._connect()
+                self._do_send(data)
+            except OSError as exc:
+                self.errors[exc.errno] += 1
+                self._disconnect()
+                if connected and attempt == 1:
+                    # The connection broke, maybe because the server was
+                    # restarted. Try a new one right away.
+                    continue
+                self._backoff_failed()
+                self.dropped += _count_lines(data)
+                return
+            self._backoff = self._min_backoff
+            return
+
+    def _backoff_failed(self):
+        self._retry_at = time_now() + self._backoff
+        self._backoff = min(self._backoff * 2, self._max_backoff)
 
     def _do_send(self, data):
-        self._sock.sendall(data.encode('ascii') + b'\n')
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        if self._blocking:
+            self._sock.sendall(b'%s\n' % data)
+        else:
+            self._send_nonblocking(b'%s\n' % data)
+        t = self._telemetry
+        if t is not None:
+            t.packets += 1
+            t.bytes += len(data) + 1
+
+    def _send_nonblocking(self, data):
+        # Called with the lock held. Anything already in the backlog has to
+        # go first, to keep lines in order.
+        if self._backlog:
+            self._drain()
+        if not self._backlog:
+            try:
+                sent = self._sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            if sent == len(data):
+                return
+            if sent:
+                # The rest of a partly sent line can't be dropped without
+                # corrupting the stream, so it always goes in the backlog.
+                data = memoryview(data)[sent:]
+                self._backlog.append(data)
+                self._backlog_size += len(data)
+                return
+        if self._backlog_size + len(data) > self._max_backlog:
+            self.dropped += data.count(b'\n')
+            return
+        self._backlog.append(data)
+        self._backlog_size += len(data)
+
+    def _drain(self):
+        backlog = self._backlog
+        while backlog:
+            data = backlog[0]
+            try:
+                sent = self._sock.send(data)
+            except BlockingIOError:
+                return
+            self._backlog_size -= sent
+            if sent < len(data):
+                backlog[0] = memoryview(data)[sent:]
+                return
+            backlog.popleft()
 
 
 class TCPStatsClient(StreamClientBase):
     """TCP version of StatsClient."""
 
     def __init__(self, host='localhost', port=8125, prefix=None,
-                 timeout=None, ipv6=False):
+                 timeout=None, ipv6=False, buffer_size=0, flush_interval=1.0,
+                 nodelay=False, blocking=True, max_backlog=65536,
+                 reconnect=False, min_backoff=0.1, max_backoff=30.0,
+                 dns_ttl=None):
         """Create a new client."""
         self._host = host
         self._port = port
         self._ipv6 = ipv6
+        self._dns_ttl = dns_ttl
+        self._resolver = None
+        self._last_address = None
         self._timeout = timeout
         self._prefix = prefix
+        self._nodelay = nodelay
         self._sock = None
+        self._init_buffer(buffer_size, flush_interval)
+        self._init_backlog(blocking, max_backlog)
+        self._init_reconnect(reconnect, min_backoff, max_backoff)
+        fork.register(self)
 
-    def connect(self):
+    def _addresses(self):
         fam = socket.AF_INET6 if self._ipv6 else socket.AF_INET
-        family, _, _, _, addr = socket.getaddrinfo(
-            self._host, self._port, fam, socket.SOCK_STREAM)[0]
-        self._sock = socket.socket(family, socket.SOCK_STREAM)
-        self._sock.settimeout(self._timeout)
-        self._sock.connect(addr)
+        if not self._dns_ttl:
+            return resolver.lookup(self._host, self._port, fam,
+                                   socket.SOCK_STREAM)
+        if self._resolver is None:
+            self._resolver = resolver.resolve(
+                self._host, self._port, fam, socket.SOCK_STREAM,
+                self._dns_ttl, self)
+        return self._resolver.addresses
+
+    def _resolved(self, addresses):
+        # Called from the resolver's thread. The new addresses are used the
+        # next time we connect.
+        pass
+
+    def connect(self):
+        # Try every address, starting with the one that worked last.
+        addresses = resolver.ordered(self._addresses(), self._last_address)
+        for family, addr in addresses:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            if self._nodelay:
+                # Writes are already coalesced, so don't wait for Nagle's
+                # algorithm to coalesce them again.
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.connect(addr)
+            except OSError as exc:
+                sock.close()
+                error = exc
+                continue
+            if not self._blocking:
+                sock.setblocking(False)
+            self._sock = sock
+            self._last_address = (family, addr)
+            return
+        raise error
 
 
 class UnixSocketStatsClient(StreamClientBase):
     """Unix domain socket version of StatsClient."""
 
-    def __init__(self, socket_path, prefix=None, timeout=None):
+    def __init__(self, socket_path, prefix=None, timeout=None,
+                 buffer_size=0, flush_interval=1.0, blocking=True,
+                 max_backlog=65536, reconnect=False, min_backoff=0.1,
+                 max_backoff=30.0):
         """Create a new client."""
         self._socket_path = socket_path
         self._timeout = timeout
         self._prefix = prefix
         self._sock = None
+        self._init_buffer(buffer_size, flush_interval)
+        self._init_backlog(blocking, max_backlog)
+        self._init_reconnect(reconnect, min_backoff, max_backoff)
+        fork.register(self)
 
     def connect(self):
         self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self._sock.settimeout(self._timeout)
         self._sock.connect(self._socket_path)
+        if not self._blocking:
+            self._sock.setblocking(False)
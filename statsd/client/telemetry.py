@@ -0,0 +1,146 @@
+"""Count what a client does, and optionally report it to statsd.
+
+Telemetry is off until a client's enable_telemetry() is called. Until then,
+the only cost on the hot path is checking that the client's `_telemetry` is
+None.
+"""
+import errno
+import threading
+import weakref
+from time import monotonic as time_now
+
+from . import fork
+
+
+class Telemetry:
+    """Counters for one client.
+
+    Counters are updated without a lock, so under heavy contention from many
+    threads an increment may occasionally be lost. They are meant for
+    watching trends, not for accounting.
+    """
+
+    def __init__(self):
+        self.formatted = 0
+        self.sampled = 0
+        self.packets = 0
+        self.bytes = 0
+        self.connects = 0
+        self.flushes = 0
+        self.flush_time = 0.0
+
+    def flushed(self, started):
+        self.flushes += 1
+        self.flush_time += time_now() - started
+
+    def snapshot(self):
+        return {
+            'formatted': self.formatted,
+            'sampled': self.sampled,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'connects': self.connects,
+            'flushes': self.flushes,
+            'flush_time': self.flush_time,
+        }
+
+
+def _flatten(stats, prefix=''):
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            if name == 'errors':
+                value = {errno.errorcode.get(code, 'unknown'): count
+                         for code, count in value.items()}
+            yield from _flatten(value, '{}{}.'.format(prefix, name))
+        else:
+            yield prefix + name, value
+
+
+class _Reporter:
+    """Send the counters of every reporting client from one daemon thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # client: [interval, prefix, next report, last counters]
+        self._clients = weakref.WeakKeyDictionary()
+        self._wakeup = threading.Event()
+        self._thread = None
+        fork.register(self)
+
+    def add(self, client, interval, prefix):
+        with self._lock:
+            self._clients[client] = [interval, prefix,
+                                     time_now() + interval, {}]
+            if self._thread is None:
+                self._start()
+        self._wakeup.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='statsd-telemetry')
+        self._thread.start()
+
+    def _after_fork(self):
+        # The thread wasn't copied into this process. The counters were,
+        # but they're this process's to report from now on.
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        if len(self._clients):
+            self._start()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_report = self._report_due()
+            self._wakeup.wait(max(next_report - time_now(), 0.01))
+
+    def _report_due(self):
+        # Returns when the next report is due. Clients are only referenced
+        # in here, so they can be garbage collected while the thread waits.
+        with self._lock:
+            entries = list(self._clients.items())
+        now = time_now()
+        next_report = now + 60
+        for client, entry in entries:
+            if entry[2] <= now:
+                entry[2] = now + entry[0]
+                try:
+                    report(client, entry[1], entry[3])
+                except Exception:
+                    # There's no one to raise to from here.
+                    pass
+            next_report = min(next_report, entry[2])
+        return next_report
+
+
+_reporter = _Reporter()
+
+
+def report(client, prefix, last):
+    """Send what changed in `client.stats()` since `last`, and update it.
+
+    Counters are sent as statsd counters under `prefix`, and the mean flush
+    time as a timer.
+    """
+    stats = dict(_flatten(client.stats()))
+    with client.pipeline() as pipe:
+        for name, value in stats.items():
+            if name.endswith('flush_time'):
+                continue
+            delta = value - last.get(name, 0)
+            if delta:
+                pipe.incr('{}.{}'.format(prefix, name), delta)
+        for name, value in stats.items():
+            if name.endswith('flush_time'):
+                flushes = name[:-len('flush_time')] + 'flushes'
+                count = stats[flushes] - last.get(flushes, 0)
+                if count:
+                    mean = (value - last.get(name, 0)) * 1000 / count
+                    pipe.timing('{}.{}'.format(prefix, name[:-5]), mean)
+    last.clear()
+    last.update(stats)
+
+
+def start(client, interval, prefix):
+    _reporter.add(client, interval, prefix)
@@ -0,0 +1,109 @@
+import atexit
+import queue
+import threading
+
+from . import fork
+from .base import StatsClientBase
+from .buffered import BufferedPipeline
+
+
+_clients = set()
+
+
+@atexit.register
+def _close_all():
+    for client in list(_clients):
+        client.close()
+
+
+class ThreadedStatsClient(StatsClientBase):
+    """Send stats from a background thread.
+
+    Stats are formatted in the calling thread and put on a bounded queue.
+    A dedicated thread drains the queue and sends whatever it finds through
+    a pipeline of the wrapped client, so callers never wait on a socket.
+    """
+
+    def __init__(self, client, queue_size=10000, drop_on_full=True):
+        """Create a new threaded client wrapping `client`."""
+        self._client = client
+        self._prefix = client._prefix
+        self._queue_size = queue_size
+        self._drop_on_full = drop_on_full
+        self._start()
+        _clients.add(self)
+        fork.register(self)
+
+    def _start(self):
+        self._queue = queue.Queue(self._queue_size)
+        self._drop_lock = threading.Lock()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='statsd-sender')
+        self._thread.start()
+
+    def _after_fork(self):
+        # The background thread wasn't copied into this process, and the
+        # parent's thread will send whatever is queued.
+        if self._thread is not None:
+            self._start()
+
+    def close(self):
+        """Send any queued stats, stop the thread and close the client."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        _clients.discard(self)
+        self._client.close()
+
+    def flush(self):
+        """Block until every queued stat has been sent."""
+        self._queue.join()
+
+    def pipeline(self):
+        return BufferedPipeline(self)
+
+    def _drop(self, count=1):
+        with self._drop_lock:
+            self.dropped += count
+
+    def _after(self, data):
+        if not data:
+            return
+        if not self._drop_on_full:
+            self._queue.put(data)
+            return
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self._drop()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch.remove(None)
+            self._send_batch(batch)
+            for _ in range(len(batch) + (not running)):
+                self._queue.task_done()
+
+    def _send_batch(self, batch):
+        if not batch:
+            return
+        try:
+            pipe = self._client.pipeline()
+            for data in batch:
+                pipe._after(data)
+            pipe.send()
+        except Exception:
+            # There's no one to raise to from here.
+            self._drop(len(batch))
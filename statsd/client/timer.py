@@ -1,8 +1,21 @@
 import functools
-from inspect import iscoroutinefunction
 from time import perf_counter as time_now
 
 
+# One format per precision, so formatting a timer is a single % operation.
+_FORMATS = tuple('%0.{}f|ms'.format(p) for p in range(7))
+
+
+def _timing_format(precision):
+    """Return the format for milliseconds with `precision` decimal places.
+
+    e.g. ``_timing_format(3) % 1.5`` is ``'1.500|ms'``.
+    """
+    if not 0 <= precision < len(_FORMATS):
+        raise ValueError('precision must be between 0 and 6')
+    return _FORMATS[precision]
+
+
 def safe_wraps(wrapper, *args, **kwargs):
     """Safely wraps partial functions."""
     while isinstance(wrapper, functools.partial):
@@ -11,18 +24,31 @@ def safe_wraps(wrapper, *args, **kwargs):
 
 
 class Timer:
-    """A context manager/decorator for statsd.timing()."""
+    """A context manager/decorator for statsd.timing().
+
+    Times are sent with `precision` decimal places. A Timer can be used any
+    number of times, in one thread at a time, and decorated functions don't
+    create one per call.
+    """
 
-    def __init__(self, client, stat, rate=1):
+    __slots__ = ('client', 'stat', 'rate', 'precision', 'ms', '_sent',
+                 '_start_time')
+
+    def __init__(self, client, stat, rate=1, precision=6):
+        _timing_format(precision)  # Fail early if it isn't valid.
         self.client = client
         self.stat = stat
         self.rate = rate
+        self.precision = precision
         self.ms = None
         self._sent = False
         self._start_time = None
 
     def __call__(self, f):
         """Thread-safe timing function decorator."""
+        # inspect is slow to import and only needed once a function is
+        # decorated.
+        from inspect import iscoroutinefunction
         if iscoroutinefunction(f):
             @safe_wraps(f)
             async def _async_wrapped(*args, **kwargs):
@@ -31,7 +57,7 @@ class Timer:
                     return await f(*args, **kwargs)
                 finally:
                     elapsed_time_ms = 1000.0 * (time_now() - start_time)
-                    self.client.timing(self.stat, elapsed_time_ms, self.rate)
+                    self._timing(elapsed_time_ms)
             return _async_wrapped
 
         @safe_wraps(f)
@@ -41,7 +67,7 @@ class Timer:
                 return f(*args, **kwargs)
             finally:
                 elapsed_time_ms = 1000.0 * (time_now() - start_time)
-                self.client.timing(self.stat, elapsed_time_ms, self.rate)
+                self._timing(elapsed_time_ms)
         return _wrapped
 
     def __enter__(self):
@@ -71,4 +97,12 @@ class Timer:
         if self._sent:
             raise RuntimeError('Already sent data.')
         self._sent = True
-        self.client.timing(self.stat, self.ms, self.rate)
+        self._timing(self.ms)
+
+    def _timing(self, ms):
+        # Only pass `precision` when it's set, so clients whose timing()
+        # doesn't take it still work.
+        if self.precision == 6:
+            self.client.timing(self.stat, ms, self.rate)
+        else:
+            self.client.timing(self.stat, ms, self.rate, self.precision)
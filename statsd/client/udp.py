@@ -1,6 +1,24 @@
+import errno
 import socket
+import threading
+from collections import Counter
 
+from . import resolver
 from .base import StatsClientBase, PipelineBase
+from .sendmmsg import send_many
+
+
+# Errors caused by our own send buffer, which another address won't fix.
+_BUFFER_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+def _count_sent(client, datagrams, sent):
+    t = client._telemetry
+    if t is not None:
+        t.packets += sent
+        # If some failed, which ones isn't known; assume the first ones
+        # made it.
+        t.bytes += sum(len(data) for data in datagrams[:sent])
 
 
 class Pipeline(PipelineBase):
@@ -10,39 +28,137 @@ class Pipeline(PipelineBase):
         self._maxudpsize = client._maxudpsize
 
     def _send(self):
-        data = self._stats.popleft()
-        while self._stats:
-            # Use popleft to preserve the order of the stats.
-            stat = self._stats.popleft()
-            if len(stat) + len(data) + 1 >= self._maxudpsize:
-                self._client._after(data)
-                data = stat
-            else:
-                data += '\n' + stat
-        self._client._after(data)
+        return self._client._after_many(self._pack())
+
+    def _pack(self):
+        # Join everything once, then hand out views of the joined buffer, so
+        # packing is linear in the number of stats. The buffer is never
+        # reused, so the views stay valid after we return.
+        buf = memoryview(bytearray(b'\n').join(self._stats))
+        maxudpsize = self._maxudpsize
+        datagrams = []
+        start = pos = 0
+        for stat in self._stats:
+            end = pos + len(stat)
+            if pos > start and end - start >= maxudpsize:
+                datagrams.append(buf[start:pos - 1])
+                start = pos
+            pos = end + 1
+        self._stats.clear()
+        datagrams.append(buf[start:pos - 1])
+        return datagrams
 
 
 class StatsClient(StatsClientBase):
-    """A client for statsd."""
+    """A client for statsd.
+
+    Stats that couldn't be sent are counted in `dropped`, and in `errors` by
+    errno, e.g. ``errors[errno.ENOBUFS]``.
+    """
+
+    dropped = 0
 
     def __init__(self, host='localhost', port=8125, prefix=None,
-                 maxudpsize=512, ipv6=False):
+                 maxudpsize=512, ipv6=False, dns_ttl=None, connected=False,
+                 sndbuf=None, blocking=True):
         """Create a new client."""
+        self._connected = connected
+        self._sndbuf = sndbuf
+        self._blocking = blocking
+        self._errors_lock = threading.Lock()
+        self.errors = Counter()
         fam = socket.AF_INET6 if ipv6 else socket.AF_INET
-        family, _, _, _, addr = socket.getaddrinfo(
-            host, port, fam, socket.SOCK_DGRAM)[0]
-        self._addr = addr
-        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        if dns_ttl:
+            res = resolver.resolve(host, port, fam, socket.SOCK_DGRAM,
+                                   dns_ttl, self)
+            self._addresses = res.addresses
+        else:
+            self._addresses = resolver.lookup(host, port, fam,
+                                              socket.SOCK_DGRAM)
+        self._family, self._addr = self._addresses[0]
+        self._sock = self._socket(self._family, self._addr)
         self._prefix = prefix
         self._maxudpsize = maxudpsize
 
+    def _socket(self, family, addr):
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        if self._sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sndbuf)
+        if not self._blocking:
+            sock.setblocking(False)
+        if self._connected:
+            # Routes are looked up once here instead of on every send.
+            sock.connect(addr)
+        return sock
+
     def _send(self, data):
         """Send data to statsd."""
         try:
-            self._sock.sendto(data.encode('ascii'), self._addr)
-        except (OSError, RuntimeError):
-            # No time for love, Dr. Jones!
-            pass
+            if isinstance(data, str):
+                data = data.encode('ascii')
+            if self._connected:
+                self._sock.send(data)
+            else:
+                self._sock.sendto(data, self._addr)
+            t = self._telemetry
+            if t is not None:
+                t.packets += 1
+                t.bytes += len(data)
+        except (OSError, RuntimeError) as exc:
+            # No time for love, Dr. Jones! But count it, and unless our own
+            # buffer was full, try the next address for the next stat.
+            code = getattr(exc, 'errno', None)
+            self._error(code)
+            if code not in _BUFFER_ERRORS:
+                self._failover()
+
+    def _error(self, code):
+        with self._errors_lock:
+            self.dropped += 1
+            self.errors[code] += 1
+
+    def _failover(self):
+        addresses = self._addresses
+        if len(addresses) < 2 or self._sock is None:
+            return
+        current = (self._family, self._addr)
+        if current in addresses:
+            index = addresses.index(current) + 1
+        else:
+            index = 0
+        self._use(*addresses[index % len(addresses)])
+
+    def _resolved(self, addresses):
+        # Called from the resolver's thread.
+        self._addresses = addresses
+        if (self._family, self._addr) not in addresses:
+            self._use(*addresses[0])
+
+    def _use(self, family, addr):
+        if self._sock is not None:
+            try:
+                if family != self._family:
+                    sock, self._sock = self._sock, self._socket(family, addr)
+                    sock.close()
+                elif self._connected:
+                    self._sock.connect(addr)
+            except OSError:
+                # Keep sending to the address we have.
+                return
+        self._family = family
+        self._addr = addr
+
+    def _after_many(self, datagrams):
+        addr = None if self._connected else self._addr
+        failed = []
+        sent = send_many(self._sock, datagrams, addr, failed.append)
+        for code in failed:
+            self._error(code)
+        if any(code not in _BUFFER_ERRORS for code in failed):
+            # Like _send(), but only move on once for the whole batch.
+            self._failover()
+        _count_sent(self, datagrams, sent)
+        return sent
 
     def close(self):
         if self._sock and hasattr(self._sock, 'close'):
@@ -51,3 +167,96 @@ class StatsClient(StatsClientBase):
 
     def pipeline(self):
         return Pipeline(self)
+
+
+class UnixDatagramStatsClient(StatsClientBase):
+    """A client for statsd on a Unix datagram socket.
+
+    Unix datagrams are never lost or reordered in transit and can be much
+    larger than UDP packets, so pipelines pack up to `max_datagram_size`
+    bytes into each one. Sends never block: a datagram the server isn't
+    ready for is dropped and counted in `dropped`, as is everything sent
+    while the server isn't listening. `errors` counts them by errno.
+    """
+
+    dropped = 0
+
+    def __init__(self, socket_path, prefix=None, max_datagram_size=8192):
+        """Create a new client."""
+        self._socket_path = socket_path
+        self._prefix = prefix
+        self._maxudpsize = max_datagram_size
+        self._sock = None
+        self._lock = threading.Lock()
+        self.errors = Counter()
+
+    def connect(self):
+        t = self._telemetry
+        if t is not None:
+            t.connects += 1
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def _connected(self):
+        sock = self._sock
+        if sock is None:
+            with self._lock:
+                if self._sock is None:
+                    self.connect()
+                sock = self._sock
+        return sock
+
+    def _send(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        try:
+            self._connected().send(data)
+        except BlockingIOError:
+            # The server's receive buffer is full.
+            self._drop(code=errno.EAGAIN)
+        except OSError as exc:
+            # The server isn't listening, or was restarted; connect again
+            # next time.
+            self._drop(code=exc.errno)
+            self._disconnect()
+        else:
+            t = self._telemetry
+            if t is not None:
+                t.packets += 1
+                t.bytes += len(data)
+
+    def _after_many(self, datagrams):
+        try:
+            sock = self._connected()
+        except OSError as exc:
+            self._drop(len(datagrams), exc.errno)
+            return 0
+        sent = send_many(sock, datagrams, on_error=self._error)
+        _count_sent(self, datagrams, sent)
+        return sent
+
+    def _drop(self, count=1, code=None):
+        with self._lock:
+            self.dropped += count
+            self.errors[code] += count
+
+    def _error(self, code):
+        self._drop(code=code)
+
+    def _disconnect(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+    def close(self):
+        self._disconnect()
+
+    def pipeline(self):
+        return Pipeline(self)
@@ -1,7 +1,8 @@
 from django.conf import settings
 
 from statsd import defaults
-from statsd.client import StatsClient
+from statsd.client import LazyClient, StatsClient
+from statsd.defaults.middleware import RequestStatsClient
 
 
 statsd = None
@@ -12,5 +13,9 @@ if statsd is None:
     prefix = getattr(settings, 'STATSD_PREFIX', defaults.PREFIX)
     maxudpsize = getattr(settings, 'STATSD_MAXUDPSIZE', defaults.MAXUDPSIZE)
     ipv6 = getattr(settings, 'STATSD_IPV6', defaults.IPV6)
-    statsd = StatsClient(host=host, port=port, prefix=prefix,
-                         maxudpsize=maxudpsize, ipv6=ipv6)
+    # Nothing is looked up or opened until the first stat is sent, and
+    # stats sent while StatsdMiddleware handles a request go into its
+    # pipeline.
+    statsd = RequestStatsClient(
+        LazyClient(StatsClient, host=host, port=port, prefix=prefix,
+                   maxudpsize=maxudpsize, ipv6=ipv6))
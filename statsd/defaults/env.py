@@ -1,7 +1,7 @@
 import os
 
 from statsd import defaults
-from statsd.client import StatsClient
+from statsd.client import LazyClient, StatsClient
 
 
 statsd = None
@@ -12,5 +12,6 @@ if statsd is None:
     prefix = os.getenv('STATSD_PREFIX', defaults.PREFIX)
     maxudpsize = int(os.getenv('STATSD_MAXUDPSIZE', defaults.MAXUDPSIZE))
     ipv6 = bool(int(os.getenv('STATSD_IPV6', defaults.IPV6)))
-    statsd = StatsClient(host=host, port=port, prefix=prefix,
-                         maxudpsize=maxudpsize, ipv6=ipv6)
+    # Nothing is looked up or opened until the first stat is sent.
+    statsd = LazyClient(StatsClient, host=host, port=port, prefix=prefix,
+                        maxudpsize=maxudpsize, ipv6=ipv6)
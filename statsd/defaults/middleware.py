@@ -0,0 +1,102 @@
+"""Django middleware that sends each request's stats in one pipeline.
+
+Add it to the MIDDLEWARE setting::
+
+    MIDDLEWARE = [
+        'statsd.defaults.middleware.StatsdMiddleware',
+        ...
+    ]
+
+While a request is handled, everything sent with the default client from
+:mod:`statsd.defaults.django` goes into a pipeline for that request, which is
+sent when the response is ready. This module doesn't import Django itself.
+"""
+import contextvars
+
+from statsd.client.base import StatsClientBase
+
+
+# The pipeline for the request being handled in this context, if any.
+_current = contextvars.ContextVar('statsd_pipeline', default=None)
+
+
+class RequestStatsClient(StatsClientBase):
+    """Send stats into the current request's pipeline, if there is one.
+
+    Outside of a request handled by :class:`StatsdMiddleware`, stats go
+    straight to `client`.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._prefix = client._prefix
+
+    def __getattr__(self, name):
+        # Anything else the client has, like flush(), dropped or errors.
+        if name.startswith('__') or name == '_client':
+            raise AttributeError(name)
+        return getattr(self._client, name)
+
+    def close(self):
+        self._client.close()
+
+    def pipeline(self):
+        pipe = _current.get()
+        if pipe is None:
+            return self._client.pipeline()
+        return pipe.pipeline()
+
+    def _after(self, data):
+        pipe = _current.get()
+        if pipe is None:
+            self._client._after(data)
+        else:
+            pipe._after(data)
+
+    def _after_many(self, datagrams):
+        pipe = _current.get()
+        if pipe is None:
+            return self._client._after_many(datagrams)
+        for data in datagrams:
+            pipe._after(data)
+        return len(datagrams)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.view_name:
+        return 'unresolved'
+    # Namespaced views are 'app:view', and ':' separates the value.
+    return match.view_name.replace(':', '.')
+
+
+class StatsdMiddleware:
+    """Time every view, and send each request's stats in one pipeline.
+
+    For every request this sends the time spent in the view as
+    ``view.<view name>.<method>`` and counts the response as
+    ``response.<status code>``, together with anything sent through `client`
+    while the request was handled. `client` defaults to the client in
+    :mod:`statsd.defaults.django`.
+    """
+
+    def __init__(self, get_response, client=None):
+        if client is None:
+            from statsd.defaults.django import statsd as client
+        self.get_response = get_response
+        self.client = client
+
+    def __call__(self, request):
+        pipe = self.client.pipeline()
+        token = _current.set(pipe)
+        try:
+            timer = pipe.timer('view').start()
+            response = self.get_response(request)
+            timer.stop(send=False)
+            pipe.timing('view.{}.{}'.format(_view_name(request),
+                                            request.method), timer.ms)
+            pipe.incr('response.{}'.format(response.status_code))
+            return response
+        finally:
+            _current.reset(token)
+            pipe.send()
@@ -0,0 +1,341 @@
+"""A small statsd server, for testing and load testing clients.
+
+It understands the line format the clients send (``name:value|type`` with an
+optional ``|@rate``) over UDP, TCP and Unix sockets, aggregates stats
+the way the statsd daemon does, and keeps count of what it received. It is
+not meant to replace a real statsd daemon: nothing is forwarded anywhere.
+
+Run it from the command line::
+
+    $ python -m statsd.server --udp 8125 --tcp 8125 --interval 10
+
+or in-process, e.g. in a test::
+
+    with StatsServer(udp=('127.0.0.1', 0)) as server:
+        client = StatsClient(*server.udp_address)
+        client.incr('foo')
+        server.wait(lines=1)
+        assert server.flush()['counters'] == {'foo': 1}
+"""
+import argparse
+import os
+import selectors
+import socket
+import threading
+import time
+
+
+class Aggregator:
+    """Parse lines and aggregate them per flush interval.
+
+    Like the statsd daemon, counters are scaled by their sample rate and
+    gauges keep their value from one interval to the next.
+    """
+
+    def __init__(self):
+        self.gauges = {}
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.sets = {}
+        self.timers = {}
+        self.packets = 0
+        self.bytes = 0
+        self.lines = 0
+        self.parsed = 0
+        self.dropped = 0
+        self.started = time.monotonic()
+
+    def add_packet(self, data, partial=b''):
+        """Count a packet and parse the complete lines in it.
+
+        Returns whatever is left after the last newline, for stream sockets
+        where lines may be split between reads. Pass that back in as
+        `partial` with the next read.
+        """
+        self.packets += 1
+        self.bytes += len(data)
+        lines = (partial + data).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line:
+                self.add_line(line)
+        return rest
+
+    def add_line(self, line):
+        """Parse and aggregate one line. Returns False if it was invalid."""
+        self.lines += 1
+        try:
+            name, _, rest = line.decode('ascii').partition(':')
+            fields = rest.split('|')
+            value, typ = fields[0], fields[1]
+            rate = 1.0
+            if len(fields) > 2:
+                if len(fields) > 3 or not fields[2].startswith('@'):
+                    raise ValueError(line)
+                rate = float(fields[2][1:])
+            if not name or not 0 < rate <= 1:
+                raise ValueError(line)
+
+            if typ == 'c':
+                self.counters[name] = (
+                    self.counters.get(name, 0) + float(value) / rate)
+            elif typ == 'g':
+                if value[:1] in ('+', '-'):
+                    self.gauges[name] = (
+                        self.gauges.get(name, 0) + float(value))
+                else:
+                    self.gauges[name] = float(value)
+            elif typ == 's':
+                self.sets.setdefault(name, set()).add(value)
+            elif typ == 'ms':
+                self._add_timer(name, float(value), rate)
+            else:
+                raise ValueError(line)
+        except (UnicodeDecodeError, ValueError, IndexError):
+            self.dropped += 1
+            return False
+        self.parsed += 1
+        return True
+
+    def _add_timer(self, name, value, rate):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = {
+                'count': 0, 'samples': 0, 'min': value, 'max': value,
+                'sum': 0.0}
+        timer['count'] += 1 / rate
+        timer['samples'] += 1
+        timer['min'] = min(timer['min'], value)
+        timer['max'] = max(timer['max'], value)
+        timer['sum'] += value
+
+    def snapshot(self):
+        """Return everything aggregated since the last reset."""
+        seconds = time.monotonic() - self.started
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'sets': {name: len(values) for name, values in self.sets.items()},
+            'timers': {
+                name: {
+                    'count': timer['count'],
+                    'min': timer['min'],
+                    'max': timer['max'],
+                    'mean': timer['sum'] / timer['samples'],
+                }
+                for name, timer in self.timers.items()
+            },
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'lines': self.lines,
+            'parsed': self.parsed,
+            'dropped': self.dropped,
+            'seconds': seconds,
+            'lines_per_sec': self.lines / seconds if seconds else 0,
+        }
+
+
+class StatsServer:
+    """Receive stats on any of a UDP, TCP and Unix socket.
+
+    `udp` and `tcp` are (host, port) addresses to listen on, and `unix` and
+    `unix_dgram` are paths for a Unix stream and datagram socket. Use port 0
+    to pick a free port; the bound addresses are available as `udp_address`,
+    `tcp_address`, `unix_path` and `unix_dgram_path`.
+
+    All sockets are served from a single background thread between start()
+    and stop(), or inside a `with` block.
+    """
+
+    def __init__(self, udp=None, tcp=None, unix=None, unix_dgram=None,
+                 rcvbuf=1 << 22):
+        self._aggregator = Aggregator()
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = None
+        self._buffer = bytearray(1 << 18)
+        self._view = memoryview(self._buffer)
+        self.udp_address = self.tcp_address = self.unix_path = None
+        self.unix_dgram_path = None
+
+        if udp is not None:
+            sock = self._bind(socket.SOCK_DGRAM, udp)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            self.udp_address = sock.getsockname()
+            self._selector.register(sock, selectors.EVENT_READ,
+                                    self._read_datagram)
+        if tcp is not None:
+            sock = self._bind(socket.SOCK_STREAM, tcp)
+            self.tcp_address = sock.getsockname()
+        if unix is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(unix)
+            self._listen(sock)
+            self.unix_path = unix
+        if unix_dgram is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            sock.bind(unix_dgram)
+            self.unix_dgram_path = unix_dgram
+            self._selector.register(sock, selectors.EVENT_READ,
+                                    self._read_datagram)
+
+    def _bind(self, kind, address):
+        family = socket.getaddrinfo(address[0], address[1], 0, kind)[0][0]
+        sock = socket.socket(family, kind)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        if kind == socket.SOCK_STREAM:
+            self._listen(sock)
+        return sock
+
+    def _listen(self, sock):
+        sock.listen(128)
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, self._accept)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, typ, value, tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True,
+                                        name='statsd-server')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close every socket."""
+        if self._thread is not None:
+            self._wake_w.send(b'x')
+            self._thread.join()
+            self._thread = None
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        self._wake_w.close()
+        for path in (self.unix_path, self.unix_dgram_path):
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+
+    def _serve(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    return
+                key.data(key.fileobj)
+
+    def _accept(self, sock):
+        try:
+            conn, _ = sock.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        partial = [b'']
+
+        def _read(conn):
+            try:
+                data = conn.recv(1 << 16)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b''
+            if not data:
+                self._selector.unregister(conn)
+                conn.close()
+                return
+            with self._lock:
+                partial[0] = self._aggregator.add_packet(data, partial[0])
+
+        self._selector.register(conn, selectors.EVENT_READ, _read)
+
+    def _read_datagram(self, sock):
+        # Unix datagrams can be much larger than UDP packets. Reading into
+        # one buffer keeps allocations out of the clients' benchmarks.
+        size = sock.recv_into(self._buffer)
+        data = bytes(self._view[:size])
+        with self._lock:
+            # Every datagram holds complete lines.
+            rest = self._aggregator.add_packet(data)
+            if rest:
+                self._aggregator.add_line(rest)
+
+    def snapshot(self):
+        """Return the stats aggregated so far in this interval."""
+        with self._lock:
+            return self._aggregator.snapshot()
+
+    def flush(self):
+        """Return the stats aggregated in this interval and start a new one."""
+        with self._lock:
+            snapshot = self._aggregator.snapshot()
+            self._aggregator.reset()
+            return snapshot
+
+    def wait(self, lines, timeout=5):
+        """Wait until `lines` lines have been received in this interval.
+
+        Returns False if that didn't happen within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while self._aggregator.lines < lines:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+
+def _print_flush(snapshot, verbose):
+    print('{lines} lines in {packets} packets ({bytes} bytes): '
+          '{parsed} parsed, {dropped} dropped, '
+          '{lines_per_sec:.0f} lines/s'.format(**snapshot), flush=True)
+    if verbose:
+        for typ in ('counters', 'gauges', 'sets', 'timers'):
+            for name, value in sorted(snapshot[typ].items()):
+                print('  {} {} {}'.format(typ[:-1], name, value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m statsd.server',
+        description='Receive and count statsd stats.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--udp', type=int, metavar='PORT',
+                        help='listen for UDP on PORT')
+    parser.add_argument('--tcp', type=int, metavar='PORT',
+                        help='listen for TCP on PORT')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix stream socket at PATH')
+    parser.add_argument('--unix-dgram', metavar='PATH',
+                        help='listen on a Unix datagram socket at PATH')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='seconds between reports (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='also print every aggregated stat')
+    args = parser.parse_args(argv)
+    if (args.udp is None and args.tcp is None and args.unix is None and
+            args.unix_dgram is None):
+        args.udp = 8125
+
+    server = StatsServer(
+        udp=None if args.udp is None else (args.host, args.udp),
+        tcp=None if args.tcp is None else (args.host, args.tcp),
+        unix=args.unix, unix_dgram=args.unix_dgram)
+    with server:
+        try:
+            while True:
+                time.sleep(args.interval)
+                _print_flush(server.flush(), args.verbose)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
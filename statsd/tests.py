@@ -1,14 +1,41 @@
 import asyncio
+import errno
 import functools
-import random
+import importlib
+import os
 import re
+import tempfile
+import random
 import socket
+import subprocess
+import sys
+import threading
+import time
 from datetime import timedelta
 from unittest import SkipTest, mock
 
+from statsd import AsyncStatsClient
+from statsd import AsyncTCPStatsClient
+from statsd import BufferedStatsClient
+from statsd import LazyClient
+from statsd import SharedStatsClient
 from statsd import StatsClient
 from statsd import TCPStatsClient
+from statsd import ThreadedStatsClient
+from statsd import UnixDatagramStatsClient
 from statsd import UnixSocketStatsClient
+from statsd.client import buffered
+from statsd.client import fork
+from statsd.client import profiling
+from statsd.client import resolver
+from statsd.client import sampling
+from statsd.client import sendmmsg
+from statsd.client import telemetry
+from statsd.client.profiling import Profiler
+from statsd.client.sketch import QuantileSketch
+from statsd.client.timer import Timer
+from statsd.defaults.middleware import RequestStatsClient, StatsdMiddleware
+from statsd.server import Aggregator, StatsServer
 
 
 ADDR = (socket.gethostbyname('localhost'), 8125)
@@ -68,7 +95,7 @@ def _unix_socket_client(prefix=None, socket_path=None):
 def _timer_check(sock, count, proto, start, end):
     send = send_method[proto](sock)
     eq_(send.call_count, count)
-    value = send.call_args[0][0].decode('ascii')
+    value = bytes(send.call_args[0][0]).decode('ascii')
     exp = re.compile(r'^{}:\d+|{}$'.format(start, end))
     assert exp.match(value)
 
@@ -156,21 +183,21 @@ def _test_incr(cl, proto):
     _sock_check(cl._sock, 4, proto, val='foo:10|c|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_incr_udp():
     """StatsClient.incr works."""
     cl = _udp_client()
     _test_incr(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_incr_tcp():
     """TCPStatsClient.incr works."""
     cl = _tcp_client()
     _test_incr(cl, 'tcp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_incr_unix_socket():
     """TCPStatsClient.incr works."""
     cl = _unix_socket_client()
@@ -191,21 +218,21 @@ def _test_decr(cl, proto):
     _sock_check(cl._sock, 4, proto, 'foo:-1|c|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_decr_udp():
     """StatsClient.decr works."""
     cl = _udp_client()
     _test_decr(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_decr_tcp():
     """TCPStatsClient.decr works."""
     cl = _tcp_client()
     _test_decr(cl, 'tcp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_decr_unix_socket():
     """TCPStatsClient.decr works."""
     cl = _unix_socket_client()
@@ -223,21 +250,21 @@ def _test_gauge(cl, proto):
     _sock_check(cl._sock, 3, proto, 'foo:70|g|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_udp():
     """StatsClient.gauge works."""
     cl = _udp_client()
     _test_gauge(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_tcp():
     """TCPStatsClient.gauge works."""
     cl = _tcp_client()
     _test_gauge(cl, 'tcp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_unix_socket():
     """TCPStatsClient.decr works."""
     cl = _unix_socket_client()
@@ -306,14 +333,14 @@ def _test_gauge_delta(cl, proto):
         _check(num, result)
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_delta_udp():
     """StatsClient.gauge works with delta values."""
     cl = _udp_client()
     _test_gauge_delta(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_delta_tcp():
     """TCPStatsClient.gauge works with delta values."""
     cl = _tcp_client()
@@ -325,14 +352,14 @@ def _test_gauge_absolute_negative(cl, proto):
     _sock_check(cl._sock, 1, 'foo:0|g\nfoo:-5|g')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_absolute_negative_udp():
     """StatsClient.gauge works with absolute negative value."""
     cl = _udp_client()
     _test_gauge_delta(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_gauge_absolute_negative_tcp():
     """TCPStatsClient.gauge works with absolute negative value."""
     cl = _tcp_client()
@@ -350,14 +377,14 @@ def _test_gauge_absolute_negative_rate(cl, proto, mock_random):
     _sock_check(cl._sock, 1, proto, 'foo:0|g\nfoo:-1|g')
 
 
-@mock.patch.object(random, 'random')
+@mock.patch.object(sampling, 'random')
 def test_gauge_absolute_negative_rate_udp(mock_random):
     """StatsClient.gauge works with absolute negative value and rate."""
     cl = _udp_client()
     _test_gauge_absolute_negative_rate(cl, 'udp', mock_random)
 
 
-@mock.patch.object(random, 'random')
+@mock.patch.object(sampling, 'random')
 def test_gauge_absolute_negative_rate_tcp(mock_random):
     """TCPStatsClient.gauge works with absolute negative value and rate."""
     cl = _tcp_client()
@@ -378,14 +405,14 @@ def _test_set(cl, proto):
     _sock_check(cl._sock, 4, proto, 'foo:2.3|s|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_set_udp():
     """StatsClient.set works."""
     cl = _udp_client()
     _test_set(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_set_tcp():
     """TCPStatsClient.set works."""
     cl = _tcp_client()
@@ -403,14 +430,14 @@ def _test_timing(cl, proto):
     _sock_check(cl._sock, 3, proto, 'foo:100.000000|ms|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timing_udp():
     """StatsClient.timing works."""
     cl = _udp_client()
     _test_timing(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timing_tcp():
     """TCPStatsClient.timing works."""
     cl = _tcp_client()
@@ -428,7 +455,7 @@ def test_timing_supports_timedelta():
     _sock_check(cl._sock, 2, proto, 'foo:129600000.000000|ms')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timing_unix_socket():
     """UnixSocketStatsClient.timing works."""
     cl = _unix_socket_client()
@@ -443,21 +470,21 @@ def _test_prepare(cl, proto):
     )
 
     def _check(o, s, v, r):
-        with mock.patch.object(random, 'random', lambda: -1):
+        with mock.patch.object(sampling, 'random', lambda: -1):
             eq_(o, cl._prepare(s, v, r))
 
     for o, (s, v, r) in tests:
         _check(o, s, v, r)
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_prepare_udp():
     """Test StatsClient._prepare method."""
     cl = _udp_client()
     _test_prepare(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_prepare_tcp():
     """Test TCPStatsClient._prepare method."""
     cl = _tcp_client()
@@ -469,21 +496,21 @@ def _test_prefix(cl, proto):
     _sock_check(cl._sock, 1, proto, 'foo.bar:1|c')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_prefix_udp():
     """StatsClient.incr works."""
     cl = _udp_client(prefix='foo')
     _test_prefix(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_prefix_tcp():
     """TCPStatsClient.incr works."""
     cl = _tcp_client(prefix='foo')
     _test_prefix(cl, 'tcp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_prefix_unix_socket():
     """UnixSocketStatsClient.incr works."""
     cl = _unix_socket_client(prefix='foo')
@@ -567,14 +594,14 @@ def _test_timer_context_rate(cl, proto):
     _timer_check(cl._sock, 1, proto, 'foo', 'ms|@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_context_rate_udp():
     """StatsClient.timer can be used as manager with rate."""
     cl = _udp_client()
     _test_timer_context_rate(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_context_rate_tcp():
     """TCPStatsClient.timer can be used as manager with rate."""
     cl = _tcp_client()
@@ -609,14 +636,14 @@ def _test_timer_decorator_rate(cl, proto):
     _timer_check(cl._sock, 2, proto, 'bar', 'ms|@0.2')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_decorator_rate_udp():
     """StatsClient.timer can be used as decorator with rate."""
     cl = _udp_client()
     _test_timer_decorator_rate(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_decorator_rate_tcp():
     """TCPStatsClient.timer can be used as decorator with rate."""
     cl = _tcp_client()
@@ -734,14 +761,14 @@ def _test_timer_object_rate(cl, proto):
     _timer_check(cl._sock, 1, proto, 'foo', 'ms@0.5')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_object_rate_udp():
     """StatsClient.timer works with rate."""
     cl = _udp_client()
     _test_timer_object_rate(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: -1)
+@mock.patch.object(sampling, 'random', lambda: -1)
 def test_timer_object_rate_tcp():
     """TCPStatsClient.timer works with rate."""
     cl = _tcp_client()
@@ -809,6 +836,83 @@ def test_timer_object_stop_without_start_tcp():
     _test_timer_object_stop_without_start(cl)
 
 
+@mock.patch('statsd.client.timer.time_now')
+def test_timer_precision(mock_time):
+    """Timers are sent with `precision` decimal places."""
+    mock_time.side_effect = [0, 0.00125, 0, 0.001234567, 0, 0.0015]
+    cl = _udp_client()
+    with cl.timer('foo') as t:
+        pass
+    _sock_check(cl._sock, 1, 'udp', 'foo:1.250000|ms')
+    eq_(1.25, t.ms)
+
+    with cl.timer('foo', precision=2):
+        pass
+    _sock_check(cl._sock, 2, 'udp', 'foo:1.23|ms')
+
+    @cl.timer('bar', precision=0)
+    def bar():
+        pass
+
+    bar()
+    _sock_check(cl._sock, 3, 'udp', 'bar:2|ms')
+
+    with assert_raises(ValueError):
+        cl.timer('foo', precision=7)
+
+
+@mock.patch('statsd.client.timer.time_now')
+def test_timer_reuse(mock_time):
+    """One Timer can be used again and again."""
+    mock_time.side_effect = [0, 0.001, 0.005, 0.007]
+    cl = _udp_client()
+    timer = cl.timer('foo')
+    with timer:
+        pass
+    _sock_check(cl._sock, 1, 'udp', 'foo:1.000000|ms')
+    with timer:
+        pass
+    _sock_check(cl._sock, 2, 'udp', 'foo:2.000000|ms')
+    assert not hasattr(timer, '__dict__')
+
+
+def test_timer_timing_override():
+    """Timers send through timing(), however a client implements it."""
+    sent = []
+
+    class Client(StatsClient):
+        def timing(self, stat, delta, rate=1, precision=6):
+            sent.append((stat, precision))
+
+    cl = Client()
+    with cl.timer('foo'):
+        pass
+    with cl.timer('bar', precision=3):
+        pass
+    eq_([('foo', 6), ('bar', 3)], sent)
+
+    cl = _udp_client()
+    cl.timing = mock.Mock()
+    with cl.timer('foo'):
+        pass
+    eq_('foo', cl.timing.call_args[0][0])
+
+    # Clients that only have a timing() method work, too.
+    client = mock.Mock(spec=['timing'])
+    with Timer(client, 'foo'):
+        pass
+    eq_(1, client.timing.call_count)
+
+
+@mock.patch('statsd.client.timer.time_now')
+def test_timer_buffered_summary(mock_time):
+    mock_time.side_effect = [0, 0.002]
+    cl = BufferedStatsClient(_udp_client(), summarize_timers=True)
+    with cl.timer('foo'):
+        pass
+    eq_(2.0, cl._timers['foo'].max)
+
+
 def _test_pipeline(cl, proto):
     pipe = cl.pipeline()
     pipe.incr('foo')
@@ -1001,20 +1105,53 @@ def _test_rate_no_send(cl, proto):
     _sock_check(cl._sock, 0, proto)
 
 
-@mock.patch.object(random, 'random', lambda: 2)
+@mock.patch.object(sampling, 'random', lambda: 2)
 def test_rate_no_send_udp():
     """Rate below random value prevents sending with StatsClient.incr."""
     cl = _udp_client()
     _test_rate_no_send(cl, 'udp')
 
 
-@mock.patch.object(random, 'random', lambda: 2)
+@mock.patch.object(sampling, 'random', lambda: 2)
 def test_rate_no_send_tcp():
     """Rate below random value prevents sending with TCPStatsClient.incr."""
     cl = _tcp_client()
     _test_rate_no_send(cl, 'tcp')
 
 
+@mock.patch.object(sampling, 'random', lambda: 2)
+def test_rate_no_format():
+    """Values are not formatted for stats that aren't sent."""
+    cl = _udp_client()
+    unformattable = object()
+    cl.incr('foo', unformattable, rate=0.5)
+    cl.timing('foo', unformattable, rate=0.5)
+    cl.gauge('foo', 1, rate=0.5)
+    cl.set('foo', unformattable, rate=0.5)
+    _sock_check(cl._sock, 0, 'udp')
+
+
+def test_sampling_random():
+    """The sampling random source returns floats in [0, 1)."""
+    values = [sampling.random() for _ in range(100)]
+    assert all(0 <= v < 1 for v in values)
+
+
+def test_sampling_thread_random():
+    """Each thread gets its own generator without a GIL."""
+    local = sampling._ThreadRandom()
+    generators = []
+
+    def _get():
+        generators.append(local.random)
+
+    thread = threading.Thread(target=_get)
+    thread.start()
+    thread.join()
+    _get()
+    assert generators[0] is not generators[1]
+
+
 def test_socket_error():
     """Socket error on StatsClient should be ignored."""
     cl = _udp_client()
@@ -1036,6 +1173,119 @@ def test_pipeline_packet_size():
     assert len(sc._sock.sendto.call_args_list[1][0][0]) <= 512
 
 
+def test_pipeline_packet_boundaries():
+    """Pipelines pack stats in order, splitting before maxudpsize."""
+    sc = _udp_client()
+    sc._maxudpsize = 16
+    with sc.pipeline() as pipe:
+        pipe.incr('a')  # 5 bytes
+        pipe.incr('bb')  # 6 bytes
+        pipe.incr('ccccccccccccc')  # 17 bytes, too big for any packet
+        pipe.incr('d')
+        pipe.incr('e')
+    eq_([b'a:1|c\nbb:1|c', b'ccccccccccccc:1|c', b'd:1|c\ne:1|c'],
+        [bytes(c[0][0]) for c in sc._sock.sendto.call_args_list])
+
+
+def test_pipeline_nested_udp():
+    """Packets from a nested pipeline are repacked by the outer one."""
+    sc = _udp_client()
+    with sc.pipeline() as outer:
+        outer.incr('foo')
+        with outer.pipeline() as inner:
+            inner.incr('bar')
+            inner.incr('baz')
+    _sock_check(sc._sock, 1, 'udp', 'foo:1|c\nbar:1|c\nbaz:1|c')
+
+
+def _test_pipeline_batch_send(family, host):
+    try:
+        server = socket.socket(family, socket.SOCK_DGRAM)
+        server.bind((host, 0))
+    except OSError:
+        raise SkipTest('Address family not available')
+    server.settimeout(1)
+    sc = StatsClient(host, server.getsockname()[1],
+                     ipv6=family == socket.AF_INET6)
+    try:
+        with sc.pipeline() as pipe:
+            for x in range(100):
+                pipe.incr('sixteen_chr_%03d' % x)
+            sent = pipe._send()
+        packets = [server.recv(512) for _ in range(sent)]
+    finally:
+        sc.close()
+        server.close()
+    # 16 bytes per stat + newline, so 30 stats fit in each packet.
+    eq_(4, sent)
+    stats = b'\n'.join(packets).split(b'\n')
+    eq_(['sixteen_chr_%03d:1|c' % x for x in range(100)],
+        [s.decode('ascii') for s in stats])
+
+
+def test_pipeline_batch_send_ipv4():
+    """UDP pipelines send all their packets in one batch."""
+    _test_pipeline_batch_send(socket.AF_INET, '127.0.0.1')
+
+
+def test_pipeline_batch_send_ipv6():
+    """UDP pipelines send all their packets in one batch over IPv6."""
+    _test_pipeline_batch_send(socket.AF_INET6, '::1')
+
+
+@mock.patch.object(sendmmsg, '_sendmmsg', None)
+def test_pipeline_batch_send_fallback():
+    """Without sendmmsg, pipelines send their packets one at a time."""
+    _test_pipeline_batch_send(socket.AF_INET, '127.0.0.1')
+
+
+def test_send_many_counts_errors():
+    """send_many reports how many packets were accepted."""
+    sock = mock.Mock()
+    sock.sendto.side_effect = [None, socket.error, None]
+    eq_(2, sendmmsg.send_many(sock, [b'a', b'b', b'c'], ADDR))
+    eq_(3, sock.sendto.call_count)
+
+
+def test_send_many_syscalls():
+    """sendmmsg hands every packet to the kernel at once."""
+    if not sendmmsg._available():
+        raise SkipTest('sendmmsg is not available')
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    real = sendmmsg._sendmmsg
+    try:
+        with mock.patch.object(sendmmsg, '_sendmmsg',
+                               mock.Mock(wraps=real)) as mock_sendmmsg:
+            eq_(3, sendmmsg.send_many(sock, [b'a', bytearray(b'b'), b'c'],
+                                      server.getsockname()))
+        eq_(1, mock_sendmmsg.call_count)
+        eq_([b'a', b'b', b'c'], [server.recv(8) for _ in range(3)])
+    finally:
+        sock.close()
+        server.close()
+
+
+@mock.patch.object(sendmmsg, '_sendmmsg', sendmmsg._NOT_LOADED)
+def test_send_many_no_ctypes():
+    """Without ctypes, batches are sent one datagram at a time."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        with mock.patch.dict(sys.modules, {'ctypes': None}):
+            eq_(2, sendmmsg.send_many(sock, [b'a', b'b'],
+                                      server.getsockname()))
+        eq_(None, sendmmsg._sendmmsg)
+        eq_([b'a', b'b'], [server.recv(8) for _ in range(2)])
+    finally:
+        sock.close()
+        server.close()
+
+
 @mock.patch.object(socket, 'socket')
 def test_tcp_raises_exception_to_user(mock_socket):
     """Socket errors in TCPStatsClient should be raised to user."""
@@ -1064,3 +1314,2123 @@ def test_unix_socket_timeout(mock_socket):
     cl = UnixSocketStatsClient(UNIX_SOCKET, timeout=test_timeout)
     cl.incr('foo')
     cl._sock.settimeout.assert_called_once_with(test_timeout)
+
+
+def test_stream_coalesce_tcp():
+    """Stream clients with a buffer_size coalesce lines into one write."""
+    cl = _tcp_client()
+    cl._init_buffer(buffer_size=24, flush_interval=60)
+    cl.incr('foo')
+    cl.incr('bar')
+    _sock_check(cl._sock, 0, 'tcp')
+    cl.gauge('baz', -1)
+    _sock_check(cl._sock, 1, 'tcp', 'foo:1|c\nbar:1|c\nbaz:0|g\nbaz:-1|g')
+
+
+def test_stream_coalesce_unix_socket():
+    """Coalesced lines are flushed on flush() and close()."""
+    cl = _unix_socket_client()
+    cl._init_buffer(buffer_size=1000, flush_interval=60)
+    sock = cl._sock
+    cl.flush()
+    _sock_check(sock, 0, 'unix')
+    cl.incr('foo')
+    cl.flush()
+    _sock_check(sock, 1, 'unix', 'foo:1|c')
+    with cl.pipeline() as pipe:
+        pipe.incr('bar')
+        pipe.incr('baz')
+    cl.close()
+    _sock_check(sock, 2, 'unix', 'bar:1|c\nbaz:1|c')
+    eq_(None, cl._sock)
+
+
+def test_stream_flush_order():
+    """Lines taken by flush() are written before any newer ones."""
+    cl = _tcp_client()
+    cl._init_buffer(buffer_size=10, flush_interval=60)
+    cl.gauge('foo', 1)
+    taken = threading.Event()
+    take_all = cl._take_all
+
+    def _take_all():
+        data = take_all()
+        taken.set()
+        # Give the other thread time to write, if it can.
+        threading.Event().wait(0.1)
+        return data
+
+    cl._take_all = _take_all
+    flusher = threading.Thread(target=cl.flush)
+    flusher.start()
+    taken.wait(5)
+    cl.gauge('foo', 2)
+    cl.gauge('foo', 3)
+    flusher.join()
+    eq_([b'foo:1|g\n', b'foo:2|g\nfoo:3|g\n'],
+        [bytes(c[0][0]) for c in cl._sock.sendall.call_args_list])
+
+
+@mock.patch('statsd.client.stream.time_now')
+def test_stream_coalesce_interval(mock_time):
+    """Coalesced lines are written once flush_interval has passed."""
+    mock_time.return_value = 0
+    cl = _tcp_client()
+    cl._init_buffer(buffer_size=1000, flush_interval=1)
+    cl.incr('foo')
+    _sock_check(cl._sock, 0, 'tcp')
+    mock_time.return_value = 1
+    cl.incr('bar')
+    _sock_check(cl._sock, 1, 'tcp', 'foo:1|c\nbar:1|c')
+
+
+@mock.patch.object(socket, 'socket')
+def test_tcp_nodelay(mock_socket):
+    """TCP_NODELAY is set on the socket if asked for."""
+    cl = TCPStatsClient(nodelay=True)
+    cl.incr('foo')
+    cl._sock.setsockopt.assert_called_once_with(
+        socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def test_stream_nonblocking_backlog():
+    """Non-blocking stream clients keep what can't be sent in a backlog."""
+    cl = _tcp_client()
+    cl._init_backlog(blocking=False, max_backlog=20)
+    send = cl._sock.send
+    send.side_effect = [3, BlockingIOError, BlockingIOError]
+    cl.incr('foo')
+    cl.incr('bar')
+    cl.incr('baz')
+    eq_(1, cl.dropped)
+    eq_(13, cl._backlog_size)
+
+    send.reset_mock(side_effect=True)
+    send.side_effect = len
+    cl.flush()
+    eq_([b':1|c\n', b'bar:1|c\n'],
+        [bytes(c[0][0]) for c in send.call_args_list])
+    eq_(0, cl._backlog_size)
+    cl.incr('foo')
+    eq_(b'foo:1|c\n', bytes(send.call_args[0][0]))
+
+
+def test_stream_nonblocking_close():
+    """Closing a non-blocking stream client drops its backlog."""
+    cl = _unix_socket_client()
+    cl._init_backlog(blocking=False, max_backlog=100)
+    cl._sock.send.side_effect = [4, BlockingIOError, BlockingIOError,
+                                 BlockingIOError]
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('bar')
+    cl.incr('baz')
+    cl.close()
+    eq_(3, cl.dropped)
+    eq_(0, cl._backlog_size)
+
+
+def test_stream_nonblocking_socket():
+    """Lines are never split or reordered when the receiver stalls."""
+    sock, peer = socket.socketpair()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    sock.setblocking(False)
+    try:
+        cl = _unix_socket_client()
+        cl._init_backlog(blocking=False, max_backlog=1000)
+        cl._sock = sock
+        for i in range(10000):
+            cl.incr('foo.%d' % i)
+        assert cl.dropped > 0
+
+        received = b''
+        peer.settimeout(0.1)
+        while True:
+            cl.flush()
+            try:
+                data = peer.recv(1 << 16)
+            except socket.timeout:
+                break
+            received += data
+        lines = received.decode('ascii').split('\n')
+        eq_('', lines.pop())
+        eq_(10000, len(lines) + cl.dropped)
+        numbers = [int(re.match(r'^foo\.(\d+):1\|c$', line).group(1))
+                   for line in lines]
+        eq_(sorted(numbers), numbers)
+    finally:
+        sock.close()
+        peer.close()
+
+
+@mock.patch.object(socket, 'socket')
+def test_stream_reconnect_broken_pipe(mock_socket):
+    """A broken connection is replaced and the write retried."""
+    mock_socket.side_effect = lambda *args: mock.Mock()
+    cl = TCPStatsClient(reconnect=True)
+    cl.incr('foo')
+    sock = cl._sock
+    sock.sendall.side_effect = BrokenPipeError
+    cl.incr('bar')
+    sock.close.assert_called_once_with()
+    assert cl._sock is not sock
+    _sock_check(cl._sock, 1, 'tcp', 'bar:1|c')
+    eq_(0, cl.dropped)
+
+
+@mock.patch('statsd.client.stream.time_now')
+@mock.patch.object(socket, 'socket')
+def test_stream_reconnect_backoff(mock_socket, mock_time):
+    """Failed connections are retried with exponential backoff."""
+    mock_time.return_value = 0
+    sock = mock_socket.return_value
+    sock.connect.side_effect = ConnectionRefusedError
+    cl = UnixSocketStatsClient(UNIX_SOCKET, reconnect=True, min_backoff=1,
+                               max_backoff=3)
+
+    def _attempts(now, count):
+        mock_time.return_value = now
+        with cl.pipeline() as pipe:
+            pipe.incr('foo')
+            pipe.incr('bar')
+        eq_(count, sock.connect.call_count)
+
+    _attempts(0, 1)
+    _attempts(0.5, 1)
+    _attempts(1, 2)
+    _attempts(2.5, 2)
+    _attempts(3, 3)
+    _attempts(5.5, 3)
+    _attempts(6, 4)
+    _attempts(8.5, 4)
+    _attempts(9, 5)
+    eq_(18, cl.dropped)
+
+    sock.connect.side_effect = None
+    _attempts(12, 6)
+    _sock_check(sock, 1, 'unix', 'foo:1|c\nbar:1|c')
+    eq_(1, cl._backoff)
+
+
+def _buffered_client(prefix=None, flush_interval=60, max_buffer=1000):
+    return BufferedStatsClient(_udp_client(prefix=prefix),
+                               flush_interval=flush_interval,
+                               max_buffer=max_buffer)
+
+
+def test_buffered_counters():
+    """BufferedStatsClient sums counters until flushed."""
+    cl = _buffered_client()
+    cl.incr('foo')
+    cl.incr('foo', 10)
+    cl.decr('foo', 2)
+    cl.incr('bar')
+    _sock_check(cl._client._sock, 0, 'udp')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:9|c\nbar:1|c')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_buffered_counters_rate():
+    """BufferedStatsClient keeps sampled counters apart."""
+    cl = _buffered_client()
+    cl.incr('foo', rate=0.5)
+    cl.incr('foo', rate=0.5)
+    cl.incr('foo')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:2|c|@0.5\nfoo:1|c')
+
+
+@mock.patch.object(sampling, 'random', lambda: 2)
+def test_buffered_rate_no_send():
+    """BufferedStatsClient drops samples before buffering them."""
+    cl = _buffered_client()
+    cl.incr('foo', rate=0.5)
+    cl.gauge('bar', 1, rate=0.5)
+    cl.set('baz', 1, rate=0.5)
+    cl.flush()
+    _sock_check(cl._client._sock, 0, 'udp')
+
+
+def test_buffered_gauges():
+    """BufferedStatsClient keeps the last gauge value and folds deltas."""
+    cl = _buffered_client()
+    cl.gauge('foo', 10)
+    cl.gauge('foo', 20)
+    cl.gauge('foo', 5, delta=True)
+    cl.gauge('bar', 3, delta=True)
+    cl.gauge('bar', -5, delta=True)
+    cl.gauge('baz', 1, delta=True)
+    cl.gauge('baz', -4)
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp',
+                'foo:25|g\nbar:-2|g\nbaz:0|g\nbaz:-4|g')
+
+
+def test_buffered_handles():
+    """BufferedStatsClient aggregates stats sent through handles."""
+    cl = _buffered_client(prefix='pre')
+    counter = cl.counter('foo')
+    gauge = cl.gauge_handle('bar')
+    for i in range(3):
+        counter.incr()
+        gauge.gauge(i + 1)
+    counter.decr(2)
+    gauge.gauge(5, delta=True)
+    _sock_check(cl._client._sock, 0, 'udp')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'pre.foo:1|c\npre.bar:8|g')
+
+
+def test_buffered_sets():
+    """BufferedStatsClient deduplicates set members."""
+    cl = _buffered_client()
+    cl.set('foo', 'a')
+    cl.set('foo', 'b')
+    cl.set('foo', 'a')
+    cl.flush()
+    value = bytes(cl._client._sock.sendto.call_args[0][0])
+    eq_({b'foo:a|s', b'foo:b|s'}, set(value.split(b'\n')))
+
+
+def test_buffered_timing_and_pipeline():
+    """Timers and pipelines are buffered as-is."""
+    cl = _buffered_client(prefix='pre')
+    cl.timing('foo', 100)
+    with cl.pipeline() as pipe:
+        pipe.timing('bar', 200)
+        pipe.incr('baz')
+    _sock_check(cl._client._sock, 0, 'udp')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp',
+                'pre.foo:100.000000|ms\npre.bar:200.000000|ms\n'
+                'pre.baz:1|c')
+
+
+def test_buffered_max_buffer():
+    """BufferedStatsClient flushes once the buffer is full."""
+    cl = _buffered_client(max_buffer=3)
+    cl.incr('foo')
+    cl.incr('foo')
+    cl.incr('bar')
+    _sock_check(cl._client._sock, 0, 'udp')
+    cl.incr('baz')
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:2|c\nbar:1|c\nbaz:1|c')
+
+
+def test_buffered_flush_at_exit():
+    """Buffered stats are flushed when the interpreter exits."""
+    cl = _buffered_client()
+    cl.incr('foo')
+    assert cl in buffered._clients
+    buffered._flush_all()
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:1|c')
+    cl.close()
+    assert cl not in buffered._clients
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    code = (
+        'from statsd import *\n'
+        'cl = BufferedStatsClient(ThreadedStatsClient('
+        'StatsClient("127.0.0.1", {})))\n'
+        'cl.incr("foo")\n'.format(server.getsockname()[1]))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       env=dict(os.environ, PYTHONPATH=root))
+        eq_(b'foo:1|c', server.recv(512))
+    finally:
+        server.close()
+
+
+def test_buffered_flush_interval():
+    """BufferedStatsClient flushes after the flush interval."""
+    cl = _buffered_client(flush_interval=0)
+    cl.incr('foo')
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:1|c')
+
+
+def test_buffered_flush_thread():
+    """A background thread flushes an idle BufferedStatsClient."""
+    cl = _buffered_client(flush_interval=0.01)
+    cl._next_flush += 60
+    cl.incr('foo')
+    sendto = cl._client._sock.sendto
+    for _ in range(100):
+        if sendto.call_count:
+            break
+        time.sleep(0.01)
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:1|c')
+    thread = cl._thread
+    cl.close()
+    assert not thread.is_alive()
+    eq_(None, cl._thread)
+
+
+def test_buffered_packet_size():
+    """Buffered flushes are packed by the wrapped client's pipeline."""
+    cl = _buffered_client()
+    for x in range(32):
+        cl.incr('sixteen_chr_%02d' % x)
+    cl.flush()
+    sendto = cl._client._sock.sendto
+    eq_(2, sendto.call_count)
+    assert len(sendto.call_args_list[0][0][0]) <= 512
+    assert len(sendto.call_args_list[1][0][0]) <= 512
+
+
+def test_buffered_timer_summaries():
+    """BufferedStatsClient can summarize timers as gauges."""
+    cl = BufferedStatsClient(_udp_client(), flush_interval=60,
+                             summarize_timers=True, quantiles=(0.5, 0.999))
+    for ms in range(1, 101):
+        cl.timing('foo', ms)
+    cl.flush()
+    sendto = cl._client._sock.sendto
+    lines = b'\n'.join(bytes(c[0][0]) for c in sendto.call_args_list)
+    values = {}
+    for line in lines.split(b'\n'):
+        name, value = line.decode('ascii').split(':')
+        eq_('|g', value[-2:])
+        values[name] = float(value[:-2])
+    eq_({'foo.count', 'foo.min', 'foo.max', 'foo.mean', 'foo.p50',
+         'foo.p99_9'}, set(values))
+    eq_(100, values['foo.count'])
+    eq_(1, values['foo.min'])
+    eq_(100, values['foo.max'])
+    eq_(50.5, values['foo.mean'])
+    assert abs(values['foo.p50'] - 50) <= 0.5
+    assert abs(values['foo.p99_9'] - 100) <= 1
+
+
+def test_buffered_timer_summaries_timer():
+    """Timer objects are summarized transparently."""
+    cl = BufferedStatsClient(_udp_client(), flush_interval=60,
+                             summarize_timers=True)
+
+    @cl.timer('foo')
+    def foo():
+        pass
+
+    for _ in range(10):
+        foo()
+    with cl.timer('foo'):
+        pass
+    cl.flush()
+    sendto = cl._client._sock.sendto
+    lines = b'\n'.join(bytes(c[0][0]) for c in sendto.call_args_list)
+    assert b'foo.count:11|g' in lines.split(b'\n')
+
+
+def test_buffered_timer_summaries_handle():
+    """Timings sent through a timer handle are summarized too."""
+    cl = BufferedStatsClient(_udp_client(), flush_interval=60,
+                             summarize_timers=True)
+    handle = cl.timer_handle('foo')
+    handle.timing(5)
+    handle.timing(timedelta(milliseconds=15))
+    _sock_check(cl._client._sock, 0, 'udp')
+    cl.flush()
+    sendto = cl._client._sock.sendto
+    lines = b'\n'.join(bytes(c[0][0]) for c in sendto.call_args_list)
+    lines = lines.split(b'\n')
+    assert b'foo.count:2|g' in lines
+    assert b'foo.max:15.0|g' in lines
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_buffered_timer_summaries_rate():
+    """Sampled timers are weighted by their sample rate."""
+    cl = BufferedStatsClient(_udp_client(), flush_interval=60,
+                             summarize_timers=True)
+    for _ in range(5):
+        cl.timing('foo', 10, rate=0.5)
+    cl.flush()
+    sendto = cl._client._sock.sendto
+    lines = b'\n'.join(bytes(c[0][0]) for c in sendto.call_args_list)
+    assert b'foo.count:10|g' in lines.split(b'\n')
+
+
+def test_quantile_sketch_accuracy():
+    """QuantileSketch quantiles stay within the relative accuracy."""
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    values = [random.Random(x).expovariate(0.01) for x in range(10000)]
+    for value in values:
+        sketch.add(value)
+    values.sort()
+    for q in (0.1, 0.5, 0.9, 0.99):
+        exact = values[int(q * len(values)) - 1]
+        assert abs(sketch.quantile(q) - exact) <= 0.011 * exact, q
+    eq_(values[0], sketch.min)
+    eq_(values[-1], sketch.max)
+
+
+def test_quantile_sketch_bounded():
+    """QuantileSketch never keeps more than max_buckets buckets."""
+    sketch = QuantileSketch(max_buckets=10)
+    for x in range(1, 100000, 7):
+        sketch.add(x)
+    eq_(10, len(sketch._buckets))
+    assert abs(sketch.quantile(0.99) - 99000) <= 0.01 * 99000
+
+
+def test_quantile_sketch_zero():
+    """QuantileSketch counts non-positive values as zero."""
+    sketch = QuantileSketch()
+    eq_(None, sketch.quantile(0.5))
+    sketch.add(0)
+    sketch.add(0)
+    sketch.add(5)
+    eq_(0, sketch.quantile(0.5))
+    assert abs(sketch.quantile(1) - 5) <= 0.05
+
+
+def test_buffered_tcp():
+    """BufferedStatsClient works with stream clients."""
+    cl = BufferedStatsClient(_tcp_client(), flush_interval=60)
+    cl.incr('foo')
+    cl.incr('foo')
+    cl.gauge('bar', 1)
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'tcp', 'foo:2|c\nbar:1|g')
+
+
+def test_buffered_close():
+    """Closing a BufferedStatsClient flushes and closes the client."""
+    cl = _buffered_client()
+    sock = cl._client._sock
+    cl.incr('foo')
+    cl.close()
+    _sock_check(sock, 1, 'udp', 'foo:1|c')
+    sock.close.assert_called_once_with()
+
+
+def test_threaded_send():
+    """ThreadedStatsClient sends stats from its own thread."""
+    cl = ThreadedStatsClient(_udp_client(prefix='foo'))
+    threads = []
+    cl._client._sock.sendto.side_effect = (
+        lambda *a: threads.append(threading.current_thread()))
+    cl.incr('bar')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'foo.bar:1|c')
+    eq_([cl._thread], threads)
+    cl.close()
+
+
+def test_threaded_pipeline():
+    """ThreadedStatsClient pipelines are packed by the wrapped client."""
+    cl = ThreadedStatsClient(_tcp_client())
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.gauge('bar', -1)
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'tcp', 'foo:1|c\nbar:0|g\nbar:-1|g')
+    cl.close()
+
+
+def _blocked_threaded_client(**kwargs):
+    cl = ThreadedStatsClient(_udp_client(), queue_size=1, **kwargs)
+    sending = threading.Event()
+    release = threading.Event()
+
+    def _sendto(*args):
+        sending.set()
+        release.wait()
+
+    cl._client._sock.sendto.side_effect = _sendto
+    cl.incr('foo')
+    sending.wait()
+    return cl, release
+
+
+def test_threaded_drop_on_full():
+    """ThreadedStatsClient drops and counts stats when the queue is full."""
+    cl, release = _blocked_threaded_client()
+    cl.incr('bar')
+    cl.incr('baz')
+    cl.incr('qux')
+    eq_(2, cl.dropped)
+    sock = cl._client._sock
+    release.set()
+    cl.close()
+    _sock_check(sock, 2, 'udp', 'bar:1|c')
+
+
+def test_threaded_socket_error():
+    """Errors in the sender thread are counted as drops."""
+    cl = ThreadedStatsClient(_tcp_client())
+    cl._client._sock.sendall.side_effect = socket.error
+    cl.incr('foo')
+    cl.flush()
+    eq_(1, cl.dropped)
+    cl.close()
+
+
+def test_threaded_close():
+    """Closing a ThreadedStatsClient sends queued stats first."""
+    cl = ThreadedStatsClient(_udp_client())
+    sock = cl._client._sock
+    cl.incr('foo')
+    cl.close()
+    _sock_check(sock, 1, 'udp', 'foo:1|c')
+    sock.close.assert_called_once_with()
+    assert cl._thread is None
+    cl.close()
+
+
+def _run_async(coro):
+    event_loop = asyncio.new_event_loop()
+    try:
+        return event_loop.run_until_complete(coro)
+    finally:
+        event_loop.close()
+
+
+def test_async_udp():
+    """AsyncStatsClient sends datagrams on the event loop."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+
+    async def _test():
+        cl = AsyncStatsClient('127.0.0.1', server.getsockname()[1],
+                              prefix='foo')
+        await cl.connect()
+        cl.incr('bar')
+        with cl.pipeline() as pipe:
+            pipe.incr('baz')
+            pipe.timing('qux', 100)
+        await asyncio.sleep(0)
+        cl.close()
+        return cl
+
+    try:
+        cl = _run_async(_test())
+        eq_(b'foo.bar:1|c', server.recv(512))
+        eq_(b'foo.baz:1|c\nfoo.qux:100.000000|ms', server.recv(512))
+        eq_(0, cl.dropped)
+    finally:
+        server.close()
+
+
+def test_async_tcp():
+    """AsyncTCPStatsClient writes lines on the event loop."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    server.settimeout(1)
+
+    async def _test():
+        cl = AsyncTCPStatsClient('127.0.0.1', server.getsockname()[1],
+                                 timeout=1)
+        await cl.connect()
+        cl.incr('foo')
+        cl.gauge('bar', -1)
+        cl.close()
+        await asyncio.sleep(0)
+
+    try:
+        _run_async(_test())
+        conn, _ = server.accept()
+        conn.settimeout(1)
+        data = b''
+        while True:
+            chunk = conn.recv(512)
+            if not chunk:
+                break
+            data += chunk
+        conn.close()
+        eq_(b'foo:1|c\nbar:0|g\nbar:-1|g\n', data)
+    finally:
+        server.close()
+
+
+def test_async_connects_lazily():
+    """Stats sent before the client is connected are dropped."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+
+    async def _test():
+        cl = AsyncStatsClient('127.0.0.1', server.getsockname()[1])
+        cl.incr('foo')
+        cl.incr('foo')
+        eq_(2, cl.dropped)
+        await cl._connecting
+        cl.incr('bar')
+        cl.close()
+
+    try:
+        _run_async(_test())
+        eq_(b'bar:1|c', server.recv(512))
+    finally:
+        server.close()
+
+
+def test_async_connect_once():
+    """connect() waits for a connect that's already under way."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+
+    async def _test():
+        cl = AsyncStatsClient('127.0.0.1', server.getsockname()[1])
+        with mock.patch.object(cl, '_open', wraps=cl._open) as _open:
+            cl.incr('foo')
+            connecting = cl._connecting
+            await cl.connect()
+            transport = cl._transport
+            await cl.connect()
+            eq_(1, _open.call_count)
+        assert connecting.done()
+        assert cl._transport is transport
+        cl.incr('bar')
+        cl.close()
+        assert transport.is_closing()
+
+    try:
+        _run_async(_test())
+        eq_(b'bar:1|c', server.recv(512))
+    finally:
+        server.close()
+
+
+def test_async_close_while_connecting():
+    """close() stops a connect that's under way."""
+    transport = mock.Mock()
+
+    async def _open():
+        # Finish opening even if cancelled.
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            pass
+        return transport
+
+    async def _test():
+        cl = AsyncStatsClient()
+        cl._open = _open
+        cl.incr('foo')
+        await asyncio.sleep(0)
+        connecting = cl._connecting
+        cl.close()
+        eq_(None, cl._connecting)
+        await asyncio.wait([connecting])
+        eq_(None, cl._transport)
+        transport.close.assert_called_once_with()
+
+        # Connecting again after close() works.
+        await cl.connect()
+        assert cl._transport is transport
+
+    _run_async(_test())
+
+
+def test_async_no_loop():
+    """Sending outside of an event loop drops the stat."""
+    cl = AsyncStatsClient()
+    cl.incr('foo')
+    eq_(1, cl.dropped)
+    eq_(None, cl._connecting)
+
+
+def test_async_write_buffer_full():
+    """Stats are dropped while the write buffer is too large."""
+    cl = AsyncTCPStatsClient(max_write_buffer=10)
+    cl._transport = mock.Mock()
+    cl._transport.get_write_buffer_size.return_value = 0
+    cl.incr('foo')
+    cl._transport.write.assert_called_once_with(b'foo:1|c\n')
+    cl._transport.get_write_buffer_size.return_value = 11
+    cl.incr('foo')
+    eq_(1, cl._transport.write.call_count)
+    eq_(1, cl.dropped)
+
+
+def _test_counter_handle(cl, proto):
+    counter = cl.counter('foo')
+    counter.incr()
+    _sock_check(cl._sock, 1, proto, 'bar.foo:1|c')
+    counter.incr(10)
+    _sock_check(cl._sock, 2, proto, 'bar.foo:10|c')
+    counter.decr(1.2)
+    _sock_check(cl._sock, 3, proto, 'bar.foo:-1.2|c')
+
+    cl.counter('foo', rate=0.5).incr()
+    _sock_check(cl._sock, 4, proto, 'bar.foo:1|c|@0.5')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_counter_handle_udp():
+    """StatsClient.counter works."""
+    cl = _udp_client(prefix='bar')
+    _test_counter_handle(cl, 'udp')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_counter_handle_tcp():
+    """TCPStatsClient.counter works."""
+    cl = _tcp_client(prefix='bar')
+    _test_counter_handle(cl, 'tcp')
+
+
+def _test_timer_handle(cl, proto):
+    timer = cl.timer_handle('foo')
+    timer.timing(100)
+    _sock_check(cl._sock, 1, proto, 'foo:100.000000|ms')
+    timer.timing(timedelta(seconds=1.5))
+    _sock_check(cl._sock, 2, proto, 'foo:1500.000000|ms')
+
+    cl.timer_handle('foo', rate=0.5).timing(100)
+    _sock_check(cl._sock, 3, proto, 'foo:100.000000|ms|@0.5')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_timer_handle_udp():
+    """StatsClient.timer_handle works."""
+    cl = _udp_client()
+    _test_timer_handle(cl, 'udp')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_timer_handle_tcp():
+    """TCPStatsClient.timer_handle works."""
+    cl = _tcp_client()
+    _test_timer_handle(cl, 'tcp')
+
+
+def _test_gauge_handle(cl, proto):
+    gauge = cl.gauge_handle('foo')
+    gauge.gauge(30)
+    _sock_check(cl._sock, 1, proto, 'foo:30|g')
+    gauge.gauge(12, delta=True)
+    _sock_check(cl._sock, 2, proto, 'foo:+12|g')
+    gauge.gauge(-13, delta=True)
+    _sock_check(cl._sock, 3, proto, 'foo:-13|g')
+    gauge.gauge(-5)
+    _sock_check(cl._sock, 4, proto, 'foo:0|g\nfoo:-5|g')
+
+    cl.gauge_handle('foo', rate=0.5).gauge(70)
+    _sock_check(cl._sock, 5, proto, 'foo:70|g|@0.5')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_gauge_handle_udp():
+    """StatsClient.gauge_handle works."""
+    cl = _udp_client()
+    _test_gauge_handle(cl, 'udp')
+
+
+@mock.patch.object(sampling, 'random', lambda: -1)
+def test_gauge_handle_tcp():
+    """TCPStatsClient.gauge_handle works."""
+    cl = _tcp_client()
+    _test_gauge_handle(cl, 'tcp')
+
+
+@mock.patch.object(sampling, 'random', lambda: 2)
+def test_handle_rate_no_send():
+    """Handles respect their sample rate."""
+    cl = _udp_client()
+    cl.counter('foo', rate=0.5).incr()
+    cl.timer_handle('foo', rate=0.5).timing(1)
+    cl.gauge_handle('foo', rate=0.5).gauge(-1)
+    _sock_check(cl._sock, 0, 'udp')
+
+
+def test_handle_pipeline():
+    """Handles work with pipelines."""
+    cl = _udp_client(prefix='pre')
+    counter = cl.counter('foo')
+    with cl.pipeline() as pipe:
+        pipe.timer_handle('bar').timing(5)
+        counter.bind(pipe).incr()
+        pipe.incr('baz')
+    _sock_check(cl._sock, 1, 'udp',
+                'pre.bar:5.000000|ms\npre.foo:1|c\npre.baz:1|c')
+    counter.incr()
+    _sock_check(cl._sock, 2, 'udp', 'pre.foo:1|c')
+
+
+def test_server_aggregates():
+    """Aggregator parses and aggregates the line format clients send."""
+    agg = Aggregator()
+    for line in (b'foo:1|c', b'foo:2|c|@0.5', b'bar:5|g', b'bar:+3|g',
+                 b'bar:-1|g', b'baz:a|s', b'baz:b|s', b'baz:a|s',
+                 b'qux:10.000000|ms', b'qux:30.000000|ms|@0.5'):
+        assert agg.add_line(line), line
+    snapshot = agg.snapshot()
+    eq_({'foo': 5}, snapshot['counters'])
+    eq_({'bar': 7}, snapshot['gauges'])
+    eq_({'baz': 2}, snapshot['sets'])
+    eq_({'qux': {'count': 3, 'min': 10, 'max': 30, 'mean': 20}},
+        snapshot['timers'])
+    eq_(10, snapshot['parsed'])
+    eq_(0, snapshot['dropped'])
+
+
+def test_server_drops_invalid_lines():
+    """Aggregator counts lines it can't parse as dropped."""
+    agg = Aggregator()
+    for line in (b'foo', b'foo:1', b':1|c', b'foo:x|c', b'foo:1|q',
+                 b'foo:1|c|0.5', b'foo:1|c|@2', b'foo:1|c|@0.5|x',
+                 b'f\xffo:1|c'):
+        assert not agg.add_line(line), line
+    snapshot = agg.snapshot()
+    eq_(9, snapshot['lines'])
+    eq_(9, snapshot['dropped'])
+    eq_({}, snapshot['counters'])
+
+
+def test_server_stream_partial_lines():
+    """Lines split between stream reads are put back together."""
+    agg = Aggregator()
+    rest = agg.add_packet(b'foo:1|c\nfo')
+    rest = agg.add_packet(b'o:2|c\nbar:1', rest)
+    rest = agg.add_packet(b'|c\n', rest)
+    eq_(b'', rest)
+    eq_({'foo': 3, 'bar': 1}, agg.snapshot()['counters'])
+    eq_(3, agg.snapshot()['packets'])
+
+
+def test_server_flush_resets():
+    """Flushing starts a new interval, but gauges are kept."""
+    agg = Aggregator()
+    agg.add_line(b'foo:1|c')
+    agg.add_line(b'bar:1|g')
+    agg.reset()
+    agg.add_line(b'bar:+1|g')
+    snapshot = agg.snapshot()
+    eq_({}, snapshot['counters'])
+    eq_({'bar': 2}, snapshot['gauges'])
+    eq_(1, snapshot['lines'])
+
+
+def test_server_clients():
+    """StatsServer receives stats from UDP, TCP and Unix socket clients."""
+    path = 'statsd-test-server.sock'
+    server = StatsServer(udp=('127.0.0.1', 0), tcp=('127.0.0.1', 0),
+                         unix=path)
+    with server:
+        clients = [
+            StatsClient(*server.udp_address),
+            TCPStatsClient(*server.tcp_address),
+            UnixSocketStatsClient(server.unix_path),
+        ]
+        for cl in clients:
+            cl.incr('foo')
+            with cl.pipeline() as pipe:
+                pipe.incr('foo', 2)
+                pipe.gauge('bar', -5)
+                pipe.timing('baz', 100)
+            cl.close()
+        assert server.wait(lines=15)
+        snapshot = server.flush()
+        eq_({'foo': 9}, snapshot['counters'])
+        eq_({'bar': -5}, snapshot['gauges'])
+        eq_(3, snapshot['timers']['baz']['count'])
+        eq_(15, snapshot['parsed'])
+        eq_(0, server.snapshot()['lines'])
+    assert not os.path.exists(path)
+
+
+def _stress(make_client, transport, threads=8, count=1000):
+    """Send from many threads at once and check every line arrives intact."""
+    path = 'statsd-test-stress.sock'
+    if transport == 'unix':
+        server = StatsServer(unix=path)
+    else:
+        server = StatsServer(tcp=('127.0.0.1', 0))
+    interval = sys.getswitchinterval()
+    # Switch threads as often as possible, to make races likely with the GIL.
+    sys.setswitchinterval(1e-6)
+    try:
+        with server:
+            cl = make_client(server)
+            barrier = threading.Barrier(threads)
+
+            def _run(n):
+                stat = 'stress.%d' % n
+                handle = cl.counter(stat)
+                barrier.wait()
+                for i in range(count):
+                    if i % 10 == 0:
+                        with cl.pipeline() as pipe:
+                            pipe.incr(stat, 2)
+                            pipe.decr(stat)
+                    elif i % 2:
+                        handle.incr()
+                    else:
+                        cl.incr(stat)
+
+            workers = [threading.Thread(target=_run, args=(n,))
+                       for n in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            while getattr(cl, '_backlog', None):
+                # Give a non-blocking client time to send its backlog.
+                cl.flush()
+            cl.close()
+            lines = threads * (count + count // 10)
+            assert server.wait(lines=lines)
+            snapshot = server.flush()
+    finally:
+        sys.setswitchinterval(interval)
+    eq_(0, cl.dropped)
+    eq_(0, snapshot['dropped'])
+    eq_(lines, snapshot['lines'])
+    eq_({'stress.%d' % n: count for n in range(threads)},
+        snapshot['counters'])
+
+
+def test_stress_tcp():
+    """Unbuffered TCP clients never interleave lines from threads."""
+    _stress(lambda server: TCPStatsClient(*server.tcp_address), 'tcp')
+
+
+def test_stress_tcp_coalesce():
+    """Per-thread buffers are all flushed, and never lose lines."""
+    _stress(lambda server: TCPStatsClient(*server.tcp_address,
+                                          buffer_size=512,
+                                          flush_interval=0.001), 'tcp')
+
+
+def test_stress_unix_socket_nonblocking():
+    """Non-blocking clients keep lines intact across threads."""
+    _stress(lambda server: UnixSocketStatsClient(server.unix_path,
+                                                 buffer_size=512,
+                                                 blocking=False,
+                                                 max_backlog=1 << 24),
+            'unix')
+
+
+def test_fork_stream():
+    """Stream clients forget their socket and buffers in a child."""
+    cl = _tcp_client()
+    cl._init_buffer(buffer_size=1000, flush_interval=60)
+    sock = cl._sock
+    cl.incr('foo')
+    assert cl in fork._clients
+    cl._after_fork()
+    sock.close.assert_called_once_with()
+    eq_(None, cl._sock)
+    cl.close()
+    _sock_check(sock, 0, 'tcp')
+
+
+def test_fork_buffered():
+    """Buffered clients forget their buffered stats in a child."""
+    cl = _buffered_client()
+    cl.incr('foo')
+    cl.timing('bar', 10)
+    thread = cl._thread
+    # A forked child doesn't have a copy of the background thread.
+    cl._stop.set()
+    thread.join()
+    assert cl in fork._clients
+    cl._after_fork()
+    assert cl._thread is not thread
+    assert cl._thread.is_alive()
+    cl.incr('baz')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'baz:1|c')
+    cl.close()
+
+
+def test_fork_threaded():
+    """Threaded clients start a new thread and queue in a child."""
+    cl = ThreadedStatsClient(_udp_client())
+    thread = cl._thread
+    # A forked child doesn't have a copy of the background thread.
+    cl._queue.put(None)
+    thread.join()
+    assert cl in fork._clients
+    cl._after_fork()
+    assert cl._thread is not thread
+    assert cl._thread.is_alive()
+    cl.incr('foo')
+    cl.flush()
+    _sock_check(cl._client._sock, 1, 'udp', 'foo:1|c')
+    cl.close()
+
+
+def test_fork_async():
+    """Async clients connect again on the child's loop."""
+    cl = AsyncStatsClient()
+    cl._transport = transport = mock.Mock()
+    cl.dropped = 3
+    assert cl in fork._clients
+    cl._after_fork()
+    eq_(None, cl._transport)
+    eq_(0, cl.dropped)
+    eq_(0, transport.close.call_count)
+
+
+def test_fork_real():
+    """Stats buffered before a fork are only sent by the parent."""
+    if not hasattr(os, 'fork'):
+        raise SkipTest('No os.fork() on this platform.')
+    with StatsServer(tcp=('127.0.0.1', 0)) as server:
+        cl = TCPStatsClient(*server.tcp_address, buffer_size=1000,
+                            flush_interval=60)
+        cl.incr('parent')
+        cl.flush()
+        cl.incr('before')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                cl.incr('child')
+                cl.close()
+            finally:
+                os._exit(0)
+        eq_(0, os.waitpid(pid, 0)[1])
+        cl.incr('parent')
+        cl.close()
+        assert server.wait(lines=4)
+        eq_({'parent': 2, 'before': 1, 'child': 1},
+            server.flush()['counters'])
+
+
+def _shared_client(path, **kwargs):
+    return SharedStatsClient(_udp_client(), path, sender=False, **kwargs)
+
+
+def _shared_sent(cl):
+    """Return the lines the wrapped client sent, as a set."""
+    lines = set()
+    for call in cl._client._sock.sendto.call_args_list:
+        lines.update(bytes(call[0][0]).decode('ascii').split('\n'))
+    cl._client._sock.reset_mock()
+    return lines
+
+
+def test_shared_aggregates():
+    """Counters and gauges from every lane are sent once, together."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'statsd')
+        one = _shared_client(path)
+        two = _shared_client(path)
+        one.incr('foo')
+        two.incr('foo', 2)
+        with mock.patch.object(sampling, 'random', lambda: 0.1):
+            two.incr('bar', rate=0.5)
+        one.gauge('baz', 5)
+        two.gauge('baz', -2)
+        one.gauge('qux', 3, delta=True)
+        two.gauge('qux', -1, delta=True)
+        _sock_check(one._client._sock, 0, 'udp')
+        _sock_check(two._client._sock, 0, 'udp')
+        assert one._lane != two._lane
+
+        one.flush()
+        eq_({'foo:3|c', 'bar:2|c', 'baz:0|g', 'baz:-2|g', 'qux:+2|g'},
+            _shared_sent(one))
+        one.flush()
+        _sock_check(one._client._sock, 0, 'udp')
+
+        # Another client can take over as the sender.
+        one.decr('foo')
+        two.flush()
+        eq_({'foo:-1|c'}, _shared_sent(two))
+        one.close()
+        two.close()
+
+
+def test_shared_handles():
+    """Stats sent through handles are aggregated too."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cl = _shared_client(os.path.join(tmpdir, 'statsd'))
+        counter = cl.counter('foo')
+        counter.incr()
+        counter.incr(2)
+        cl.gauge_handle('bar').gauge(4)
+        _sock_check(cl._client._sock, 0, 'udp')
+        cl.flush()
+        eq_({'foo:3|c', 'bar:4|g'}, _shared_sent(cl))
+        cl.close()
+
+
+def test_shared_direct():
+    """Stats that can't be aggregated are sent directly."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cl = _shared_client(os.path.join(tmpdir, 'statsd'), max_stats=1)
+        cl.timing('foo', 10)
+        _sock_check(cl._client._sock, 1, 'udp', 'foo:10.000000|ms')
+        cl.set('foo', 1)
+        _sock_check(cl._client._sock, 2, 'udp', 'foo:1|s')
+        cl.incr('x' * 100)
+        _sock_check(cl._client._sock, 3, 'udp', 'x' * 100 + ':1|c')
+        cl.incr('foo')
+        cl.incr('bar')
+        _sock_check(cl._client._sock, 4, 'udp', 'bar:1|c')
+        cl.gauge('bar', -1)
+        _sock_check(cl._client._sock, 5, 'udp', 'bar:0|g\nbar:-1|g')
+        with cl.pipeline() as pipe:
+            pipe.incr('foo')
+        _sock_check(cl._client._sock, 6, 'udp', 'foo:1|c')
+        cl.close()
+
+
+def test_shared_gauge_set_after_delta():
+    """Setting a gauge replaces the deltas made before it."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cl = _shared_client(os.path.join(tmpdir, 'statsd'))
+        cl.gauge('foo', 10)
+        cl.gauge('foo', 5, delta=True)
+        cl.gauge('foo', 100)
+        cl.flush()
+        eq_({'foo:100|g'}, _shared_sent(cl))
+
+        cl.gauge('bar', 5, delta=True)
+        cl.flush()
+        eq_({'bar:+5|g'}, _shared_sent(cl))
+        cl.gauge('bar', 1, delta=True)
+        cl.gauge('bar', 100)
+        cl.gauge('bar', -3, delta=True)
+        cl.flush()
+        eq_({'bar:97|g'}, _shared_sent(cl))
+        cl.close()
+
+
+def test_shared_lanes_full():
+    """Without a free lane, stats are sent directly."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'statsd')
+        one = _shared_client(path, max_processes=1)
+        two = _shared_client(path, max_processes=1)
+        one.incr('foo')
+        with mock.patch.object(two, '_lock_file',
+                               wraps=two._lock_file) as lock_file:
+            two.incr('foo')
+            two.gauge('bar', 1)
+            eq_(1, lock_file.call_count)
+        _sock_check(two._client._sock, 2, 'udp', 'bar:1|g')
+        one.flush()
+        eq_({'foo:1|c'}, _shared_sent(one))
+        one.close()
+        two.close()
+
+
+def test_shared_layout():
+    """Every client must use the same layout."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'statsd')
+        cl = _shared_client(path, max_stats=16)
+        with assert_raises(ValueError):
+            _shared_client(path, max_stats=32)
+        cl.close()
+
+
+def test_shared_prefix():
+    """Prefixes are applied, and a lane left behind is taken over."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'statsd')
+        cl = SharedStatsClient(_udp_client(prefix='app'), path, sender=False)
+        cl.incr('foo')
+        lane = cl._lane
+        cl.close()
+        cl = SharedStatsClient(_udp_client(prefix='app'), path, sender=False)
+        cl.incr('foo')
+        eq_(lane, cl._lane)
+        eq_(1, cl._lane_used())
+        cl.flush()
+        eq_({'app.foo:2|c'}, _shared_sent(cl))
+        cl.close()
+
+
+def test_shared_fork():
+    """Forked processes each write to a lane of their own."""
+    if not hasattr(os, 'fork'):
+        raise SkipTest('No os.fork() on this platform.')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cl = _shared_client(os.path.join(tmpdir, 'statsd'))
+        cl.incr('foo')
+        pids = []
+        for _ in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for _ in range(100):
+                        cl.incr('foo')
+                    cl.gauge('pid', os.getpid())
+                finally:
+                    # Skip atexit handlers, like a worker that was killed.
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            eq_(0, os.waitpid(pid, 0)[1])
+        cl.flush()
+        lines = _shared_sent(cl)
+        assert 'foo:401|c' in lines
+        gauges = [line for line in lines if line.startswith('pid:')]
+        eq_(1, len(gauges))
+        assert int(gauges[0][4:-2]) in pids
+        cl.close()
+
+
+def test_shared_sender():
+    """Only one client at a time sends."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'statsd')
+        cl = SharedStatsClient(_udp_client(), path, flush_interval=0.01)
+        cl.incr('foo')
+        for _ in range(100):
+            if cl._client._sock.sendto.call_count:
+                break
+            threading.Event().wait(0.01)
+        assert cl._is_sender
+        eq_({'foo:1|c'}, _shared_sent(cl))
+        cl.close()
+
+
+def _addrinfo(*addrs):
+    """Return what getaddrinfo() would for these addresses."""
+    return [
+        (socket.AF_INET6 if ':' in addr[0] else socket.AF_INET,
+         socket.SOCK_DGRAM, 0, '', addr)
+        for addr in addrs
+    ]
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_resolver_refresh(mock_getaddrinfo):
+    """Resolvers tell their clients when addresses change."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125))
+    res = resolver.Resolver('statsd', 8125, socket.AF_INET,
+                            socket.SOCK_DGRAM, 60)
+    client = mock.Mock()
+    res.watch(client)
+    eq_([(socket.AF_INET, ('10.0.0.1', 8125))], res.addresses)
+
+    res.refresh()
+    eq_(0, client._resolved.call_count)
+    mock_getaddrinfo.side_effect = socket.gaierror
+    res.refresh()
+    eq_(0, client._resolved.call_count)
+    mock_getaddrinfo.side_effect = None
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.2', 8125))
+    res.refresh()
+    client._resolved.assert_called_once_with(
+        [(socket.AF_INET, ('10.0.0.2', 8125))])
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_resolver_background(mock_getaddrinfo):
+    """Addresses are refreshed in the background, and shared."""
+    mock_getaddrinfo.return_value = _addrinfo(('127.0.0.2', 8125))
+    refresher = resolver._Refresher()
+    try:
+        with mock.patch.object(resolver, '_refresher', refresher):
+            cl = StatsClient(dns_ttl=0.01)
+            other = StatsClient(dns_ttl=0.01)
+        eq_(('127.0.0.2', 8125), cl._addr)
+        mock_getaddrinfo.return_value = _addrinfo(('127.0.0.3', 8125))
+        for _ in range(100):
+            if cl._addr != ('127.0.0.2', 8125):
+                break
+            threading.Event().wait(0.01)
+        eq_(('127.0.0.3', 8125), cl._addr)
+        eq_(('127.0.0.3', 8125), other._addr)
+        cl.close()
+        other.close()
+    finally:
+        # Leave the thread with nothing to refresh.
+        with refresher._lock:
+            refresher._resolvers.clear()
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_resolver_background_errors(mock_getaddrinfo):
+    """The background thread keeps going after unexpected errors."""
+    mock_getaddrinfo.return_value = _addrinfo(('127.0.0.2', 8125))
+    refresher = resolver._Refresher()
+    try:
+        client = mock.Mock()
+        res = refresher.get('statsd', 8125, socket.AF_INET,
+                            socket.SOCK_DGRAM, 0.01, client)
+        mock_getaddrinfo.side_effect = UnicodeError
+        for _ in range(100):
+            if mock_getaddrinfo.call_count > 2:
+                break
+            threading.Event().wait(0.01)
+        mock_getaddrinfo.side_effect = None
+        mock_getaddrinfo.return_value = _addrinfo(('127.0.0.3', 8125))
+        for _ in range(100):
+            if res.addresses[0][1] != ('127.0.0.2', 8125):
+                break
+            threading.Event().wait(0.01)
+        eq_([(socket.AF_INET, ('127.0.0.3', 8125))], res.addresses)
+        assert refresher._thread.is_alive()
+    finally:
+        with refresher._lock:
+            refresher._resolvers.clear()
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_resolver_dropped(mock_getaddrinfo):
+    """Resolvers are dropped once all of their clients are gone."""
+    mock_getaddrinfo.return_value = _addrinfo(('127.0.0.2', 8125))
+    refresher = resolver._Refresher()
+    try:
+        client = mock.Mock()
+        refresher.get('statsd', 8125, socket.AF_INET, socket.SOCK_DGRAM,
+                      0.01, client)
+        threading.Event().wait(0.05)
+        eq_(1, len(refresher._resolvers))
+        del client
+        for _ in range(100):
+            if not refresher._resolvers:
+                break
+            threading.Event().wait(0.01)
+        eq_({}, refresher._resolvers)
+    finally:
+        with refresher._lock:
+            refresher._resolvers.clear()
+
+
+@mock.patch.object(socket, 'socket')
+@mock.patch.object(socket, 'getaddrinfo')
+def test_udp_failover(mock_getaddrinfo, mock_socket):
+    """UDP clients move on to the next address after an error."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125),
+                                              ('10.0.0.2', 8125))
+    cl = StatsClient()
+    cl.incr('foo')
+    _sock_check(cl._sock, 1, 'udp', 'foo:1|c', addr=('10.0.0.1', 8125))
+    cl._sock.sendto.side_effect = OSError
+    cl.incr('foo')
+    cl._sock.sendto.side_effect = None
+    cl.incr('foo')
+    _sock_check(cl._sock, 3, 'udp', 'foo:1|c', addr=('10.0.0.2', 8125))
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_udp_failover_pipeline(mock_getaddrinfo):
+    """Pipelines move on to the next address once after errors."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125),
+                                              ('10.0.0.2', 8125),
+                                              ('10.0.0.3', 8125))
+    cl = StatsClient(maxudpsize=8)
+    cl._sock.close()
+    cl._sock = mock.Mock()
+    cl._sock.sendto.side_effect = OSError(errno.ECONNREFUSED, 'Refused')
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('bar')
+    eq_(2, cl.errors[errno.ECONNREFUSED])
+    eq_(('10.0.0.2', 8125), cl._addr)
+
+    cl._sock.sendto.side_effect = OSError(errno.ENOBUFS, 'No buffer space')
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('bar')
+    eq_(2, cl.errors[errno.ENOBUFS])
+    eq_(('10.0.0.2', 8125), cl._addr)
+
+
+@mock.patch.object(socket, 'socket')
+@mock.patch.object(socket, 'getaddrinfo')
+def test_udp_resolved_family(mock_getaddrinfo, mock_socket):
+    """UDP clients change sockets if the address family changes."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125))
+    mock_socket.side_effect = lambda *args: mock.Mock()
+    cl = StatsClient()
+    sock = cl._sock
+    cl._resolved([(socket.AF_INET, ('10.0.0.2', 8125))])
+    assert cl._sock is sock
+    eq_(('10.0.0.2', 8125), cl._addr)
+    cl._resolved([(socket.AF_INET6, ('::2', 8125, 0, 0))])
+    assert cl._sock is not sock
+    sock.close.assert_called_once_with()
+    mock_socket.assert_called_with(socket.AF_INET6, socket.SOCK_DGRAM)
+    eq_(('::2', 8125, 0, 0), cl._addr)
+
+
+@mock.patch.object(socket, 'socket')
+@mock.patch.object(socket, 'getaddrinfo')
+def test_tcp_failover(mock_getaddrinfo, mock_socket):
+    """TCP clients try every address, starting with the last good one."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125),
+                                              ('10.0.0.2', 8125))
+    down = {('10.0.0.1', 8125)}
+
+    def _connect(addr):
+        if addr in down:
+            raise ConnectionRefusedError
+
+    socks = []
+
+    def _socket(*args):
+        sock = mock.Mock()
+        sock.connect.side_effect = _connect
+        socks.append(sock)
+        return sock
+
+    mock_socket.side_effect = _socket
+    cl = TCPStatsClient(dns_ttl=60)
+    cl.incr('foo')
+    eq_(2, len(socks))
+    socks[0].close.assert_called_once_with()
+    _sock_check(socks[1], 1, 'tcp', 'foo:1|c')
+
+    down.clear()
+    cl.reconnect()
+    socks[2].connect.assert_called_once_with(('10.0.0.2', 8125))
+    eq_(1, mock_getaddrinfo.call_count)
+
+    down.update([('10.0.0.1', 8125), ('10.0.0.2', 8125)])
+    cl.close()
+    with assert_raises(ConnectionRefusedError):
+        cl.connect()
+    eq_(None, cl._sock)
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_lazy_client(mock_getaddrinfo):
+    """LazyClient only creates the client when it's first used."""
+    mock_getaddrinfo.return_value = _addrinfo(('127.0.0.1', 8125))
+    cl = LazyClient(StatsClient, host='localhost', prefix='foo')
+    timer = cl.timer('bar')
+    eq_(0, mock_getaddrinfo.call_count)
+    eq_(None, cl._client)
+    cl.close()
+
+    cl.incr('baz')
+    eq_(1, mock_getaddrinfo.call_count)
+    client = cl._client
+    eq_('foo', client._prefix)
+    # Stats now go straight to the client.
+    eq_(client.incr, cl.incr)
+
+    client._sock = mock.Mock()
+    with timer:
+        pass
+    eq_(1, client._sock.sendto.call_count)
+    with cl.pipeline() as pipe:
+        pipe.incr('qux')
+    _sock_check(client._sock, 2, 'udp', 'foo.qux:1|c')
+    eq_(client._addr, cl._addr)
+    sock = client._sock
+    cl.close()
+    sock.close.assert_called_once_with()
+
+
+def test_lazy_client_threads():
+    """Only one client is created, however many threads race to use it."""
+    created = []
+
+    def _factory():
+        created.append(1)
+        client = StatsClient()
+        client._sock = mock.Mock()
+        return client
+
+    cl = LazyClient(_factory)
+    threads = [threading.Thread(target=cl.incr, args=('foo',))
+               for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    eq_(1, len(created))
+    eq_(10, cl._client._sock.sendto.call_count)
+
+
+def test_lazy_client_many():
+    """The bulk methods go to the client's own, once it exists."""
+    cl = LazyClient(_buffered_client)
+    cl.incr_many({'foo': 1, 'bar': 2})
+    cl.incr_many([('foo', 3)])
+    cl.gauge_many({'baz': 4})
+    cl.timing_many('qux', [5])
+    client = cl._client
+    eq_(client.incr_many, cl.incr_many)
+    eq_(client.gauge_many, cl.gauge_many)
+    eq_(client.timing_many, cl.timing_many)
+    _sock_check(client._client._sock, 0, 'udp')
+    cl.flush()
+    sent = client._client._sock.sendto.call_args[0][0]
+    eq_(b'foo:4|c\nbar:2|c\nbaz:4|g\nqux:5.000000|ms', bytes(sent))
+
+
+@mock.patch.object(socket, 'getaddrinfo')
+def test_defaults_env_lazy(mock_getaddrinfo):
+    """Importing statsd.defaults.env doesn't look anything up."""
+    env = importlib.import_module('statsd.defaults.env')
+    env = importlib.reload(env)
+    assert isinstance(env.statsd, LazyClient)
+    eq_(0, mock_getaddrinfo.call_count)
+
+
+def test_import_lazy():
+    """Clients that need more to import are only imported when used."""
+    code = (
+        'import sys\n'
+        'import statsd.defaults.env\n'
+        'print(" ".join(sorted(m for m in sys.modules if m in {})))\n'
+        'statsd.BufferedStatsClient\n'
+        'print("statsd.client.buffered" in sys.modules)\n'.format(
+            ('asyncio', 'ctypes', 'mmap', 'queue', 'statsd.client.buffered',
+             'statsd.client.shared', 'statsd.client.threaded')))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', code], check=True,
+                         stdout=subprocess.PIPE,
+                         env=dict(os.environ, PYTHONPATH=root)).stdout
+    eq_(b'\nTrue\n', out)
+
+
+def _request(view_name='polls:detail', method='GET'):
+    request = mock.Mock(method=method)
+    if view_name is None:
+        request.resolver_match = None
+    else:
+        request.resolver_match.view_name = view_name
+    return request
+
+
+def test_middleware():
+    """Everything sent while handling a request goes in one packet."""
+    cl = RequestStatsClient(_udp_client('foo'))
+    response = mock.Mock(status_code=200)
+
+    def _view(request):
+        cl.incr('bar')
+        cl.gauge('baz', -1)
+        with cl.pipeline() as pipe:
+            pipe.incr('qux')
+        return response
+
+    middleware = StatsdMiddleware(_view, client=cl)
+    with mock.patch('statsd.client.timer.time_now', side_effect=[1.0, 1.5]):
+        eq_(response, middleware(_request()))
+    _sock_check(cl._client._sock, 1, 'udp',
+                'foo.bar:1|c\nfoo.baz:0|g\nfoo.baz:-1|g\nfoo.qux:1|c\n'
+                'foo.view.polls.detail.GET:500.000000|ms\n'
+                'foo.response.200:1|c')
+
+    # Outside of a request, stats are sent right away.
+    cl.incr('bar')
+    _sock_check(cl._client._sock, 2, 'udp', 'foo.bar:1|c')
+
+    # Anything else is the wrapped client's.
+    eq_(cl._client.errors, cl.errors)
+    eq_(cl._client._addr, cl._addr)
+    with assert_raises(AttributeError):
+        cl.missing
+
+
+def test_middleware_error():
+    """Stats are still sent if the view raises."""
+    cl = RequestStatsClient(_udp_client())
+
+    def _view(request):
+        cl.incr('bar')
+        raise ValueError
+
+    middleware = StatsdMiddleware(_view, client=cl)
+    with assert_raises(ValueError):
+        middleware(_request(view_name=None))
+    _sock_check(cl._client._sock, 1, 'udp', 'bar:1|c')
+
+    middleware = StatsdMiddleware(lambda r: mock.Mock(status_code=404),
+                                  client=cl)
+    middleware(_request(view_name=None, method='POST'))
+    eq_(2, cl._client._sock.sendto.call_count)
+    sent = bytes(cl._client._sock.sendto.call_args[0][0]).decode('ascii')
+    assert re.match(r'view\.unresolved\.POST:[\d.]+\|ms\n'
+                    r'response\.404:1\|c$', sent), sent
+
+
+class _Array:
+    """Just enough of a NumPy array for timing_many()."""
+
+    dtype = 'float64'
+
+    def __init__(self, values):
+        self._values = values
+
+    def ravel(self):
+        return self
+
+    def tolist(self):
+        return list(self._values)
+
+    def __iter__(self):
+        raise AssertionError('arrays should not be iterated over')
+
+
+def test_timing_many():
+    """timing_many() sends every value, packed into as few packets."""
+    cl = _udp_client('foo')
+    cl.timing_many('bar', [1, 2.5])
+    _sock_check(cl._sock, 1, 'udp', 'foo.bar:1.000000|ms\nfoo.bar:2.500000|ms')
+
+    cl.timing_many('bar', _Array([3]))
+    _sock_check(cl._sock, 2, 'udp', 'foo.bar:3.000000|ms')
+
+    cl.timing_many('bar', [])
+    _sock_check(cl._sock, 2, 'udp')
+
+    cl.timing_many('bar', range(100))
+    packets = [bytes(call[0][0])
+               for call in cl._sock.sendto.call_args_list[2:]]
+    eq_(5, len(packets))
+    assert all(len(packet) <= 512 for packet in packets)
+    lines = [line for packet in packets for line in packet.split(b'\n')]
+    eq_(['foo.bar:%0.6f|ms' % i for i in range(100)],
+        [line.decode('ascii') for line in lines])
+
+
+@mock.patch.object(sampling, 'random')
+def test_timing_many_rate(mock_random):
+    cl = _udp_client('100%')
+    mock_random.side_effect = [0.1, 0.9, 0.2]
+    cl.timing_many('bar', (1, 2, 3), rate=0.5)
+    _sock_check(cl._sock, 1, 'udp',
+                '100%.bar:1.000000|ms|@0.5\n100%.bar:3.000000|ms|@0.5')
+
+
+def test_incr_many():
+    cl = _udp_client()
+    cl.incr_many({'foo': 1, 'bar': -2})
+    _sock_check(cl._sock, 1, 'udp', 'foo:1|c\nbar:-2|c')
+
+    cl.incr_many([('baz', 3)], rate=0.99999999999)
+    _sock_check(cl._sock, 2, 'udp', 'baz:3|c|@0.99999999999')
+
+    cl.incr_many([])
+    _sock_check(cl._sock, 2, 'udp')
+
+
+def test_gauge_many():
+    cl = _udp_client()
+    cl.gauge_many([('foo', 1), ('bar', -2)])
+    _sock_check(cl._sock, 1, 'udp', 'foo:1|g\nbar:0|g\nbar:-2|g')
+
+    cl.gauge_many({'foo': 1, 'bar': -2}, delta=True)
+    _sock_check(cl._sock, 2, 'udp', 'foo:+1|g\nbar:-2|g')
+
+
+def test_many_tcp():
+    cl = _tcp_client()
+    cl.incr_many({'foo': 1, 'bar': 2})
+    _sock_check(cl._sock, 1, 'tcp', 'foo:1|c\nbar:2|c')
+
+
+def test_many_pipeline():
+    """Bulk stats in a pipeline are sent with the rest of it."""
+    cl = _udp_client()
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.timing_many('bar', [1])
+        pipe.incr_many({'baz': 1})
+    _sock_check(cl._sock, 1, 'udp', 'foo:1|c\nbar:1.000000|ms\nbaz:1|c')
+
+
+def test_many_buffered():
+    """Buffered clients aggregate bulk stats."""
+    cl = _udp_client()
+    bcl = BufferedStatsClient(cl, summarize_timers=True, quantiles=())
+    bcl.incr_many([('foo', 1), ('foo', 2)])
+    bcl.gauge_many({'bar': 5})
+    bcl.timing_many('baz', _Array([1, 3]))
+    bcl.flush()
+    _sock_check(cl._sock, 1, 'udp',
+                'foo:3|c\nbar:5|g\nbaz.count:2|g\nbaz.min:1|g\nbaz.max:3|g\n'
+                'baz.mean:2.0|g')
+
+
+def _unix_dgram_server():
+    path = os.path.join(tempfile.mkdtemp(), 'statsd.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.settimeout(1)
+    return sock, path
+
+
+def _close_unix_dgram_server(sock, path):
+    sock.close()
+    os.unlink(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def test_unix_dgram():
+    sock, path = _unix_dgram_server()
+    try:
+        cl = UnixDatagramStatsClient(path, prefix='foo')
+        cl.incr('bar')
+        eq_(b'foo.bar:1|c', sock.recv(1 << 16))
+
+        # Pipelines fill much larger datagrams than over UDP.
+        with cl.pipeline() as pipe:
+            for i in range(1000):
+                pipe.incr('bar')
+        eq_(b'\n'.join([b'foo.bar:1|c'] * 682), sock.recv(1 << 16))
+        eq_(b'\n'.join([b'foo.bar:1|c'] * 318), sock.recv(1 << 16))
+        eq_(0, cl.dropped)
+        cl.close()
+        eq_(None, cl._sock)
+    finally:
+        _close_unix_dgram_server(sock, path)
+
+
+def test_unix_dgram_drops():
+    """Sends never block; what the server can't take is dropped."""
+    sock, path = _unix_dgram_server()
+    try:
+        cl = UnixDatagramStatsClient(path)
+        sent = 0
+        while not cl.dropped:
+            cl.incr('foo')
+            sent += 1
+        eq_(1, cl.dropped)
+
+        with cl.pipeline() as pipe:
+            pipe.incr('foo')
+        eq_(2, cl.dropped)
+
+        received = 0
+        sock.setblocking(False)
+        try:
+            while sock.recv(1 << 16):
+                received += 1
+        except BlockingIOError:
+            pass
+        eq_(sent - 1, received)
+    finally:
+        _close_unix_dgram_server(sock, path)
+
+
+def test_unix_dgram_not_listening():
+    """Stats are dropped until the server listens."""
+    path = os.path.join(tempfile.mkdtemp(), 'statsd.sock')
+    cl = UnixDatagramStatsClient(path)
+    cl.incr('foo')
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('bar')
+    eq_(2, cl.dropped)
+    eq_(None, cl._sock)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.settimeout(1)
+    try:
+        cl.incr('foo')
+        eq_(b'foo:1|c', sock.recv(1 << 16))
+    finally:
+        _close_unix_dgram_server(sock, path)
+
+    # The server went away.
+    cl.incr('foo')
+    eq_(3, cl.dropped)
+    eq_(None, cl._sock)
+
+
+def test_server_unix_dgram():
+    path = os.path.join(tempfile.mkdtemp(), 'statsd.sock')
+    with StatsServer(unix_dgram=path) as server:
+        cl = UnixDatagramStatsClient(server.unix_dgram_path)
+        cl.incr_many({'foo': 1, 'bar': 2})
+        assert server.wait(lines=2)
+        eq_({'foo': 1, 'bar': 2}, server.flush()['counters'])
+    assert not os.path.exists(path)
+    os.rmdir(os.path.dirname(path))
+
+
+@mock.patch.object(socket, 'socket')
+def test_udp_connected(mock_socket):
+    """Connected clients send() instead of sendto()."""
+    cl = StatsClient(connected=True, sndbuf=1 << 20, blocking=False)
+    sock = cl._sock
+    sock.connect.assert_called_once_with(ADDR)
+    sock.setsockopt.assert_called_once_with(
+        socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    sock.setblocking.assert_called_once_with(False)
+
+    cl.incr('foo')
+    sock.send.assert_called_once_with(b'foo:1|c')
+    eq_(0, sock.sendto.call_count)
+
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('bar')
+    eq_(b'foo:1|c\nbar:1|c', bytes(sock.send.call_args[0][0]))
+
+    cl._use(socket.AF_INET, ('10.0.0.2', 8125))
+    sock.connect.assert_called_with(('10.0.0.2', 8125))
+
+
+def test_udp_errors():
+    """Failed sends are counted by errno."""
+    cl = _udp_client()
+    cl._sock.sendto.side_effect = OSError(errno.ENOBUFS, 'No buffer space')
+    cl.incr('foo')
+    cl.incr('foo')
+    cl._sock.sendto.side_effect = OSError(errno.EAGAIN, 'Try again')
+    cl.incr('foo')
+    cl._sock.sendto.side_effect = RuntimeError
+    cl.incr('foo')
+    eq_(4, cl.dropped)
+    eq_({errno.ENOBUFS: 2, errno.EAGAIN: 1, None: 1}, dict(cl.errors))
+
+    cl._sock.sendto.side_effect = [None, OSError(errno.EAGAIN, 'Try again')]
+    pipe = cl.pipeline()
+    pipe.incr('x' * 500)
+    pipe.incr('y' * 500)
+    eq_(1, pipe.send())
+    eq_(5, cl.dropped)
+    eq_(2, cl.errors[errno.EAGAIN])
+
+
+@mock.patch.object(socket, 'socket')
+@mock.patch.object(socket, 'getaddrinfo')
+def test_udp_buffer_errors_no_failover(mock_getaddrinfo, mock_socket):
+    """A full send buffer isn't a reason to use another address."""
+    mock_getaddrinfo.return_value = _addrinfo(('10.0.0.1', 8125),
+                                              ('10.0.0.2', 8125))
+    cl = StatsClient()
+    cl._sock.sendto.side_effect = OSError(errno.ENOBUFS, 'No buffer space')
+    cl.incr('foo')
+    eq_(('10.0.0.1', 8125), cl._addr)
+    cl._sock.sendto.side_effect = OSError(errno.ECONNREFUSED, 'Refused')
+    cl.incr('foo')
+    eq_(('10.0.0.2', 8125), cl._addr)
+
+
+def test_udp_connection_refused():
+    """Connected clients find out when nothing is listening."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    cl = StatsClient('127.0.0.1', port, connected=True)
+    sock.close()
+    for _ in range(100):
+        cl.incr('foo')
+        if cl.errors[errno.ECONNREFUSED]:
+            break
+    cl.close()
+    if not cl.errors[errno.ECONNREFUSED]:
+        raise SkipTest('ICMP port unreachable was not reported')
+
+
+def _telemetry(cl):
+    return {name: value for name, value in cl.stats().items()
+            if name not in ('flush_time', 'client')}
+
+
+def test_stats_disabled():
+    """Without telemetry, stats() only has what clients always count."""
+    eq_({'dropped': 0, 'errors': {}}, _udp_client().stats())
+    cl = _buffered_client()
+    eq_({'dropped': 0, 'client': {'dropped': 0, 'errors': {}}}, cl.stats())
+
+
+@mock.patch.object(sampling, 'random', return_value=0.9)
+def test_stats_udp(mock_random):
+    cl = _udp_client()
+    cl.enable_telemetry()
+    cl.incr('foo')
+    cl.incr('foo', rate=0.5)
+    cl.counter('bar').incr()
+    cl.timer_handle('bar', rate=0.5).timing(1)
+    cl.timing_many('baz', [1, 2, 3, 4], rate=0.5)
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.incr('foo')
+    cl._sock.sendto.side_effect = OSError(errno.ENOBUFS, 'No buffer space')
+    cl.incr('foo')
+    eq_({'dropped': 1, 'errors': {errno.ENOBUFS: 1}, 'formatted': 5,
+         'sampled': 6, 'packets': 3, 'bytes': 29, 'connects': 0,
+         'flushes': 0}, _telemetry(cl))
+
+
+@mock.patch.object(socket, 'socket')
+def test_stats_stream(mock_socket):
+    mock_socket.side_effect = lambda *args: mock.Mock()
+    cl = TCPStatsClient(reconnect=True, buffer_size=1000)
+    cl.enable_telemetry()
+    cl.incr('foo')
+    cl.flush()
+    cl._sock.sendall.side_effect = BrokenPipeError(errno.EPIPE, 'Broken')
+    cl.incr('foo')
+    cl.flush()
+    stats = cl.stats()
+    eq_({'dropped': 0, 'errors': {errno.EPIPE: 1}, 'formatted': 2,
+         'sampled': 0, 'packets': 2, 'bytes': 16, 'connects': 2,
+         'flushes': 2}, _telemetry(cl))
+    assert stats['flush_time'] >= 0
+
+
+def test_stats_buffered():
+    """Wrapping clients count their own stats, and the wrapped client's."""
+    cl = _buffered_client()
+    cl.enable_telemetry()
+    cl.incr('foo')
+    cl.incr('foo')
+    cl.timing('bar', 1)
+    cl.flush()
+    stats = cl.stats()
+    eq_({'dropped': 0, 'formatted': 2, 'sampled': 0, 'packets': 0,
+         'bytes': 0, 'connects': 0, 'flushes': 1}, _telemetry(cl))
+    eq_(1, stats['client']['packets'])
+    eq_(len(b'foo:2|c\nbar:1.000000|ms'), stats['client']['bytes'])
+
+
+def test_stats_lazy():
+    cl = LazyClient(_udp_client)
+    cl.enable_telemetry()
+    cl.incr('foo')
+    eq_(1, cl.stats()['formatted'])
+
+
+def test_telemetry_report():
+    """Reports send what changed since the last one."""
+    cl = _udp_client()
+    cl.enable_telemetry()
+    last = {}
+    cl.incr('foo')
+    cl._telemetry.flushes = 2
+    cl._telemetry.flush_time = 0.5
+    telemetry.report(cl, 'statsd.client', last)
+    eq_(b'statsd.client.formatted:1|c\nstatsd.client.packets:1|c\n'
+        b'statsd.client.bytes:7|c\nstatsd.client.flushes:2|c\n'
+        b'statsd.client.flush:250.000000|ms',
+        bytes(cl._sock.sendto.call_args[0][0]))
+
+    cl._sock.sendto.side_effect = OSError(errno.ECONNREFUSED, 'Refused')
+    cl.incr('foo')
+    cl._sock.sendto.side_effect = None
+    telemetry.report(cl, 'statsd.client', last)
+    # The first report was formatted and sent, too.
+    eq_(b'statsd.client.dropped:1|c\n'
+        b'statsd.client.errors.ECONNREFUSED:1|c\n'
+        b'statsd.client.formatted:6|c\nstatsd.client.packets:1|c\n'
+        b'statsd.client.bytes:137|c',
+        bytes(cl._sock.sendto.call_args[0][0]))
+
+
+def test_telemetry_interval():
+    """Clients report every `interval` seconds from a background thread."""
+    cl = _udp_client()
+    cl.enable_telemetry(interval=0.01, prefix='self')
+    cl.incr('foo')
+    for _ in range(500):
+        if cl._sock.sendto.call_count > 1:
+            break
+        threading.Event().wait(0.01)
+    sent = bytes(cl._sock.sendto.call_args_list[1][0][0])
+    assert sent.startswith(b'self.formatted:1|c\n'), sent
+    del telemetry._reporter._clients[cl]
+
+
+def test_profiler_sampling():
+    """Only every `every`-th call is timed, and results are scaled up."""
+    cl = _udp_client()
+    profiler = Profiler(every=3)
+    cl.set_profiler(profiler)
+    for _ in range(7):
+        cl.incr('foo')
+    cl.timing('bar', 1)
+    eq_(8, cl._sock.sendto.call_count)
+    _sock_check(cl._sock, 8, 'udp', 'bar:1.000000|ms')
+    eq_(['foo'], [r[0] for r in profiler.results()])
+    stat, calls, fmt, send = profiler.results()[0]
+    eq_(6, calls)
+    assert fmt > 0 and send > 0, (fmt, send)
+    assert profiler.report().splitlines()[1].startswith('foo ')
+
+    with assert_raises(ValueError):
+        Profiler(every=0)
+
+
+def test_profiler_pipeline():
+    """Pipeline sends are recorded, split into packing and sending."""
+    cl = _udp_client()
+    profiler = Profiler(every=1)
+    cl.set_profiler(profiler)
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+        pipe.gauge('bar', 2)
+    _sock_check(cl._sock, 1, 'udp', 'foo:1|c\nbar:2|g')
+    results = {r[0]: r for r in profiler.results()}
+    eq_({'foo', 'bar', profiling.PIPELINE}, set(results))
+    assert results[profiling.PIPELINE][3] > 0
+
+    cl = _tcp_client()
+    cl.set_profiler(profiler)
+    profiler.clear()
+    with cl.pipeline() as pipe:
+        pipe.incr('foo')
+    _sock_check(cl._sock, 1, 'tcp', 'foo:1|c')
+    # Stream pipelines are sent in one piece.
+    results = {r[0]: r for r in profiler.results()}
+    eq_(0, results[profiling.PIPELINE][2])
+
+
+def test_profiler_handles():
+    """Stats sent through handles are profiled by name."""
+    cl = _udp_client(prefix='pre')
+    counter = cl.counter('foo')
+    profiler = Profiler(every=1)
+    cl.set_profiler(profiler)
+    counter.incr()
+    cl.timer_handle('bar').timing(5)
+    cl.gauge_handle('baz').gauge(-1)
+    # The negative gauge is sent in a pipeline.
+    eq_({'foo', 'bar', 'baz', profiling.PIPELINE},
+        {r[0] for r in profiler.results()})
+    _sock_check(cl._sock, 3, 'udp', 'pre.baz:0|g\npre.baz:-1|g')
+
+    cl.set_profiler(None)
+    assert cl._handle_send is None
+    profiler.clear()
+    counter.incr()
+    _sock_check(cl._sock, 4, 'udp', 'pre.foo:1|c')
+    eq_([], profiler.results())
+
+
+def test_profiler_disable():
+    """set_profiler(None) puts the original methods back."""
+    cl = _buffered_client()
+    profiler = Profiler(every=1)
+    cl.set_profiler(profiler)
+    assert cl._client._profiler is profiler
+    cl.set_profiler(None)
+    assert cl._profiler is None and cl._client._profiler is None
+    assert '_send_stat' not in vars(cl)
+    assert '_send_stat' not in vars(cl._client)
+    cl.incr('foo')
+    cl.flush()
+    eq_([], profiler.results())
+
+
+def test_profiler_lazy():
+    cl = LazyClient(_udp_client)
+    profiler = Profiler(every=1)
+    cl.set_profiler(profiler)
+    cl.incr('foo')
+    eq_(['foo'], [r[0] for r in profiler.results()])
+
+
+def test_profiler_hook():
+    """Any object with sampled() and record() can be used."""
+    calls = []
+
+    class Hook:
+        def sampled(self):
+            return True
+
+        def record(self, stat, format_ns, send_ns):
+            calls.append(stat)
+
+    cl = _udp_client()
+    cl.set_profiler(Hook())
+    cl.incr('foo')
+    cl.set('bar', 1)
+    eq_(['foo', 'bar'], calls)